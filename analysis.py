@@ -3,49 +3,370 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from collections import Counter
 import os
+import argparse
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-def analyze_listings(listings_file):
+from combine import find_listing_files, open_listing_file
+from listing_store import MISSING, open_listing_store
+
+# Fields counted in the data completeness report
+KEY_FIELDS = ['brand', 'item_name', 'color', 'product_type', 'main_image_id']
+
+# Counter attributes of ListingAggregate
+COUNTER_FIELDS = ['type_counts', 'brand_counts', 'country_counts', 'marketplace_counts', 'language_counts']
+
+class ListingAggregate:
     """
-    Analyze combined listings file and extract key statistics
+    Mergeable partial statistics for a slice of the listings
     
-    Args:
-        listings_file: Path to combined listings JSON file
+    Each shard (or byte range of a shard) is folded into its own aggregate
+    in one streaming pass; merging aggregates in shard order gives the
+    same counters, including tie order, as one pass over the whole file.
     """
-    print(f"Analyzing listings file: {listings_file}")
     
-    # Load and parse all products
-    products = []
-    with open(listings_file, 'r', encoding='utf-8') as f:
+    def __init__(self):
+        self.total_products = 0
+        self.type_counts = Counter()
+        self.brand_counts = Counter()
+        self.country_counts = Counter()
+        self.marketplace_counts = Counter()
+        self.field_presence = {field: 0 for field in KEY_FIELDS}
+        self.language_counts = Counter()
+        self.has_main_image = 0
+        self.has_other_images = 0
+        self.total_images = 0
+    
+    def add(self, product):
+        """Fold one parsed product into the aggregate"""
+        self.total_products += 1
+        
+        # 1. Product Type Distribution
+        if 'product_type' in product and product['product_type']:
+            self.type_counts[product['product_type'][0]['value']] += 1
+        
+        # 2. Brand Analysis
+        if 'brand' in product and product['brand']:
+            self.brand_counts[product['brand'][0].get('value', 'Unknown')] += 1
+        
+        # 3. Country/Marketplace Analysis
+        if 'country' in product:
+            self.country_counts[product['country']] += 1
+        if 'marketplace' in product:
+            self.marketplace_counts[product['marketplace']] += 1
+        
+        # 4. Data Completeness
+        for field in KEY_FIELDS:
+            if field in product and product[field]:
+                self.field_presence[field] += 1
+        
+        # 5. Language Analysis (brand then item_name entries)
+        for field in ('brand', 'item_name'):
+            if field in product and product[field]:
+                for entry in product[field]:
+                    if 'language_tag' in entry:
+                        self.language_counts[entry['language_tag']] += 1
+        
+        # 6. Image Analysis
+        if 'main_image_id' in product and product['main_image_id']:
+            self.has_main_image += 1
+            self.total_images += 1
+        if 'other_image_id' in product and product['other_image_id']:
+            self.has_other_images += 1
+            self.total_images += len(product['other_image_id'])
+    
+    def merge(self, other):
+        """Merge another aggregate into this one and return self"""
+        self.total_products += other.total_products
+        self.type_counts.update(other.type_counts)
+        self.brand_counts.update(other.brand_counts)
+        self.country_counts.update(other.country_counts)
+        self.marketplace_counts.update(other.marketplace_counts)
+        for field in KEY_FIELDS:
+            self.field_presence[field] += other.field_presence.get(field, 0)
+        self.language_counts.update(other.language_counts)
+        self.has_main_image += other.has_main_image
+        self.has_other_images += other.has_other_images
+        self.total_images += other.total_images
+        return self
+    
+    def to_dict(self):
+        """JSON-serialisable form (counters as ordered key/count pairs)"""
+        data = {name: value for name, value in vars(self).items()}
+        for name in COUNTER_FIELDS:
+            data[name] = [[key, count] for key, count in data[name].items()]
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Inverse of to_dict"""
+        aggregate = cls()
+        for name, value in data.items():
+            if name in COUNTER_FIELDS:
+                value = Counter({key: count for key, count in value})
+            setattr(aggregate, name, value)
+        return aggregate
+
+# Per-shard aggregate cache used by analyze_listings
+CACHE_DIR = os.path.join('analysis_results', 'cache')
+CACHE_VERSION = 1
+
+# Byte range handled by one worker when splitting a large uncompressed file
+CHUNK_BYTES = 64 * 1024 * 1024
+
+def aggregate_listing_range(file_path, start=0, end=None):
+    """
+    Aggregate the listings whose lines start within [start, end)
+    
+    Args:
+        file_path: Listings file or shard (.gz shards are read whole)
+        start: Byte offset where the range begins
+        end: Byte offset where the range ends (None for end of file)
+    
+    Returns:
+        ListingAggregate: Partial statistics for the range
+    """
+    aggregate = ListingAggregate()
+    with open_listing_file(file_path, 'rb') as f:
+        position = 0
+        if start > 0:
+            # Skip the line straddling the range start; the previous range owns it
+            f.seek(start - 1)
+            position = start - 1 + len(f.readline())
         for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
             try:
-                product = json.loads(line.strip())
-                products.append(product)
-            except json.JSONDecodeError:
+                product = json.loads(line)
+            except ValueError:
                 continue
+            if isinstance(product, dict):
+                aggregate.add(product)
+    return aggregate
+
+def _aggregate_unit(unit):
+    return aggregate_listing_range(*unit)
+
+def plan_work_units(shard_paths, chunk_bytes=CHUNK_BYTES):
+    """
+    Split shards into (path, start, end) work units in listing order
+    
+    Args:
+        shard_paths: Listing files in the order their products should count
+        chunk_bytes: Maximum byte range per unit for uncompressed files
+    
+    Returns:
+        list: Work unit tuples
+    """
+    units = []
+    for path in shard_paths:
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or size <= chunk_bytes:
+            units.append((path, 0, None))
+            continue
+        for start in range(0, size, chunk_bytes):
+            units.append((path, start, min(start + chunk_bytes, size)))
+    return units
+
+def _run_units(units, workers=None):
+    """Aggregate work units, in parallel when there is more than one"""
+    if len(units) <= 1 or workers == 1:
+        return [_aggregate_unit(unit) for unit in units]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map yields in submission order, so merges stay deterministic
+        return list(executor.map(_aggregate_unit, units))
+
+def aggregate_listings(shard_paths, workers=None):
+    """
+    Aggregate statistics over listing shards with a process pool
+    
+    Args:
+        shard_paths: Listing files, in order
+        workers: Number of worker processes (defaults to CPU count)
+    
+    Returns:
+        ListingAggregate: Merged statistics
+    """
+    total = ListingAggregate()
+    for partial in _run_units(plan_work_units(shard_paths), workers):
+        total.merge(partial)
+    return total
+
+def hash_file(file_path, chunk_size=4 * 1024 * 1024):
+    """BLAKE2b hex digest of a file's raw bytes"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _shard_stat(file_path):
+    stat = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+def _cache_file(cache_dir, file_path):
+    key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{key}.json")
+
+def _load_cached_aggregate(cache_dir, file_path, stat):
+    """
+    Return the cached aggregate for a shard if the shard is unchanged
+    
+    A matching path, size and mtime is trusted as-is. If only the stat
+    changed (e.g. the shard was re-downloaded) the content hash decides,
+    and a matching hash refreshes the cached stat.
+    
+    Returns:
+        tuple: (ListingAggregate or None, content hash or None)
+    """
+    cache_file = _cache_file(cache_dir, file_path)
+    if not os.path.exists(cache_file):
+        return None, None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if entry.get('version') != CACHE_VERSION:
+        return None, None
+    
+    cached = entry['fingerprint']
+    if all(cached.get(k) == stat[k] for k in ('path', 'size', 'mtime_ns')):
+        return ListingAggregate.from_dict(entry['aggregate']), cached['hash']
     
-    total_products = len(products)
+    content_hash = hash_file(file_path) if cached.get('size') == stat['size'] else None
+    if content_hash is not None and content_hash == cached.get('hash'):
+        _save_cached_aggregate(cache_dir, file_path, dict(stat, hash=content_hash), entry['aggregate'])
+        return ListingAggregate.from_dict(entry['aggregate']), content_hash
+    return None, content_hash
+
+def _save_cached_aggregate(cache_dir, file_path, fingerprint, aggregate_dict):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = _cache_file(cache_dir, file_path)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'fingerprint': fingerprint, 'aggregate': aggregate_dict}, f)
+    os.replace(tmp_file, cache_file)
+
+def aggregate_listings_cached(shard_paths, workers=None, cache_dir=CACHE_DIR, force=False):
+    """
+    Aggregate statistics, reparsing only shards that changed since the last run
+    
+    Per-shard aggregates are cached in cache_dir keyed by shard path, size,
+    mtime and content hash. Unchanged shards are loaded from the cache and
+    only the remaining shards are parsed (in parallel) before the merge.
+    A changed shard is hashed before it is parsed, and its aggregate is only
+    cached if the shard's size and mtime are the same after parsing.
+    
+    Args:
+        shard_paths: Listing files, in order
+        workers: Number of worker processes (defaults to CPU count)
+        cache_dir: Directory holding the per-shard cache entries
+        force: Ignore the cache and recompute every shard
+    
+    Returns:
+        ListingAggregate: Merged statistics
+    """
+    partials = {}
+    stale = []
+    for path in shard_paths:
+        stat = _shard_stat(path)
+        aggregate, content_hash = (None, None) if force else _load_cached_aggregate(cache_dir, path, stat)
+        if aggregate is not None:
+            partials[path] = aggregate
+        else:
+            # Hashed before parsing, so the fingerprint never describes newer bytes
+            fingerprint = dict(stat, hash=content_hash or hash_file(path))
+            stale.append((path, fingerprint))
+    
+    print(f"Reusing cached aggregates for {len(partials)} shards, parsing {len(stale)}")
+    
+    units = plan_work_units([path for path, _ in stale])
+    results = _run_units(units, workers)
+    for (path, _, _), partial in zip(units, results):
+        partials.setdefault(path, ListingAggregate()).merge(partial)
+    
+    for path, fingerprint in stale:
+        partial = partials.setdefault(path, ListingAggregate())
+        stat = _shard_stat(path)
+        if any(stat[k] != fingerprint[k] for k in ('size', 'mtime_ns')):
+            print(f"Warning: {path} changed while it was parsed, not caching its aggregate")
+            continue
+        _save_cached_aggregate(cache_dir, path, fingerprint, partial.to_dict())
+    
+    total = ListingAggregate()
+    for path in shard_paths:
+        total.merge(partials[path])
+    return total
+
+def resolve_listing_shards(listings_file):
+    """A combined file is a single shard; a directory holds listings_* shards"""
+    if os.path.isdir(listings_file):
+        return find_listing_files(listings_file)
+    return [listings_file]
+
+def _counter_from_codes(store, codes):
+    """Counter of decoded strings, keyed in order of first occurrence"""
+    codes = np.asarray(codes)
+    codes = codes[codes != MISSING]
+    if not len(codes):
+        return Counter()
+    unique, first_index, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first_index, kind='stable')
+    return Counter({store.string(unique[i]): int(counts[i]) for i in order})
+
+def _statistics_from_store(store):
+    """
+    Compute the listing statistics from a columnar listing store
+    
+    Args:
+        store: ListingStore built from the listings file
+    
+    Returns:
+        ListingAggregate: Statistics for every stored product
+    """
+    other_image_count = np.asarray(store.other_image_count)
+    has_main = store.has('main_image_id')
+    has_other = store.has('other_image_id')
+    
+    aggregate = ListingAggregate()
+    aggregate.total_products = len(store)
+    aggregate.type_counts = _counter_from_codes(store, store.column('product_type')[store.has('product_type')])
+    aggregate.brand_counts = _counter_from_codes(store, store.column('brand')[store.has('brand')])
+    aggregate.country_counts = _counter_from_codes(store, store.column('country'))
+    aggregate.marketplace_counts = _counter_from_codes(store, store.column('marketplace'))
+    aggregate.field_presence = {field: int(store.has(field).sum()) for field in KEY_FIELDS}
+    aggregate.language_counts = _counter_from_codes(store, store.language_tag_codes)
+    aggregate.has_main_image = int(has_main.sum())
+    aggregate.has_other_images = int(has_other.sum())
+    aggregate.total_images = int(has_main.sum() + other_image_count[has_other].sum())
+    return aggregate
+
+def _report_statistics(stats):
+    """
+    Print the listing statistics and save the CSV and plots
+    
+    Args:
+        stats: ListingAggregate with the merged statistics
+    """
+    total_products = stats.total_products
     print(f"\nTotal products: {total_products}")
     
     # 1. Product Type Distribution
-    product_types = []
-    for product in products:
-        if 'product_type' in product and product['product_type']:
-            product_types.append(product['product_type'][0]['value'])
-    
-    type_counts = Counter(product_types)
+    type_counts = stats.type_counts
     print(f"\nProduct Type Distribution (Top 10):")
     for product_type, count in type_counts.most_common(10):
         print(f"  {product_type}: {count} ({count/total_products:.1%})")
     
     # 2. Brand Analysis
-    brands = []
-    for product in products:
-        if 'brand' in product and product['brand']:
-            brand_value = product['brand'][0].get('value', 'Unknown')
-            brands.append(brand_value)
-    
-    unique_brands = len(set(brands))
-    top_brands = Counter(brands).most_common(10)
+    unique_brands = len(stats.brand_counts)
+    top_brands = stats.brand_counts.most_common(10)
     
     print(f"\nBrand Analysis:")
     print(f"  Total unique brands: {unique_brands}")
@@ -54,17 +375,8 @@ def analyze_listings(listings_file):
         print(f"    {brand}: {count} ({count/total_products:.1%})")
     
     # 3. Country/Marketplace Analysis
-    countries = []
-    marketplaces = []
-    
-    for product in products:
-        if 'country' in product:
-            countries.append(product['country'])
-        if 'marketplace' in product:
-            marketplaces.append(product['marketplace'])
-    
-    country_counts = Counter(countries)
-    marketplace_counts = Counter(marketplaces)
+    country_counts = stats.country_counts
+    marketplace_counts = stats.marketplace_counts
     
     print(f"\nCountry Distribution:")
     for country, count in country_counts.most_common():
@@ -75,52 +387,19 @@ def analyze_listings(listings_file):
         print(f"  {marketplace}: {count} ({count/total_products:.1%})")
     
     # 4. Data Completeness
-    key_fields = ['brand', 'item_name', 'color', 'product_type', 'main_image_id']
-    field_presence = {field: 0 for field in key_fields}
-    
-    for product in products:
-        for field in key_fields:
-            if field in product and product[field]:
-                field_presence[field] += 1
-    
     print(f"\nData Completeness:")
-    for field, count in field_presence.items():
+    for field, count in stats.field_presence.items():
         print(f"  {field}: {count} ({count/total_products:.1%})")
     
     # 5. Language Analysis
-    languages = []
-    for product in products:
-        # Check brand language
-        if 'brand' in product and product['brand']:
-            for brand_entry in product['brand']:
-                if 'language_tag' in brand_entry:
-                    languages.append(brand_entry['language_tag'])
-        
-        # Check item_name language
-        if 'item_name' in product and product['item_name']:
-            for name_entry in product['item_name']:
-                if 'language_tag' in name_entry:
-                    languages.append(name_entry['language_tag'])
-    
-    language_counts = Counter(languages)
     print(f"\nLanguage Distribution (Top 10):")
-    for language, count in language_counts.most_common(10):
+    for language, count in stats.language_counts.most_common(10):
         print(f"  {language}: {count}")
     
     # 6. Image Analysis
-    has_main_image = sum(1 for p in products if 'main_image_id' in p and p['main_image_id'])
-    has_other_images = sum(1 for p in products if 'other_image_id' in p and p['other_image_id'])
-    
-    images_per_product = []
-    for product in products:
-        count = 0
-        if 'main_image_id' in product and product['main_image_id']:
-            count += 1
-        if 'other_image_id' in product and product['other_image_id']:
-            count += len(product['other_image_id'])
-        images_per_product.append(count)
-    
-    avg_images = sum(images_per_product) / total_products
+    has_main_image = stats.has_main_image
+    has_other_images = stats.has_other_images
+    avg_images = stats.total_images / total_products
     
     print(f"\nImage Analysis:")
     print(f"  Products with main image: {has_main_image} ({has_main_image/total_products:.1%})")
@@ -170,9 +449,44 @@ def analyze_listings(listings_file):
     
     print(f"\nAnalysis results saved to 'analysis_results' directory")
 
+def analyze_listings(listings_file, use_store=False, workers=None, cache_dir=CACHE_DIR, force=False):
+    """
+    Analyze combined listings file and extract key statistics
+    
+    Args:
+        listings_file: Path to combined listings JSON file, or a directory of listings_* shards
+        use_store: Read from the columnar listing store instead of parsing JSON
+        workers: Number of worker processes for JSON parsing
+        cache_dir: Per-shard aggregate cache (None disables caching)
+        force: Recompute every shard even if its cached aggregate is valid
+    """
+    print(f"Analyzing listings file: {listings_file}")
+    
+    if use_store:
+        with open_listing_store(listings_file, rebuild=force) as store:
+            stats = _statistics_from_store(store)
+    elif cache_dir:
+        # Only shards that changed since the last run are parsed again
+        stats = aggregate_listings_cached(resolve_listing_shards(listings_file), workers=workers,
+                                          cache_dir=cache_dir, force=force)
+    else:
+        # One streaming pass per shard, merged in shard order
+        stats = aggregate_listings(resolve_listing_shards(listings_file), workers=workers)
+    
+    _report_statistics(stats)
+
 if __name__ == "__main__":
-    # Path to the combined listings file
-    listings_file = "combined_listings.json"
+    parser = argparse.ArgumentParser(description="Analyze ABO listings")
+    parser.add_argument('listings_file', nargs='?', default="combined_listings.json",
+                        help="Combined listings file or directory of listings_* shards")
+    parser.add_argument('--no-store', action='store_true',
+                        help="Parse the JSON (with per-shard caching) instead of using the columnar listing store")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for parsing")
+    parser.add_argument('--force', action='store_true', help="Ignore cached shard aggregates and recompute")
+    args = parser.parse_args()
+    
+    # The store is built from a combined file; a directory of shards is always parsed
+    use_store = not args.no_store and not os.path.isdir(args.listings_file)
     
     # Analyze the listings
-    analyze_listings(listings_file)
\ No newline at end of file
+    analyze_listings(args.listings_file, use_store=use_store, workers=args.workers, force=args.force)
\ No newline at end of file
@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+
+# Bump when the on-disk layout changes
+LEDGER_VERSION = 1
+
+PENDING = 'pending'
+DONE = 'done'
+
+def default_ledger_dir(batches_dir):
+    """Ledger location inside a batches directory"""
+    return os.path.join(batches_dir, 'assigned_images')
+
+def _atomic_save(path, array):
+    tmp_path = f"{path}.tmp{os.getpid()}.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class AssignmentLedger:
+    """
+    On-disk record of which image_ids have been assigned to which batch
+
+    Each batch is one sorted array of image_ids (batch<N>.npy), and
+    ledger.json lists the batches with their status and the tool that
+    reserved them. A run first reserves its batches (status 'pending')
+    before any image is copied, and commits them ('done') once the batch
+    files are written. Both steps replace ledger.json atomically, so a crash
+    leaves either the old or the new state. Pending batches still count as
+    assigned, and a rerun of the same tool can pick the same assignments
+    back up instead of sampling new ones, so images are never handed out
+    twice.
+
+    Membership checks binary-search one merged, sorted array of every
+    assigned image_id, so excluding earlier batches never re-reads their
+    metadata files.
+    """
+
+    def __init__(self, ledger_dir):
+        self.ledger_dir = ledger_dir
+        self.meta_path = os.path.join(ledger_dir, 'ledger.json')
+        os.makedirs(ledger_dir, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if self.meta.get('version') != LEDGER_VERSION:
+                raise ValueError(f"Unsupported ledger version {self.meta.get('version')} in {self.meta_path}")
+        else:
+            self.meta = {'version': LEDGER_VERSION, 'batches': {}}
+        self._arrays = {}
+        self._merged = None
+
+    def _save_meta(self):
+        tmp_path = f"{self.meta_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _batch_path(self, batch_num):
+        return os.path.join(self.ledger_dir, f"batch{batch_num}.npy")
+
+    @property
+    def batches(self):
+        """{batch number: status} for every recorded batch"""
+        return {int(num): info['status'] for num, info in self.meta['batches'].items()}
+
+    def owner(self, batch_num):
+        """Tool that reserved a batch (None for ledgers written before owners were recorded)"""
+        return self.meta['batches'][str(batch_num)].get('owner')
+
+    def pending_batches(self, owner=None):
+        """
+        Batch numbers reserved by a run that hasn't finished
+
+        Args:
+            owner: Only return batches reserved by this tool (default: any)
+
+        Returns:
+            list: Sorted batch numbers
+        """
+        return sorted(num for num, status in self.batches.items()
+                      if status == PENDING and (owner is None or self.owner(num) == owner))
+
+    def next_batch(self):
+        """First batch number after every recorded batch"""
+        return max(self.batches, default=0) + 1
+
+    def batch_ids(self, batch_num):
+        """Sorted image_ids assigned to a batch (as bytes)"""
+        if batch_num not in self._arrays:
+            self._arrays[batch_num] = np.load(self._batch_path(batch_num), mmap_mode='r')
+        return self._arrays[batch_num]
+
+    def __len__(self):
+        return sum(info['count'] for info in self.meta['batches'].values())
+
+    def assigned_ids(self):
+        """Sorted image_ids of every recorded batch, merged once and cached"""
+        if self._merged is None:
+            arrays = [self.batch_ids(batch_num) for batch_num in sorted(self.batches)]
+            arrays = [ids for ids in arrays if len(ids)]
+            self._merged = np.sort(np.concatenate(arrays)) if arrays else np.zeros(0, dtype='S1')
+        return self._merged
+
+    def contains(self, image_ids):
+        """
+        Which image_ids are already assigned to some batch
+
+        Args:
+            image_ids: Sequence of image_id strings
+
+        Returns:
+            np.ndarray: Boolean mask aligned with image_ids
+        """
+        keys = np.asarray(image_ids, dtype='S')
+        ids = self.assigned_ids()
+        if len(ids) == 0 or len(keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        pos = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+        return ids[pos] == keys
+
+    def reserve(self, batch_images, overwrite=False, owner=None):
+        """
+        Record the images a run is about to place, before copying them
+
+        Args:
+            batch_images: {batch number: iterable of image_ids}
+            overwrite: Allow replacing batches that were already committed
+            owner: Name of the tool reserving the batches (e.g. 'new-batches'),
+                so only that tool resumes them after a crash
+
+        Raises:
+            ValueError: If a batch is already committed (and not overwrite)
+        """
+        batches = self.batches
+        for batch_num in batch_images:
+            if batches.get(batch_num) == DONE and not overwrite:
+                raise ValueError(f"Batch {batch_num} is already recorded in {self.meta_path}")
+
+        # Batch arrays first, then the ledger that points at them
+        for batch_num, image_ids in batch_images.items():
+            ids = np.unique(np.asarray(list(image_ids), dtype='S'))
+            self._arrays.pop(batch_num, None)
+            _atomic_save(self._batch_path(batch_num), ids)
+            self.meta['batches'][str(batch_num)] = {'status': PENDING, 'count': int(len(ids)), 'owner': owner}
+        self._merged = None
+        self._save_meta()
+
+    def commit(self, batch_nums):
+        """Mark reserved batches as complete"""
+        for batch_num in batch_nums:
+            self.meta['batches'][str(batch_num)]['status'] = DONE
+        self._save_meta()
+
+    def drop(self, batch_nums):
+        """Forget batches (their images become available again)"""
+        batch_nums = list(batch_nums)
+        for batch_num in batch_nums:
+            self.meta['batches'].pop(str(batch_num), None)
+            self._arrays.pop(batch_num, None)
+        self._merged = None
+        # Ledger first, so it never points at a missing array
+        self._save_meta()
+        for batch_num in batch_nums:
+            if os.path.exists(self._batch_path(batch_num)):
+                os.remove(self._batch_path(batch_num))
+
+    def record(self, batch_num, image_ids, owner=None):
+        """Reserve and commit a batch in one step (e.g. importing an old batch)"""
+        self.reserve({batch_num: image_ids}, owner=owner)
+        self.commit([batch_num])
@@ -0,0 +1,199 @@
+import json
+import os
+
+import numpy as np
+import torch
+from tqdm.auto import tqdm
+
+def _clean(text):
+    # Same empty-string handling as calculate_bert_score_complete
+    return text if text and text.strip() else " "
+
+class BertScorer:
+    """
+    BERTScore with per-string embedding and per-pair score caches
+
+    Reproduces bert_score.score(cands, refs, model_type=...) (no idf, no
+    baseline rescaling) using the same building blocks as
+    bert_score.utils.bert_cos_score_idf, but:
+
+    - every distinct string is embedded once, however many rows, models or
+      calls it appears in (so baseline and LoRA predictions share the
+      reference embeddings)
+    - every distinct (prediction, reference) pair is scored once
+    - pair scores are appended to a JSON Lines cache file, so a restarted
+      run only scores pairs it hasn't seen
+
+    Usage:
+        scorer = BertScorer("distilroberta-base", cache_file="bertscore_checkpoints/scores.jsonl")
+        baseline_bert_scores = scorer.score(baseline_predictions, ground_truths)
+        lora_bert_scores = scorer.score(lora_predictions, ground_truths)
+    """
+
+    def __init__(self, model_type="distilroberta-base", num_layers=None, device=None, batch_size=64,
+                 cache_file=None):
+        if num_layers is None:
+            from bert_score.utils import model2layers
+
+            num_layers = model2layers[model_type]
+        self.model_type = model_type
+        self.num_layers = num_layers
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.batch_size = batch_size
+        self.cache_file = cache_file
+        self.model_key = f"{model_type}:L{self.num_layers}"
+        self._model = None
+        self._tokenizer = None
+        self._idf_dict = None
+        self._stats = {}
+        self.scores = {}
+        if cache_file and os.path.exists(cache_file):
+            self._load_cache()
+
+    def _load_cache(self):
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn final line from an interrupted run
+                if entry['model'] == self.model_key:
+                    self.scores[(entry['cand'], entry['ref'])] = (entry['P'], entry['R'], entry['F1'])
+        print(f"Loaded {len(self.scores)} cached BERTScore pairs from {self.cache_file}")
+
+    def _load_model(self):
+        if self._model is not None:
+            return
+        from collections import defaultdict
+
+        from bert_score.utils import get_model, get_tokenizer
+
+        self._tokenizer = get_tokenizer(self.model_type)
+        self._model = get_model(self.model_type, self.num_layers)
+        self._model.to(self.device)
+        # bert_score.score's idf=False weights: 1 for every token but [SEP]/[CLS]
+        self._idf_dict = defaultdict(lambda: 1.0)
+        self._idf_dict[self._tokenizer.sep_token_id] = 0
+        self._idf_dict[self._tokenizer.cls_token_id] = 0
+
+    def _embed(self, sentences):
+        """Contextual embeddings (and idf weights) of strings not seen yet"""
+        from bert_score.utils import get_bert_embedding
+
+        todo = sorted({s for s in sentences if s not in self._stats}, key=lambda s: len(s.split(" ")), reverse=True)
+        if not todo:
+            return
+        self._load_model()
+        for start in range(0, len(todo), self.batch_size):
+            batch = todo[start:start + self.batch_size]
+            embs, masks, padded_idf = get_bert_embedding(batch, self._model, self._tokenizer, self._idf_dict,
+                                                         device=self.device)
+            embs, masks, padded_idf = embs.cpu(), masks.cpu(), padded_idf.cpu()
+            for i, sentence in enumerate(batch):
+                length = int(masks[i].sum().item())
+                self._stats[sentence] = (embs[i, :length], padded_idf[i, :length])
+
+    def _padded(self, sentences):
+        from torch.nn.utils.rnn import pad_sequence
+
+        embs, idfs = zip(*(self._stats[s] for s in sentences))
+        lengths = torch.tensor([e.size(0) for e in embs], dtype=torch.long)
+        emb_pad = pad_sequence([e.to(self.device) for e in embs], batch_first=True, padding_value=2.0)
+        idf_pad = pad_sequence([i.to(self.device) for i in idfs], batch_first=True)
+        mask = (torch.arange(int(lengths.max())).expand(len(lengths), -1) < lengths.unsqueeze(1)).to(self.device)
+        return emb_pad, mask, idf_pad
+
+    def _pair_scores(self, batch):
+        """P, R and F1 lists for a batch of (candidate, reference) pairs"""
+        from bert_score.utils import greedy_cos_idf
+
+        P, R, F1 = greedy_cos_idf(*self._padded([ref for _, ref in batch]),
+                                  *self._padded([cand for cand, _ in batch]))
+        return P.cpu().tolist(), R.cpu().tolist(), F1.cpu().tolist()
+
+    def _open_cache(self):
+        # Appending straight after a torn final line would glue the first new record onto it
+        torn = False
+        if os.path.exists(self.cache_file) and os.path.getsize(self.cache_file) > 0:
+            with open(self.cache_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+        cache = open(self.cache_file, 'a', encoding='utf-8')
+        if torn:
+            cache.write('\n')
+        return cache
+
+    def _score_new(self, pairs):
+        self._embed([s for pair in pairs for s in pair])
+        cache = self._open_cache() if self.cache_file else None
+        try:
+            with torch.no_grad():
+                for start in tqdm(range(0, len(pairs), self.batch_size), desc="BERTScore", disable=len(pairs) < 1000):
+                    batch = pairs[start:start + self.batch_size]
+                    for (cand, ref), p, r, f in zip(batch, *self._pair_scores(batch)):
+                        self.scores[(cand, ref)] = (p, r, f)
+                        if cache is not None:
+                            cache.write(json.dumps({'model': self.model_key, 'cand': cand, 'ref': ref,
+                                                    'P': p, 'R': r, 'F1': f}) + '\n')
+                    if cache is not None:
+                        cache.flush()
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def score(self, predictions, references):
+        """
+        Per-row BERTScore, scoring each distinct pair once
+
+        Args:
+            predictions: Candidate strings
+            references: Reference strings (same length)
+
+        Returns:
+            dict: Same keys as calculate_bert_score_complete (precision,
+                recall, f1, *_scores lists, total_processed, expected_samples)
+        """
+        if len(predictions) != len(references):
+            raise ValueError(f"{len(predictions)} predictions but {len(references)} references")
+        rows = [(_clean(p), _clean(r)) for p, r in zip(predictions, references)]
+        new_pairs = list(dict.fromkeys(pair for pair in rows if pair not in self.scores))
+        print(f"BERTScore: {len(rows)} rows, {len(set(rows))} distinct pairs, {len(new_pairs)} to score")
+        if new_pairs:
+            if self.cache_file:
+                os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            self._score_new(new_pairs)
+
+        all_P = [self.scores[pair][0] for pair in rows]
+        all_R = [self.scores[pair][1] for pair in rows]
+        all_F1 = [self.scores[pair][2] for pair in rows]
+        return {
+            'precision': np.mean(all_P),
+            'recall': np.mean(all_R),
+            'f1': np.mean(all_F1),
+            'precision_scores': all_P,
+            'recall_scores': all_R,
+            'f1_scores': all_F1,
+            'total_processed': len(all_F1),
+            'expected_samples': len(rows)
+        }
+
+def add_bertscore_columns(results_df, scorer, variants, reference_column='Ground_Truth'):
+    """
+    Add <variant>_BERTScore_F1 columns to a results table
+
+    Args:
+        results_df: Table with <variant>_Prediction columns (e.g. vqa_results.csv)
+        scorer: BertScorer
+        variants: Variant names (e.g. ['Baseline', 'LoRA'])
+        reference_column: Ground-truth column
+
+    Returns:
+        dict: {variant: scores dict from BertScorer.score}
+    """
+    references = results_df[reference_column].fillna('').astype(str).tolist()
+    scores = {}
+    for variant in variants:
+        predictions = results_df[f'{variant}_Prediction'].fillna('').astype(str).tolist()
+        scores[variant] = scorer.score(predictions, references)
+        results_df[f'{variant}_BERTScore_F1'] = scores[variant]['f1_scores']
+    return scores
@@ -1,6 +1,62 @@
 import os
 import glob
+import gzip
 import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+def find_listing_files(metadata_dir):
+    """
+    Find all listings_* shards in a directory, plain or gzipped
+    
+    Args:
+        metadata_dir: Directory containing listing files
+    
+    Returns:
+        list: Shard paths in sorted order
+    """
+    return sorted(glob.glob(os.path.join(metadata_dir, "listings_*")))
+
+def open_listing_file(file_path, mode='rb'):
+    """
+    Open a listing shard, transparently decompressing .gz shards
+    
+    Args:
+        file_path: Path to the shard
+        mode: File mode ('rb' or 'rt')
+    
+    Returns:
+        File object for the shard
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode, encoding='utf-8') if 't' in mode else gzip.open(file_path, mode)
+    return open(file_path, mode, encoding='utf-8') if 't' in mode else open(file_path, mode)
+
+def _discard_object(pairs):
+    # Objects are only checked for syntax, so never build the dict
+    return None
+
+_VALIDATOR = json.JSONDecoder(object_pairs_hook=_discard_object)
+
+def is_valid_json_line(line):
+    """
+    Check that a raw listing line holds one JSON document
+    
+    Args:
+        line: Line as bytes or str
+    
+    Returns:
+        bool: True if the line parses as JSON
+    """
+    try:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        _VALIDATOR.decode(line)
+        return True
+    except ValueError:
+        return False
 
 def combine_listing_files(metadata_dir, output_file):
     """
@@ -14,8 +70,7 @@ def combine_listing_files(metadata_dir, output_file):
         int: Number of products processed
     """
     # Find all listing files (note: they don't have .json extension in the screenshot)
-    pattern = os.path.join(metadata_dir, "listings_*")
-    listing_files = glob.glob(pattern)
+    listing_files = find_listing_files(metadata_dir)
     print(f"Found {len(listing_files)} listing files")
     
     # Process each file
@@ -26,15 +81,14 @@ def combine_listing_files(metadata_dir, output_file):
             file_count = 0
             
             try:
-                with open(file_path, 'r', encoding='utf-8') as infile:
+                with open_listing_file(file_path, 'rt') as infile:
                     for line in infile:
-                        try:
-                            # Verify it's valid JSON before writing
-                            json.loads(line.strip())
+                        # Verify it's valid JSON before writing
+                        if is_valid_json_line(line):
                             outfile.write(line)
                             processed += 1
                             file_count += 1
-                        except json.JSONDecodeError:
+                        else:
                             print(f"Skipping invalid JSON line in {file_path}")
                 
                 print(f"  Added {file_count} products from {os.path.basename(file_path)}")
@@ -44,6 +98,104 @@ def combine_listing_files(metadata_dir, output_file):
     print(f"Successfully combined {processed} products into {output_file}")
     return processed
 
+def _combine_shard(file_path, part_path):
+    """
+    Validate one shard and write its valid lines to a part file
+    
+    A shard that can't be read (e.g. a truncated .gz) leaves an empty part
+    file and is reported through 'error', so the other shards still combine.
+    
+    Args:
+        file_path: Path to the listing shard
+        part_path: Path to the part file for this shard
+    
+    Returns:
+        dict: Per-shard counts, timing and error (None on success)
+    """
+    start = time.perf_counter()
+    lines = 0
+    invalid = 0
+    bytes_read = 0
+    error = None
+    try:
+        with open_listing_file(file_path, 'rb') as infile, open(part_path, 'wb') as outfile:
+            for line in infile:
+                bytes_read += len(line)
+                if not is_valid_json_line(line):
+                    invalid += 1
+                    continue
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                outfile.write(line)
+                lines += 1
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        lines = 0
+        open(part_path, 'wb').close()
+    return {
+        'file': file_path,
+        'lines': lines,
+        'invalid': invalid,
+        'bytes': bytes_read,
+        'seconds': time.perf_counter() - start,
+        'error': error
+    }
+
+def combine_listing_files_parallel(metadata_dir, output_file, workers=None):
+    """
+    Combine all listings_* files into a single file using a process pool
+    
+    Shards (plain or .gz) are validated in parallel into part files, which
+    are then concatenated in sorted shard order so the output is the same
+    on every run.
+    
+    Args:
+        metadata_dir: Directory containing listing files
+        output_file: Path to output combined file
+        workers: Number of worker processes (defaults to CPU count)
+    
+    Returns:
+        int: Number of products processed
+    """
+    listing_files = find_listing_files(metadata_dir)
+    print(f"Found {len(listing_files)} listing files")
+    
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    parts_dir = tempfile.mkdtemp(prefix='combine_parts_', dir=output_dir)
+    part_paths = [os.path.join(parts_dir, f"{i:05d}.part") for i in range(len(listing_files))]
+    
+    processed = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            stats = list(executor.map(_combine_shard, listing_files, part_paths))
+        
+        failed = 0
+        for stat in stats:
+            if stat['error'] is not None:
+                print(f"Error processing {stat['file']}: {stat['error']}")
+                failed += 1
+                continue
+            seconds = max(stat['seconds'], 1e-9)
+            print(f"  {os.path.basename(stat['file'])}: {stat['lines']} products, "
+                  f"{stat['invalid']} invalid lines, "
+                  f"{stat['lines'] / seconds:,.0f} lines/s, "
+                  f"{stat['bytes'] / seconds / 1e6:,.1f} MB/s")
+            processed += stat['lines']
+        
+        with open(output_file, 'wb') as outfile:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, outfile, 1024 * 1024)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    
+    elapsed = time.perf_counter() - start
+    if failed:
+        print(f"Skipped {failed} unreadable listing files")
+    print(f"Successfully combined {processed} products into {output_file} in {elapsed:.1f}s")
+    return processed
+
 if __name__ == "__main__":
     # Updated path from the screenshot
     metadata_dir = "D:\\VR-Project\\abo-listings\\listings\\metadata\\listings"
@@ -51,5 +203,5 @@ if __name__ == "__main__":
     # Output file
     output_file = "combined_listings.json"
     
-    # Combine listings
-    combine_listing_files(metadata_dir, output_file)
\ No newline at end of file
+    # Combine listings in parallel (combine_listing_files is the serial version)
+    combine_listing_files_parallel(metadata_dir, output_file)
\ No newline at end of file
@@ -1,31 +1,46 @@
-import json
 import pandas as pd
 import os
-import shutil
-import random
 from collections import Counter
-import math
+import numpy as np
 
-def create_diverse_image_batches():
+from assignment_ledger import AssignmentLedger, default_ledger_dir
+from image_store import ImageStore, manifest_path, write_manifest
+from listing_store import open_listing_store
+from materialize import materialize_files
+from partition import image_sizes, partition_balanced
+from sampling import stratified_sample
+
+def create_diverse_image_batches(seed=None, num_batches=4, link_mode="copy", copy_workers=8, image_store_dir=None,
+                                 paths=None):
+    """
+    Sample a diverse set of products and copy their images into K batches
+    
+    Args:
+        seed: Random seed for a reproducible selection
+        num_batches: Number of batches to split the selection into
+        link_mode: How images are placed in batch dirs: "copy", "hardlink" or "reflink"
+        copy_workers: Number of threads materializing images
+        image_store_dir: Content-addressed image store; when set, batches are
+            written as batchN_manifest.jsonl files instead of image copies
+        paths: Optional overrides for the default paths, keyed by
+            'combined_listings', 'images_csv', 'images_dir' and 'batches_dir'
+    """
     # Paths (from your screenshots)
-    COMBINED_LISTINGS_PATH = "D:\\VR-Project\\combined_listings.json"
-    IMAGES_CSV_PATH = "D:\\VR-Project\\abo-images-small\\images\\metadata\\images.csv"
-    IMAGES_BASE_DIR = "D:\\VR-Project\\abo-images-small\\images\\small"
+    paths = paths or {}
+    COMBINED_LISTINGS_PATH = paths.get('combined_listings', "D:\\VR-Project\\combined_listings.json")
+    IMAGES_CSV_PATH = paths.get('images_csv', "D:\\VR-Project\\abo-images-small\\images\\metadata\\images.csv")
+    IMAGES_BASE_DIR = paths.get('images_dir', "D:\\VR-Project\\abo-images-small\\images\\small")
     
     # Output directories
-    OUTPUT_BASE_DIR = "D:\\VR-Project\\dataset-batches"
-    BATCH_DIRS = [
-        os.path.join(OUTPUT_BASE_DIR, "batch1"),
-        os.path.join(OUTPUT_BASE_DIR, "batch2"),
-        os.path.join(OUTPUT_BASE_DIR, "batch3"),
-        os.path.join(OUTPUT_BASE_DIR, "batch4")
-    ]
+    OUTPUT_BASE_DIR = paths.get('batches_dir', "D:\\VR-Project\\dataset-batches")
+    BATCH_DIRS = [os.path.join(OUTPUT_BASE_DIR, f"batch{i+1}") for i in range(num_batches)]
     
-    # Create output directories
+    # Create output directories (batch dirs aren't needed when using the image store)
     os.makedirs(OUTPUT_BASE_DIR, exist_ok=True)
-    for batch_dir in BATCH_DIRS:
-        os.makedirs(batch_dir, exist_ok=True)
-        print(f"Created directory: {batch_dir}")
+    if not image_store_dir:
+        for batch_dir in BATCH_DIRS:
+            os.makedirs(batch_dir, exist_ok=True)
+            print(f"Created directory: {batch_dir}")
     
     # Load images.csv for image paths
     print("Loading images.csv...")
@@ -33,117 +48,25 @@ def create_diverse_image_batches():
     image_path_map = dict(zip(images_df['image_id'], images_df['path']))
     print(f"Loaded {len(image_path_map)} image paths")
     
-    # Load combined listings
+    # Load combined listings from the columnar store (built on first use)
     print("Loading combined listings...")
-    products = []
-    with open(COMBINED_LISTINGS_PATH, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                product = json.loads(line.strip())
-                # Only include products with main_image_id
-                if 'main_image_id' in product and product['main_image_id'] and product['main_image_id'] in image_path_map:
-                    products.append(product)
-            except json.JSONDecodeError:
-                continue
-    
-    print(f"Loaded {len(products)} valid products with images")
-    
-    # Get product type distribution
-    product_types = []
-    product_by_type = {}
-    
-    for product in products:
-        product_type = "Unknown"
-        if 'product_type' in product and product['product_type']:
-            product_type = product['product_type'][0]['value']
-        
-        product_types.append(product_type)
-        
-        if product_type not in product_by_type:
-            product_by_type[product_type] = []
-        
-        product_by_type[product_type].append(product)
-    
-    type_counts = Counter(product_types)
-    print(f"Found {len(type_counts)} unique product types")
-    
-    # Calculate how many items to sample from each product type
-    total_samples = 20000
-    total_products = len(products)
-    
-    # Strategy for sampling:
-    # 1. For very common types: Cap at max_per_type
-    # 2. For medium types: Take proportional samples
-    # 3. For rare types: Take all available up to min_per_type
-    
-    selected_products = []
-    max_per_type = 200  # Cap for common types
-    min_per_type = 5    # Minimum for rare types
-    
-    # Sort product types by frequency
-    sorted_types = sorted(product_by_type.keys(), key=lambda x: len(product_by_type[x]), reverse=True)
-    
-    # First, take minimum samples from all types to ensure diversity
-    for product_type in sorted_types:
-        products_of_type = product_by_type[product_type]
-        take_count = min(min_per_type, len(products_of_type))
-        
-        if take_count > 0:
-            selected_products.extend(random.sample(products_of_type, take_count))
-            # Remove the selected products
-            for p in selected_products[-take_count:]:
-                if p in products_of_type:
-                    products_of_type.remove(p)
-    
-    print(f"Selected {len(selected_products)} products as minimum samples")
-    
-    # Calculate remaining samples needed
-    remaining_samples = total_samples - len(selected_products)
-    
-    # Calculate proportional allocation for remaining samples
-    total_remaining_products = sum(len(product_by_type[t]) for t in sorted_types)
-    
-    # Take proportional samples from each type, respecting max_per_type
-    for product_type in sorted_types:
-        if not product_by_type[product_type]:  # Skip if no products left
-            continue
-            
-        # Calculate proportional allocation
-        proportion = len(product_by_type[product_type]) / total_remaining_products
-        allocation = int(remaining_samples * proportion)
+    with open_listing_store(COMBINED_LISTINGS_PATH) as store:
+        # Only include products with main_image_id
+        rows = store.rows_with_images(image_path_map)
         
-        # Cap at max_per_type (including already taken minimum samples)
-        already_taken = min_per_type
-        if already_taken > len(product_by_type[product_type]) + min_per_type:
-            already_taken = len(product_by_type[product_type]) + min_per_type
-            
-        max_additional = max_per_type - already_taken
-        if max_additional < 0:
-            max_additional = 0
-        
-        take_count = min(allocation, max_additional, len(product_by_type[product_type]))
-        
-        if take_count > 0:
-            selected_products.extend(random.sample(product_by_type[product_type], take_count))
-    
-    print(f"Selected {len(selected_products)} products total after proportional allocation")
-    
-    # If we haven't reached our target, take more from types that still have products
-    if len(selected_products) < total_samples:
-        remaining_needed = total_samples - len(selected_products)
-        print(f"Need {remaining_needed} more products to reach target")
+        print(f"Loaded {len(rows)} valid products with images")
         
-        all_remaining = []
-        for product_type in sorted_types:
-            all_remaining.extend(product_by_type[product_type])
+        # Products without a product type are sampled as their own "Unknown" stratum
+        type_codes = np.asarray(store.column('product_type'))[rows]
+        print(f"Found {len(np.unique(type_codes))} unique product types")
         
-        if len(all_remaining) >= remaining_needed:
-            additional_samples = random.sample(all_remaining, remaining_needed)
-            selected_products.extend(additional_samples)
-    
-    # Shuffle and trim to exactly 20,000
-    random.shuffle(selected_products)
-    selected_products = selected_products[:total_samples]
+        # Sample with the usual policy:
+        # 1. For very common types: Cap at max_per_type
+        # 2. For medium types: Take proportional samples
+        # 3. For rare types: Take all available up to min_per_type
+        total_samples = 20000
+        selected = stratified_sample(type_codes, total_samples=total_samples, min_per_type=5, max_per_type=200, seed=seed)
+        selected_products = store.products(rows[selected])
     
     print(f"Final selection: {len(selected_products)} products")
     
@@ -161,65 +84,76 @@ def create_diverse_image_batches():
     for product_type, count in final_type_counts.most_common(10):
         print(f"  {product_type}: {count}")
     
-    # Split into 4 balanced batches
-    batch_size = total_samples // 4
-    batches = [[] for _ in range(4)]
-    
-    # Distribute products to ensure type diversity in each batch
-    product_types_list = list(final_type_counts.keys())
-    
-    for product_type in product_types_list:
-        # Get all products of this type
-        type_products = [p for p in selected_products if 
-                         'product_type' in p and 
-                         p['product_type'] and 
-                         p['product_type'][0]['value'] == product_type]
-        
-        # Distribute evenly across batches
-        products_per_batch = len(type_products) // 4
-        remainder = len(type_products) % 4
+    # Resolve each selected image and its size on disk
+    image_ids = [product['main_image_id'] for product in selected_products]
+    src_paths = [os.path.join(IMAGES_BASE_DIR, image_path_map[image_id]) for image_id in image_ids]
+    
+    # Split into balanced batches (by product type and image bytes)
+    print(f"Partitioning into {num_batches} batches...")
+    assignments = list(partition_balanced(
+        final_types,
+        num_batches,
+        sizes=image_sizes(src_paths),
+        keys=image_ids,
+        assignments_file=os.path.join(OUTPUT_BASE_DIR, "batch_assignments.csv")
+    ))
+    
+    # Record the assignment in the ledger before copying, so later batches
+    # (create_new_batches) never reuse these images
+    ledger = AssignmentLedger(default_ledger_dir(OUTPUT_BASE_DIR))
+    batch_images = {batch_num: [] for batch_num in range(1, num_batches + 1)}
+    for index, batch_idx in assignments:
+        batch_images[batch_idx + 1].append(image_ids[index])
+    ledger.reserve(batch_images, overwrite=True, owner='distribute')
+    
+    # Images are materialized by a thread pool
+    print(f"Materializing images ({link_mode})...")
+    batch_sizes = [0] * num_batches
+    
+    def placements():
+        for index, batch_idx in assignments:
+            batch_sizes[batch_idx] += 1
+            image_id = image_ids[index]
+            src_path = src_paths[index]
+            
+            # Extract file extension
+            _, ext = os.path.splitext(src_path)
+            if not ext:  # If no extension, default to .jpg
+                ext = ".jpg"
+            
+            yield batch_idx, image_id, src_path, f"{image_id}{ext}"
+    
+    if image_store_dir:
+        # Each image is stored once by content; a batch is just a manifest
+        image_store = ImageStore(image_store_dir)
+        batch_entries = [[] for _ in range(num_batches)]
+        items = []
+        for batch_idx, image_id, src_path, file_name in placements():
+            items.append((image_id, src_path))
+            batch_entries[batch_idx].append({'image_id': image_id, 'local_path': file_name})
+        blobs, _ = image_store.add_many(items, workers=copy_workers)
         
-        start_idx = 0
-        for i in range(4):
-            take_count = products_per_batch + (1 if i < remainder else 0)
-            end_idx = start_idx + take_count
-            batches[i].extend(type_products[start_idx:end_idx])
-            start_idx = end_idx
-    
-    # Verify batch sizes and adjust if needed
-    for i in range(4):
-        print(f"Batch {i+1} size: {len(batches[i])}")
-    
-    # Copy images to batch directories
-    for batch_idx, batch in enumerate(batches):
-        batch_dir = BATCH_DIRS[batch_idx]
-        print(f"Copying images to {batch_dir}...")
+        for batch_idx, entries in enumerate(batch_entries):
+            print(f"Batch {batch_idx+1} size: {batch_sizes[batch_idx]}")
+            path = manifest_path(OUTPUT_BASE_DIR, batch_idx + 1)
+            count = write_manifest(path, (dict(entry, blob=blobs[entry['image_id']])
+                                          for entry in entries if entry['image_id'] in blobs))
+            print(f"Batch {batch_idx+1} manifest lists {count} images at {path}")
+    else:
+        # Files already in place (same size and mtime) are skipped, so a rerun
+        # only copies what is missing
+        jobs = ((src_path, os.path.join(BATCH_DIRS[batch_idx], file_name))
+                for batch_idx, _, src_path, file_name in placements())
+        materialize_files(jobs, mode=link_mode, workers=copy_workers)
         
-        for product in batch:
-            image_id = product['main_image_id']
+        for batch_idx, batch_dir in enumerate(BATCH_DIRS):
+            print(f"Batch {batch_idx+1} size: {batch_sizes[batch_idx]}")
             
-            # Get image path
-            if image_id in image_path_map:
-                src_path = os.path.join(IMAGES_BASE_DIR, image_path_map[image_id])
-                
-                # Extract file extension
-                _, ext = os.path.splitext(src_path)
-                if not ext:  # If no extension, default to .jpg
-                    ext = ".jpg"
-                
-                # Create destination path
-                dst_path = os.path.join(batch_dir, f"{image_id}{ext}")
-                
-                # Copy the file
-                try:
-                    shutil.copy2(src_path, dst_path)
-                except Exception as e:
-                    print(f"Error copying {image_id}: {str(e)}")
-        
-        # Count files in batch directory
-        file_count = len(os.listdir(batch_dir))
-        print(f"Batch {batch_idx+1} contains {file_count} images")
+            # Count files in batch directory
+            file_count = len(os.listdir(batch_dir))
+            print(f"Batch {batch_idx+1} contains {file_count} images")
     
+    ledger.commit(range(1, num_batches + 1))
     print("Done creating diverse image batches!")
 
 if __name__ == "__main__":
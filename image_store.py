@@ -0,0 +1,187 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from materialize import materialize_files
+
+def hash_image(file_path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of an image file"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ImageStore:
+    """
+    Content-addressed store of image blobs
+
+    Every distinct image is written once under objects/<aa>/<sha256><ext>.
+    An append-only index remembers which blob each image_id resolved to
+    (with the source's size and mtime), so re-adding an unchanged image
+    doesn't even need to re-hash it. Batches refer to blobs through
+    manifests instead of holding their own copies.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.index_path = os.path.join(root, 'index.jsonl')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from an interrupted run
+                    self.index[entry['image_id']] = entry
+
+    def blob_path(self, blob):
+        """Path of a blob inside the store"""
+        return os.path.join(self.objects_dir, blob[:2], blob)
+
+    def _put(self, src_path):
+        """Hash a file and write it into the store if it isn't there yet"""
+        _, ext = os.path.splitext(src_path)
+        blob = hash_image(src_path) + (ext or '.jpg')
+        blob_path = self.blob_path(blob)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # Unique per process and thread: two workers may store the same content at once
+            tmp_path = f"{blob_path}.tmp{os.getpid()}-{threading.get_ident()}"
+            shutil.copy2(src_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+        return blob
+
+    def _cached_blob(self, image_id, src_path):
+        entry = self.index.get(image_id)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(src_path)
+        except OSError:
+            return None
+        if (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns) \
+                and os.path.exists(self.blob_path(entry['blob'])):
+            return entry['blob']
+        return None
+
+    def add_many(self, items, workers=8):
+        """
+        Add images to the store concurrently
+
+        Args:
+            items: Iterable of (image_id, src_path)
+            workers: Number of hashing/copying threads
+
+        Returns:
+            tuple: ({image_id: blob}, [(image_id, src_path, error), ...])
+        """
+        blobs = {}
+        failed = []
+        todo = []
+        for image_id, src_path in items:
+            blob = self._cached_blob(image_id, src_path)
+            if blob is not None:
+                blobs[image_id] = blob
+            else:
+                todo.append((image_id, src_path))
+
+        def put(item):
+            image_id, src_path = item
+            try:
+                return self._put(src_path), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                open(self.index_path, 'a', encoding='utf-8') as index_file:
+            for (image_id, src_path), (blob, error) in zip(todo, executor.map(put, todo)):
+                if error is not None:
+                    print(f"Error storing {image_id}: {error}")
+                    failed.append((image_id, src_path, str(error)))
+                    continue
+                stat = os.stat(src_path)
+                entry = {'image_id': image_id, 'blob': blob, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                self.index[image_id] = entry
+                index_file.write(json.dumps(entry) + '\n')
+                blobs[image_id] = blob
+
+        print(f"Image store: {len(blobs) - len(todo) + len(failed)} cached, "
+              f"{len(todo) - len(failed)} added, {len(failed)} failed")
+        return blobs, failed
+
+def manifest_path(batches_dir, batch_num):
+    """Location of a batch's manifest"""
+    return os.path.join(batches_dir, f"batch{batch_num}_manifest.jsonl")
+
+def write_manifest(path, entries):
+    """
+    Atomically write a batch manifest
+
+    Args:
+        path: Manifest path
+        entries: Iterable of dicts with image_id, blob and local_path
+    """
+    tmp_path = path + '.tmp'
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+def read_manifest(path):
+    """
+    Read a batch manifest
+
+    Args:
+        path: Manifest path
+
+    Returns:
+        list: Entry dicts (image_id, blob, local_path)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def list_batch_images(batch_dir, manifest_file=None):
+    """
+    Images that belong to a batch, from its manifest or its directory
+
+    Args:
+        batch_dir: Batch directory (used when there is no manifest)
+        manifest_file: Manifest path (ignored if it doesn't exist)
+
+    Returns:
+        list: (image_id, local_path) tuples
+    """
+    if manifest_file and os.path.exists(manifest_file):
+        return [(entry['image_id'], entry['local_path']) for entry in read_manifest(manifest_file)]
+    image_files = glob.glob(os.path.join(batch_dir, "*.*"))
+    return [(os.path.splitext(os.path.basename(f))[0], os.path.basename(f)) for f in image_files]
+
+def export_batch(store, manifest_file, batch_dir, mode='hardlink', workers=8):
+    """
+    Materialize a batch directory from its manifest (e.g. for zipping)
+
+    Args:
+        store: ImageStore holding the blobs
+        manifest_file: Manifest path
+        batch_dir: Directory to populate
+        mode: 'hardlink' (default, no extra space), 'reflink' or 'copy'
+        workers: Number of threads
+
+    Returns:
+        dict: materialize_files statistics
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    jobs = ((store.blob_path(entry['blob']), os.path.join(batch_dir, entry['local_path']))
+            for entry in read_manifest(manifest_file))
+    return materialize_files(jobs, mode=mode, workers=workers)
@@ -0,0 +1,410 @@
+import os
+import json
+import time
+from array import array
+
+import numpy as np
+
+# Bump when the on-disk layout changes so stale stores get rebuilt
+STORE_VERSION = 2
+
+# Scalar string fields kept per product, as codes into the string pool
+STRING_COLUMNS = [
+    'item_id',
+    'main_image_id',
+    'product_type',
+    'brand',
+    'brand_language',
+    'item_name',
+    'name_language',
+    'color',
+    'country',
+    'marketplace'
+]
+
+# Fields whose presence (key exists and is non-empty) is tracked as a bitmask
+PRESENCE_FIELDS = ['brand', 'item_name', 'color', 'product_type', 'main_image_id', 'other_image_id']
+
+# Columns with a sorted, memory-mapped lookup index
+INDEXED_COLUMNS = ['main_image_id', 'item_id']
+
+MISSING = -1
+
+# Code for a field that is present but null; the statistics count it as None,
+# unlike a missing field. Only NULLABLE_COLUMNS use it
+NULL = -2
+NULLABLE_COLUMNS = ['country', 'marketplace']
+_NULL_VALUE = object()
+
+def default_store_dir(listings_file):
+    """
+    Default store location for a combined listings file
+
+    Args:
+        listings_file: Path to combined listings JSON file
+
+    Returns:
+        str: Sibling directory named <listings>.store
+    """
+    return os.path.splitext(listings_file)[0] + '.store'
+
+def _source_fingerprint(listings_file):
+    stat = os.stat(listings_file)
+    return {
+        'path': os.path.abspath(listings_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+def _first_entry(product, field):
+    entries = product.get(field)
+    if entries and isinstance(entries, list):
+        return entries[0]
+    return None
+
+def _project_listing(product):
+    """Pull the stored columns out of one parsed listing"""
+    brand_entry = _first_entry(product, 'brand')
+    name_entry = _first_entry(product, 'item_name')
+    color_entry = _first_entry(product, 'color')
+    type_entry = _first_entry(product, 'product_type')
+
+    values = {
+        'item_id': product.get('item_id'),
+        'main_image_id': product.get('main_image_id') or None,
+        'product_type': type_entry.get('value') if type_entry else None,
+        'brand': brand_entry.get('value', 'Unknown') if brand_entry else None,
+        'brand_language': brand_entry.get('language_tag') if brand_entry else None,
+        'item_name': name_entry.get('value') if name_entry else None,
+        'name_language': name_entry.get('language_tag') if name_entry else None,
+        'color': color_entry.get('value') if color_entry else None,
+    }
+    for name in NULLABLE_COLUMNS:
+        if name in product:
+            values[name] = _NULL_VALUE if product[name] is None else product[name]
+        else:
+            values[name] = None
+
+    # Every language tag on brand and item_name entries, in listing order
+    language_tags = []
+    for field in ('brand', 'item_name'):
+        if field in product and product[field]:
+            for entry in product[field]:
+                if 'language_tag' in entry:
+                    language_tags.append(entry['language_tag'])
+
+    presence = 0
+    for bit, field in enumerate(PRESENCE_FIELDS):
+        if field in product and product[field]:
+            presence |= 1 << bit
+
+    other_images = product.get('other_image_id')
+    other_image_count = len(other_images) if other_images else 0
+
+    return values, language_tags, presence, other_image_count
+
+def build_listing_store(listings_file, store_dir=None):
+    """
+    Build a compact columnar store from a combined listings file
+
+    Each product becomes one row. String fields are stored as int32 codes
+    into a shared string pool, presence flags as a bitmask, and the byte
+    offset of every source line is kept so full records can still be read
+    on demand. Sorted key arrays index rows by main_image_id and item_id.
+
+    Args:
+        listings_file: Path to combined listings JSON file
+        store_dir: Output directory (defaults to <listings>.store)
+
+    Returns:
+        str: Path to the store directory
+    """
+    store_dir = store_dir or default_store_dir(listings_file)
+    os.makedirs(store_dir, exist_ok=True)
+    print(f"Building listing store from {listings_file} into {store_dir}")
+    start = time.perf_counter()
+
+    pool = {}
+
+    def intern(value):
+        if value is None:
+            return MISSING
+        if value is _NULL_VALUE:
+            return NULL
+        value = str(value)
+        code = pool.get(value)
+        if code is None:
+            code = len(pool)
+            pool[value] = code
+        return code
+
+    columns = {name: array('i') for name in STRING_COLUMNS}
+    language_codes = array('i')
+    language_offsets = array('q', [0])
+    presence = array('B')
+    other_image_counts = array('i')
+    line_offsets = array('q')
+
+    offset = 0
+    with open(listings_file, 'rb') as f:
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            try:
+                product = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(product, dict):
+                continue
+
+            values, language_tags, product_presence, other_image_count = _project_listing(product)
+            for name in STRING_COLUMNS:
+                columns[name].append(intern(values[name]))
+            for tag in language_tags:
+                language_codes.append(intern(tag))
+            language_offsets.append(len(language_codes))
+            presence.append(product_presence)
+            other_image_counts.append(other_image_count)
+            line_offsets.append(line_offset)
+
+    n_rows = len(line_offsets)
+
+    def save(name, data, dtype):
+        np.save(os.path.join(store_dir, f"{name}.npy"), np.frombuffer(data, dtype=dtype) if len(data) else np.zeros(0, dtype=dtype))
+
+    for name in STRING_COLUMNS:
+        save(name, columns[name], np.int32)
+    save('language_tags.codes', language_codes, np.int32)
+    save('language_tags.offsets', language_offsets, np.int64)
+    save('presence', presence, np.uint8)
+    save('other_image_count', other_image_counts, np.int32)
+    save('line_offset', line_offsets, np.int64)
+
+    # String pool: concatenated UTF-8 plus offsets
+    encoded = [value.encode('utf-8') for value in pool]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=string_offsets[1:])
+    with open(os.path.join(store_dir, 'strings.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    np.save(os.path.join(store_dir, 'strings.offsets.npy'), string_offsets)
+
+    # Sorted fixed-width key arrays for binary-search lookups
+    for name in INDEXED_COLUMNS:
+        codes = np.frombuffer(columns[name], dtype=np.int32) if n_rows else np.zeros(0, dtype=np.int32)
+        rows = np.nonzero(codes != MISSING)[0].astype(np.int32)
+        keys = np.array([encoded[code] for code in codes[rows]], dtype=bytes) if len(rows) else np.zeros(0, dtype='S1')
+        order = np.argsort(keys, kind='stable')
+        np.save(os.path.join(store_dir, f"{name}.index.keys.npy"), keys[order])
+        np.save(os.path.join(store_dir, f"{name}.index.rows.npy"), rows[order])
+
+    meta = {
+        'version': STORE_VERSION,
+        'rows': n_rows,
+        'strings': len(pool),
+        'columns': STRING_COLUMNS,
+        'presence_fields': PRESENCE_FIELDS,
+        'source': _source_fingerprint(listings_file)
+    }
+    with open(os.path.join(store_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Stored {n_rows} products and {len(pool)} unique strings in {time.perf_counter() - start:.1f}s")
+    return store_dir
+
+class ListingStore:
+    """Read-only, memory-mapped view of a store built by build_listing_store"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.source_path = self.meta['source']['path']
+        self._columns = {}
+        self._string_cache = {}
+        self._strings = np.memmap(os.path.join(store_dir, 'strings.bin'), dtype=np.uint8, mode='r') \
+            if self.meta['strings'] and os.path.getsize(os.path.join(store_dir, 'strings.bin')) else np.zeros(0, dtype=np.uint8)
+        self._string_offsets = self._load('strings.offsets')
+        self._source = None
+
+    def _load(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.store_dir, f"{name}.npy"), mmap_mode='r')
+        return self._columns[name]
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def is_stale(self):
+        """True if the source listings file changed since the store was built"""
+        if self.meta.get('version') != STORE_VERSION:
+            return True
+        try:
+            return _source_fingerprint(self.source_path) != self.meta['source']
+        except OSError:
+            return True
+
+    def column(self, name):
+        """int32 string codes for a column (MISSING where the field is missing, NULL where it is null)"""
+        return self._load(name)
+
+    def has(self, field):
+        """Boolean array: field exists and is non-empty in each product"""
+        bit = PRESENCE_FIELDS.index(field)
+        return (self._load('presence') >> bit) & 1 == 1
+
+    @property
+    def other_image_count(self):
+        return self._load('other_image_count')
+
+    @property
+    def language_tag_codes(self):
+        """Flat codes of all brand/item_name language tags, in listing order"""
+        return self._load('language_tags.codes')
+
+    def string(self, code):
+        """Decode a single string code (None for missing or null)"""
+        code = int(code)
+        if code in (MISSING, NULL):
+            return None
+        value = self._string_cache.get(code)
+        if value is None:
+            start, end = self._string_offsets[code], self._string_offsets[code + 1]
+            value = bytes(self._strings[start:end]).decode('utf-8')
+            self._string_cache[code] = value
+        return value
+
+    def strings(self, codes):
+        """Decode an array of string codes into a list"""
+        return [self.string(code) for code in codes]
+
+    def value(self, name, row):
+        """Decoded value of one column for one row"""
+        return self.string(self._load(name)[row])
+
+    def _index(self, name):
+        return self._load(f"{name}.index.keys"), self._load(f"{name}.index.rows")
+
+    def _lookup(self, name, key):
+        keys, rows = self._index(name)
+        encoded = key.encode('utf-8')
+        if not len(keys) or len(encoded) > keys.dtype.itemsize:
+            return None
+        # Last matching row, so duplicates resolve like a dict built in file order
+        pos = np.searchsorted(keys, encoded, side='right') - 1
+        if pos >= 0 and keys[pos] == encoded:
+            return int(rows[pos])
+        return None
+
+    def lookup_image(self, image_id):
+        """Row of the product whose main_image_id is image_id, or None"""
+        return self._lookup('main_image_id', image_id)
+
+    def lookup_item(self, item_id):
+        """Row of the product with this item_id, or None"""
+        return self._lookup('item_id', item_id)
+
+    def rows_with_images(self, image_ids):
+        """
+        Rows (in file order) whose main_image_id is in image_ids
+
+        Args:
+            image_ids: Iterable of image ids, e.g. the keys of images.csv
+
+        Returns:
+            np.ndarray: Sorted int32 row indices
+        """
+        keys, rows = self._index('main_image_id')
+        query = [image_id.encode('utf-8') for image_id in image_ids if isinstance(image_id, str)]
+        if not len(keys) or not query:
+            return np.zeros(0, dtype=np.int32)
+        width = max(keys.dtype.itemsize, max(len(q) for q in query))
+        mask = np.isin(keys.astype(f'S{width}'), np.array(query, dtype=f'S{width}'))
+        return np.sort(rows[mask])
+
+    def read_line(self, row):
+        """Raw JSON line for a row from the source file"""
+        if self._source is None:
+            self._source = open(self.source_path, 'rb')
+        self._source.seek(int(self._load('line_offset')[row]))
+        return self._source.readline()
+
+    def read_product(self, row):
+        """Parse the full listing for a row from the source file"""
+        return json.loads(self.read_line(row))
+
+    def close(self):
+        """Close the source listings file if a full record was read"""
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_product_by_image(self, image_id):
+        """Full listing for a main_image_id, or None"""
+        row = self.lookup_image(image_id)
+        return self.read_product(row) if row is not None else None
+
+    def products(self, rows, fields=('item_id', 'main_image_id', 'product_type')):
+        """
+        Slim product dicts in the listings schema for the given rows
+
+        Only the requested scalar fields are included, shaped like the
+        source JSON (e.g. product_type -> [{'value': ...}]) so existing
+        product-handling code works unchanged.
+
+        Args:
+            rows: Row indices
+            fields: Stored columns to include
+
+        Returns:
+            list: Product dicts
+        """
+        nested = {'product_type', 'brand', 'item_name', 'color'}
+        columns = {field: self._load(field) for field in fields}
+        products = []
+        for row in rows:
+            product = {}
+            for field, codes in columns.items():
+                value = self.string(codes[row])
+                if value is None:
+                    continue
+                product[field] = [{'value': value}] if field in nested else value
+            products.append(product)
+        return products
+
+def open_listing_store(listings_file, store_dir=None, rebuild=False):
+    """
+    Open the columnar store for a listings file, building it if needed
+
+    The store is rebuilt when it is missing, was built by another store
+    version, or the listings file changed since it was built.
+
+    Args:
+        listings_file: Path to combined listings JSON file
+        store_dir: Store directory (defaults to <listings>.store)
+        rebuild: Force a rebuild
+
+    Returns:
+        ListingStore: The opened store
+    """
+    store_dir = store_dir or default_store_dir(listings_file)
+    if not rebuild and os.path.exists(os.path.join(store_dir, 'meta.json')):
+        store = ListingStore(store_dir)
+        if not store.is_stale():
+            print(f"Opened listing store {store_dir} with {len(store)} products")
+            return store
+        print(f"Listing store {store_dir} is out of date")
+    build_listing_store(listings_file, store_dir)
+    return ListingStore(store_dir)
+
+if __name__ == "__main__":
+    # Path to the combined listings file
+    listings_file = "D:\\VR-Project\\combined_listings.json"
+
+    # One-time build; scripts reuse the store until the listings change
+    build_listing_store(listings_file)
@@ -0,0 +1,152 @@
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Supported ways of placing a source file at its destination
+MODES = ('copy', 'hardlink', 'reflink')
+
+# Linux FICLONE ioctl: share the source's extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+def is_up_to_date(src_path, dst_path):
+    """
+    True if dst already holds src: same file, or same size and mtime
+
+    Args:
+        src_path: Source file
+        dst_path: Destination file
+
+    Returns:
+        bool: Whether the destination can be left alone
+    """
+    try:
+        dst_stat = os.stat(dst_path)
+    except OSError:
+        return False
+    src_stat = os.stat(src_path)
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino) and src_stat.st_ino:
+        return True
+    # copy2 preserves mtime; allow for filesystems with coarse timestamps
+    return src_stat.st_size == dst_stat.st_size and abs(src_stat.st_mtime - dst_stat.st_mtime) < 2
+
+def _reflink(src_path, dst_path):
+    if not sys.platform.startswith('linux'):
+        raise OSError("reflink is only supported on Linux")
+    import fcntl
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dst_path)
+
+def materialize_file(src_path, dst_path, mode='copy', skip_identical=True):
+    """
+    Place one file at dst_path by copying, hardlinking or reflinking
+
+    Hardlink and reflink fall back to a regular copy when the filesystem
+    can't do them (e.g. across devices). Files are written to a temporary
+    name and renamed into place, so an interrupted run never leaves a
+    truncated file that looks complete.
+
+    Args:
+        src_path: Source file
+        dst_path: Destination file
+        mode: 'copy', 'hardlink' or 'reflink'
+        skip_identical: Leave dst alone if it already matches src
+
+    Returns:
+        str: What happened ('skipped', 'copied', 'hardlinked' or 'reflinked')
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+    if skip_identical and is_up_to_date(src_path, dst_path):
+        return 'skipped'
+
+    # Unique per process and thread: two jobs may share a destination
+    tmp_path = f"{dst_path}.tmp{os.getpid()}-{threading.get_ident()}"
+    try:
+        action = 'copied'
+        try:
+            if mode == 'hardlink':
+                os.link(src_path, tmp_path)
+                action = 'hardlinked'
+            elif mode == 'reflink':
+                _reflink(src_path, tmp_path)
+                action = 'reflinked'
+            else:
+                shutil.copy2(src_path, tmp_path)
+        except OSError:
+            if mode == 'copy':
+                raise
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            shutil.copy2(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+        return action
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def materialize_files(jobs, mode='copy', workers=8, skip_identical=True, report_every=5000):
+    """
+    Materialize many files concurrently with a thread pool
+
+    jobs may be a generator (e.g. fed by the batch partitioner); at most a
+    few jobs per worker are in flight, so copying starts immediately and
+    memory stays flat. Rerunning after a partial failure only redoes files
+    that are missing or differ.
+
+    Args:
+        jobs: Iterable of (src_path, dst_path)
+        mode: 'copy', 'hardlink' or 'reflink'
+        workers: Number of copy threads
+        skip_identical: Skip destinations whose size and mtime already match
+        report_every: Print progress every this many files (0 disables)
+
+    Returns:
+        dict: Counts per action, bytes, seconds and the failed jobs
+    """
+    stats = {'copied': 0, 'hardlinked': 0, 'reflinked': 0, 'skipped': 0, 'bytes': 0, 'failed': []}
+    start = time.perf_counter()
+    done = 0
+
+    def run(job):
+        src_path, dst_path = job
+        action = materialize_file(src_path, dst_path, mode=mode, skip_identical=skip_identical)
+        size = os.path.getsize(dst_path) if action != 'skipped' else 0
+        return action, size
+
+    def collect(futures):
+        nonlocal done
+        for future in futures:
+            job = pending.pop(future)
+            try:
+                action, size = future.result()
+                stats[action] += 1
+                stats['bytes'] += size
+            except Exception as e:
+                print(f"Error materializing {job[0]} -> {job[1]}: {e}")
+                stats['failed'].append((job[0], job[1], str(e)))
+            done += 1
+            if report_every and done % report_every == 0:
+                _report(stats, done, time.perf_counter() - start)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job in jobs:
+            pending[executor.submit(run, tuple(job[:2]))] = job
+            if len(pending) >= workers * 4:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        collect(list(pending))
+
+    stats['seconds'] = time.perf_counter() - start
+    _report(stats, done, stats['seconds'])
+    return stats
+
+def _report(stats, done, seconds):
+    seconds = max(seconds, 1e-9)
+    written = stats['copied'] + stats['hardlinked'] + stats['reflinked']
+    print(f"  {done} files ({written} written, {stats['skipped']} skipped, {len(stats['failed'])} failed): "
+          f"{done / seconds:,.0f} files/s, {stats['bytes'] / seconds / 1e6:,.1f} MB/s")
@@ -0,0 +1,178 @@
+import json
+
+# Listing fields the batch metadata is built from
+METADATA_FIELDS = [
+    'item_id',
+    'main_image_id',
+    'brand',
+    'item_name',
+    'color',
+    'product_type',
+    'bullet_point',
+    'style',
+    'material',
+    'item_weight',
+    'item_dimensions'
+]
+
+# Keys kept inside those fields' entries
+ENTRY_KEYS = ['value', 'language_tag', 'unit', 'height', 'width', 'length']
+
+_KEEP = frozenset(METADATA_FIELDS + ENTRY_KEYS)
+
+def _project(pairs):
+    # Called for every JSON object as it is decoded, innermost first, so
+    # unwanted subtrees are dropped before the enclosing object is built
+    return {key: value for key, value in pairs if key in _KEEP}
+
+_DECODER = json.JSONDecoder(object_pairs_hook=_project)
+
+def _first_entry(product, field):
+    entries = product.get(field)
+    if entries and isinstance(entries, list):
+        return entries[0]
+    return None
+
+class ProductMetadata:
+    """
+    The fields of one listing that go into batch metadata
+
+    Uses __slots__ and tuples so a record costs a fraction of the parsed
+    listing. Absent fields are None; a field that is present without a
+    value is '' (same as the old inline extraction).
+    """
+
+    __slots__ = (
+        'item_id', 'main_image_id', 'brand', 'brand_language', 'item_name', 'name_language',
+        'color', 'product_type', 'features', 'style', 'material', 'weight', 'weight_unit',
+        'dimensions'
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_product(cls, product):
+        """
+        Build a record from a (possibly projected) listing dict
+
+        Args:
+            product: Parsed listing
+
+        Returns:
+            ProductMetadata: Extracted fields
+        """
+        fields = {
+            'item_id': product.get('item_id', ''),
+            'main_image_id': product.get('main_image_id')
+        }
+
+        brand_entry = _first_entry(product, 'brand')
+        if brand_entry is not None:
+            fields['brand'] = brand_entry.get('value', '')
+            fields['brand_language'] = brand_entry.get('language_tag')
+
+        name_entry = _first_entry(product, 'item_name')
+        if name_entry is not None:
+            fields['item_name'] = name_entry.get('value', '')
+            fields['name_language'] = name_entry.get('language_tag')
+
+        for field in ('color', 'product_type', 'style', 'material'):
+            entry = _first_entry(product, field)
+            if entry is not None:
+                fields[field] = entry.get('value', '')
+
+        if product.get('bullet_point'):
+            fields['features'] = tuple(bp['value'] for bp in product['bullet_point'] if 'value' in bp)
+
+        weight_entry = _first_entry(product, 'item_weight')
+        if weight_entry is not None and 'value' in weight_entry:
+            fields['weight'] = weight_entry['value']
+            fields['weight_unit'] = weight_entry.get('unit')
+
+        if product.get('item_dimensions'):
+            dims = tuple(
+                (dim_type, product['item_dimensions'][dim_type]['value'],
+                 product['item_dimensions'][dim_type].get('unit', ''))
+                for dim_type in ('height', 'width', 'length')
+                if 'value' in product['item_dimensions'].get(dim_type, {})
+            )
+            if dims:
+                fields['dimensions'] = dims
+
+        return cls(**fields)
+
+    def to_entry(self, image_id, image_path, local_path=None):
+        """
+        Metadata entry in the batchN_metadata.json schema
+
+        Args:
+            image_id: Image the entry describes
+            image_path: Path from images.csv
+            local_path: File name relative to the batch directory
+
+        Returns:
+            dict: Metadata entry (same keys and order as before)
+        """
+        entry = {
+            'item_id': self.item_id,
+            'image_id': image_id,
+            'image_path': image_path
+        }
+        if self.brand is not None:
+            entry['brand'] = self.brand
+            if self.brand_language is not None:
+                entry['brand_language'] = self.brand_language
+        if self.item_name is not None:
+            entry['item_name'] = self.item_name
+            if self.name_language is not None:
+                entry['name_language'] = self.name_language
+        if self.color is not None:
+            entry['color'] = self.color
+        if self.product_type is not None:
+            entry['product_type'] = self.product_type
+        if self.features is not None:
+            entry['features'] = list(self.features)
+        if self.style is not None:
+            entry['style'] = self.style
+        if self.material is not None:
+            entry['material'] = self.material
+        if self.weight is not None:
+            entry['weight'] = self.weight
+            if self.weight_unit is not None:
+                entry['weight_unit'] = self.weight_unit
+        if self.dimensions is not None:
+            entry['dimensions'] = {dim_type: {'value': value, 'unit': unit}
+                                   for dim_type, value, unit in self.dimensions}
+        if local_path is not None:
+            entry['local_path'] = local_path
+        return entry
+
+def extract_metadata(line):
+    """
+    Parse one listing line keeping only the metadata fields
+
+    Args:
+        line: JSON line (str or bytes)
+
+    Returns:
+        ProductMetadata: Extracted fields
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    return ProductMetadata.from_product(_DECODER.decode(line))
+
+def read_metadata(store, image_id):
+    """
+    Metadata record for a main_image_id from a listing store
+
+    Args:
+        store: ListingStore over the combined listings
+        image_id: main_image_id to look up
+
+    Returns:
+        ProductMetadata or None if no listing has that image
+    """
+    row = store.lookup_image(image_id)
+    return extract_metadata(store.read_line(row)) if row is not None else None
@@ -0,0 +1,210 @@
+import gzip
+import json
+import os
+
+# File suffix for each supported metadata format. 'json' is the original
+# indented array; 'jsonl' has one record per line; 'jsonl.gz' is the
+# compact (gzip-compressed) form of the same records.
+FORMAT_SUFFIXES = {
+    'json': '.json',
+    'jsonl': '.jsonl',
+    'jsonl.gz': '.jsonl.gz'
+}
+
+def metadata_format(path):
+    """
+    Format of a metadata file, from its suffix
+
+    Args:
+        path: Metadata file path
+
+    Returns:
+        str: 'json', 'jsonl' or 'jsonl.gz'
+    """
+    for fmt in ('jsonl.gz', 'jsonl', 'json'):
+        if path.endswith(FORMAT_SUFFIXES[fmt]):
+            return fmt
+    raise ValueError(f"Unknown metadata format for {path}, expected one of {list(FORMAT_SUFFIXES.values())}")
+
+def metadata_path(base_dir, batch_num, fmt='json', kind='metadata'):
+    """
+    Path of a batch's metadata file in a given format
+
+    Args:
+        base_dir: Batches directory
+        batch_num: Batch number
+        fmt: 'json', 'jsonl' or 'jsonl.gz'
+        kind: File kind in the name (e.g. 'metadata', 'qa_dataset')
+
+    Returns:
+        str: Path such as base_dir/batch3_metadata.jsonl
+    """
+    return os.path.join(base_dir, f"batch{batch_num}_{kind}{FORMAT_SUFFIXES[fmt]}")
+
+def find_metadata_file(base_dir, batch_num, kind='metadata'):
+    """
+    Existing metadata file for a batch, whatever its format
+
+    Args:
+        base_dir: Batches directory
+        batch_num: Batch number
+        kind: File kind in the name (e.g. 'metadata', 'qa_dataset')
+
+    Returns:
+        str or None: First existing path (jsonl, jsonl.gz, then json)
+    """
+    for fmt in ('jsonl', 'jsonl.gz', 'json'):
+        path = metadata_path(base_dir, batch_num, fmt, kind)
+        if os.path.exists(path):
+            return path
+    return None
+
+def _iter_json_array(f, chunk_size=1024 * 1024):
+    """Yield the elements of a top-level JSON array without loading the file"""
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size)
+    eof = not buf
+    pos = 0
+    started = False
+    while True:
+        # Skip whitespace and separators, refilling the buffer as needed
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ',' or (buf[pos] == '[' and not started)):
+            started = started or buf[pos] == '['
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+            continue
+        if not started:
+            raise ValueError("Expected a JSON array")
+        if buf[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = None
+        if end is None or (end == len(buf) and not eof):
+            # Element may run past the buffer: read more and retry
+            more = f.read(chunk_size)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield value
+        pos = end
+
+def iter_metadata(path):
+    """
+    Stream records from a metadata file (json, jsonl or jsonl.gz)
+
+    Legacy .json arrays are parsed incrementally, so no format needs the
+    whole file in memory.
+
+    Args:
+        path: Metadata file path
+
+    Yields:
+        dict: One record at a time
+    """
+    fmt = metadata_format(path)
+    if fmt == 'json':
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from _iter_json_array(f)
+        return
+
+    opener = gzip.open if fmt == 'jsonl.gz' else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def load_metadata(path):
+    """
+    Read a whole metadata file
+
+    Args:
+        path: Metadata file path
+
+    Returns:
+        list: All records
+    """
+    return list(iter_metadata(path))
+
+class MetadataWriter:
+    """
+    Write metadata records one at a time
+
+    Records are appended to a temporary file as they are written and the
+    file is moved into place on close, so readers never see a partial
+    file. The 'json' format reproduces json.dump(..., indent=2) output.
+
+    Usage:
+        with MetadataWriter(path) as writer:
+            writer.write(entry)
+    """
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = fmt or metadata_format(path)
+        self.count = 0
+        self._tmp_path = f"{path}.tmp{os.getpid()}"
+        if self.fmt == 'jsonl.gz':
+            self._file = gzip.open(self._tmp_path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(self._tmp_path, 'w', encoding='utf-8')
+
+    def write(self, entry):
+        """Append one record"""
+        if self.fmt == 'json':
+            text = json.dumps(entry, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+            self._file.write(("[\n  " if self.count == 0 else ",\n  ") + text)
+        else:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        """Finish the file and move it into place"""
+        if self._file is None:
+            return
+        if self.fmt == 'json':
+            self._file.write("[]" if self.count == 0 else "\n]")
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discard everything written so far"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_metadata(path, entries, fmt=None):
+    """
+    Write an iterable of records to a metadata file
+
+    Args:
+        path: Output path
+        entries: Iterable of dicts
+        fmt: Format override (default: from the suffix)
+
+    Returns:
+        int: Number of records written
+    """
+    with MetadataWriter(path, fmt) as writer:
+        for entry in entries:
+            writer.write(entry)
+    return writer.count
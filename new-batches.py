@@ -1,39 +1,103 @@
-import json
 import pandas as pd
 import os
-import shutil
-import random
+import numpy as np
 from collections import Counter
 
-def create_new_batches():
+from assignment_ledger import AssignmentLedger, default_ledger_dir
+from image_store import ImageStore, manifest_path, write_manifest
+from listing_store import open_listing_store
+from metadata_extract import ProductMetadata, read_metadata
+from metadata_io import find_metadata_file, iter_metadata, metadata_path, write_metadata
+from materialize import materialize_files
+from partition import image_sizes, partition_balanced
+from sampling import stratified_sample
+
+# Name this script reserves its ledger batches under
+LEDGER_OWNER = 'new-batches'
+
+def create_new_batches(seed=None, first_batch=None, num_batches=4, link_mode="copy", copy_workers=8, image_store_dir=None,
+                       metadata_format="json", replace=False, paths=None):
+    """
+    Sample new batches from products not used in earlier batches
+    
+    Args:
+        seed: Random seed for a reproducible selection
+        first_batch: Number of the first new batch (default: the one after the
+            last batch in the ledger). Every image already in the ledger is excluded.
+            Batches left pending by an interrupted run of this script are
+            resumed instead (with their own count), and an explicit, different
+            first_batch is an error
+        num_batches: Number of new batches to create
+        link_mode: How images are placed in batch dirs: "copy", "hardlink" or "reflink"
+        copy_workers: Number of threads materializing images
+        image_store_dir: Content-addressed image store; when set, batches are
+            written as batchN_manifest.jsonl files instead of image copies
+        metadata_format: Format of the new metadata files: "json", "jsonl" or "jsonl.gz"
+        replace: Regenerate batches first_batch.. even if the ledger already has them
+        paths: Optional overrides for the default paths, keyed by
+            'combined_listings', 'images_csv', 'images_dir' and 'batches_dir'
+    """
     # Paths
-    COMBINED_LISTINGS_PATH = "D:\\VR-Project\\combined_listings.json"
-    IMAGES_CSV_PATH = "D:\\VR-Project\\abo-images-small\\images\\metadata\\images.csv"
-    IMAGES_BASE_DIR = "D:\\VR-Project\\abo-images-small\\images\\small"
+    paths = paths or {}
+    COMBINED_LISTINGS_PATH = paths.get('combined_listings', "D:\\VR-Project\\combined_listings.json")
+    IMAGES_CSV_PATH = paths.get('images_csv', "D:\\VR-Project\\abo-images-small\\images\\metadata\\images.csv")
+    IMAGES_BASE_DIR = paths.get('images_dir', "D:\\VR-Project\\abo-images-small\\images\\small")
     
     # Base directory for all batches
-    OUTPUT_BASE_DIR = "D:\\VR-Project\\dataset-batches"
-    
-    # Existing batch metadata files
-    EXISTING_METADATA_FILES = [
-        os.path.join(OUTPUT_BASE_DIR, "batch1_metadata.json"),
-        os.path.join(OUTPUT_BASE_DIR, "batch2_metadata.json"),
-        os.path.join(OUTPUT_BASE_DIR, "batch3_metadata.json"),
-        os.path.join(OUTPUT_BASE_DIR, "batch4_metadata.json"),
-    ]
+    OUTPUT_BASE_DIR = paths.get('batches_dir', "D:\\VR-Project\\dataset-batches")
+    
+    # Images already handed out to a batch are tracked in an on-disk ledger
+    ledger = AssignmentLedger(default_ledger_dir(OUTPUT_BASE_DIR))
+    
+    # Batches that only exist as metadata files (e.g. made before the ledger) are imported once
+    batch_num = 1
+    metadata_file = find_metadata_file(OUTPUT_BASE_DIR, batch_num)
+    while metadata_file is not None:
+        if batch_num not in ledger.batches:
+            print(f"Importing batch {batch_num} into the ledger from {metadata_file}")
+            ledger.record(batch_num, (item['image_id'] for item in iter_metadata(metadata_file) if 'image_id' in item))
+        batch_num += 1
+        metadata_file = find_metadata_file(OUTPUT_BASE_DIR, batch_num)
+    
+    if replace and first_batch is not None:
+        # Forget the batches being regenerated (and anything reserved after them)
+        ledger.drop([num for num in ledger.batches if num >= first_batch])
+    
+    # Batches another tool (e.g. distribute.py) reserved stay assigned, but only that tool finishes them
+    other_pending = [num for num in ledger.pending_batches() if ledger.owner(num) != LEDGER_OWNER]
+    if other_pending:
+        print(f"Warning: batches {other_pending} were reserved by an unfinished run of another tool "
+              f"({', '.join(sorted({str(ledger.owner(num)) for num in other_pending}))}) and are left alone")
+    
+    # A run of this script that crashed after reserving its batches is finished with the same assignment
+    pending_batches = ledger.pending_batches(owner=LEDGER_OWNER)
+    if pending_batches:
+        if pending_batches != list(range(pending_batches[0], pending_batches[-1] + 1)):
+            raise ValueError(f"Pending batches {pending_batches} in {ledger.meta_path} are not contiguous; "
+                             f"regenerate them with first_batch={pending_batches[0]} and replace=True")
+        if first_batch is not None and first_batch != pending_batches[0]:
+            raise ValueError(f"Batches {pending_batches[0]}-{pending_batches[-1]} from an interrupted run are "
+                             f"pending; resume them with first_batch={pending_batches[0]} (or None) or "
+                             f"regenerate them with first_batch={pending_batches[0]} and replace=True")
+        if num_batches != len(pending_batches):
+            print(f"Resuming {len(pending_batches)} pending batches instead of num_batches={num_batches}")
+        first_batch, num_batches = pending_batches[0], len(pending_batches)
+        print(f"Resuming interrupted run for batches {pending_batches[0]}-{pending_batches[-1]}")
+    elif first_batch is None:
+        first_batch = ledger.next_batch()
     
     # New batch directories
+    last_batch = first_batch + num_batches - 1
     NEW_BATCH_DIRS = [
-        os.path.join(OUTPUT_BASE_DIR, "batch5"),
-        os.path.join(OUTPUT_BASE_DIR, "batch6"),
-        os.path.join(OUTPUT_BASE_DIR, "batch7"),
-        os.path.join(OUTPUT_BASE_DIR, "batch8")
+        os.path.join(OUTPUT_BASE_DIR, f"batch{i}") for i in range(first_batch, last_batch + 1)
     ]
     
-    # Create output directories for new batches
-    for batch_dir in NEW_BATCH_DIRS:
-        os.makedirs(batch_dir, exist_ok=True)
-        print(f"Created directory: {batch_dir}")
+    # Create output directories for new batches (not needed with the image store)
+    os.makedirs(OUTPUT_BASE_DIR, exist_ok=True)
+    if not image_store_dir:
+        for batch_dir in NEW_BATCH_DIRS:
+            os.makedirs(batch_dir, exist_ok=True)
+            print(f"Created directory: {batch_dir}")
     
     # Load images.csv for image paths
     print("Loading images.csv...")
@@ -41,138 +105,36 @@ def create_new_batches():
     image_path_map = dict(zip(images_df['image_id'], images_df['path']))
     print(f"Loaded {len(image_path_map)} image paths")
     
-    # Collect all image IDs that are already in existing batches
-    print("Collecting existing image IDs from batches 1-4...")
-    existing_image_ids = set()
-    for metadata_file in EXISTING_METADATA_FILES:
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-                for item in metadata:
-                    if 'image_id' in item:
-                        existing_image_ids.add(item['image_id'])
-    
-    print(f"Found {len(existing_image_ids)} existing image IDs in batches 1-4")
+    print(f"Ledger holds {len(ledger)} assigned images in {len(ledger.batches)} batches")
     
-    # Load combined listings
+    # Load combined listings from the columnar store (built on first use)
     print("Loading combined listings...")
-    products = []
-    with open(COMBINED_LISTINGS_PATH, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                product = json.loads(line.strip())
-                # Only include products with main_image_id that aren't already in existing batches
-                if ('main_image_id' in product and 
-                    product['main_image_id'] and 
-                    product['main_image_id'] in image_path_map and
-                    product['main_image_id'] not in existing_image_ids):
-                    products.append(product)
-            except json.JSONDecodeError:
-                continue
-    
-    print(f"Loaded {len(products)} valid products with images (excluding ones in existing batches)")
-    
-    # Get product type distribution
-    product_types = []
-    product_by_type = {}
-    
-    for product in products:
-        product_type = "Unknown"
-        if 'product_type' in product and product['product_type']:
-            product_type = product['product_type'][0]['value']
-        
-        product_types.append(product_type)
-        
-        if product_type not in product_by_type:
-            product_by_type[product_type] = []
-        
-        product_by_type[product_type].append(product)
-    
-    type_counts = Counter(product_types)
-    print(f"Found {len(type_counts)} unique product types in remaining products")
-    
-    # Calculate how many items to sample from each product type
-    total_samples = 20000  # Same as original batches
-    total_products = len(products)
-    
-    # Strategy for sampling similar to original script
-    selected_products = []
-    max_per_type = 200  # Cap for common types
-    min_per_type = 5    # Minimum for rare types
-    
-    # Sort product types by frequency
-    sorted_types = sorted(product_by_type.keys(), key=lambda x: len(product_by_type[x]), reverse=True)
-    
-    # First, take minimum samples from all types to ensure diversity
-    for product_type in sorted_types:
-        products_of_type = product_by_type[product_type].copy()  # Create a copy to modify
-        take_count = min(min_per_type, len(products_of_type))
-        
-        if take_count > 0:
-            sampled = random.sample(products_of_type, take_count)
-            selected_products.extend(sampled)
-            
-            # Remove the selected products from product_by_type
-            for p in sampled:
-                product_by_type[product_type].remove(p)
-    
-    print(f"Selected {len(selected_products)} products as minimum samples")
-    
-    # Calculate remaining samples needed
-    remaining_samples = total_samples - len(selected_products)
-    
-    # Calculate proportional allocation for remaining samples
-    total_remaining_products = sum(len(product_by_type[t]) for t in sorted_types)
-    
-    # Take proportional samples from each type, respecting max_per_type
-    for product_type in sorted_types:
-        if not product_by_type[product_type]:  # Skip if no products left
-            continue
-            
-        # Calculate proportional allocation
-        proportion = len(product_by_type[product_type]) / total_remaining_products if total_remaining_products > 0 else 0
-        allocation = int(remaining_samples * proportion)
-        
-        # Cap at max_per_type (including already taken minimum samples)
-        already_taken = sum(1 for p in selected_products 
-                           if 'product_type' in p and p['product_type'] 
-                           and p['product_type'][0]['value'] == product_type)
-        
-        max_additional = max_per_type - already_taken
-        if max_additional < 0:
-            max_additional = 0
+    store = open_listing_store(COMBINED_LISTINGS_PATH)
+    
+    if pending_batches:
+        # Same products, in the same batches, as the interrupted run
+        resumed_batch = {}
+        for batch_num in pending_batches:
+            for image_id in ledger.batch_ids(batch_num):
+                resumed_batch[image_id.decode()] = batch_num - first_batch
+        selected_products = store.products(store.rows_with_images(list(resumed_batch)))
+    else:
+        # Only include products with main_image_id that aren't already in existing batches
+        candidate_images = list(image_path_map)
+        assigned = ledger.contains(candidate_images)
+        candidate_images = [image_id for image_id, used in zip(candidate_images, assigned) if not used]
+        rows = store.rows_with_images(candidate_images)
         
-        take_count = min(allocation, max_additional, len(product_by_type[product_type]))
+        print(f"Loaded {len(rows)} valid products with images (excluding ones in existing batches)")
         
-        if take_count > 0:
-            sampled = random.sample(product_by_type[product_type], take_count)
-            selected_products.extend(sampled)
-            
-            # Remove the selected products
-            for p in sampled:
-                product_by_type[product_type].remove(p)
-    
-    print(f"Selected {len(selected_products)} products total after proportional allocation")
-    
-    # If we haven't reached our target, take more from types that still have products
-    if len(selected_products) < total_samples:
-        remaining_needed = total_samples - len(selected_products)
-        print(f"Need {remaining_needed} more products to reach target")
+        # Products without a product type are sampled as their own "Unknown" stratum
+        type_codes = np.asarray(store.column('product_type'))[rows]
+        print(f"Found {len(np.unique(type_codes))} unique product types in remaining products")
         
-        all_remaining = []
-        for product_type in sorted_types:
-            all_remaining.extend(product_by_type[product_type])
-        
-        if len(all_remaining) >= remaining_needed:
-            additional_samples = random.sample(all_remaining, remaining_needed)
-            selected_products.extend(additional_samples)
-        else:
-            # If we don't have enough remaining products, take all we have
-            selected_products.extend(all_remaining)
-    
-    # Shuffle the selected products
-    random.shuffle(selected_products)
-    selected_products = selected_products[:min(total_samples, len(selected_products))]
+        # Strategy for sampling similar to original script
+        total_samples = 20000  # Same as original batches
+        selected = stratified_sample(type_codes, total_samples=total_samples, min_per_type=5, max_per_type=200, seed=seed)
+        selected_products = store.products(rows[selected])
     
     print(f"Final selection: {len(selected_products)} products")
     
@@ -190,150 +152,105 @@ def create_new_batches():
     for product_type, count in final_type_counts.most_common(10):
         print(f"  {product_type}: {count}")
     
-    # Split into 4 balanced batches
-    batches = [[] for _ in range(4)]
-    
-    # Distribute products to ensure type diversity in each batch
-    product_types_list = list(final_type_counts.keys())
-    
-    for product_type in product_types_list:
-        # Get all products of this type
-        type_products = [p for p in selected_products if 
-                         'product_type' in p and 
-                         p['product_type'] and 
-                         p['product_type'][0]['value'] == product_type]
-        
-        # Distribute evenly across batches
-        products_per_batch = len(type_products) // 4
-        remainder = len(type_products) % 4
+    # Resolve each selected image and its size on disk
+    image_ids = [product['main_image_id'] for product in selected_products]
+    src_sizes = image_sizes([os.path.join(IMAGES_BASE_DIR, image_path_map[image_id]) for image_id in image_ids])
+    
+    if pending_batches:
+        assignments = [(index, resumed_batch[image_id]) for index, image_id in enumerate(image_ids)]
+    else:
+        # Split into balanced batches (by product type and image bytes)
+        print(f"Partitioning into {num_batches} batches...")
+        assignments = list(partition_balanced(
+            final_types,
+            num_batches,
+            sizes=src_sizes,
+            keys=image_ids,
+            assignments_file=os.path.join(OUTPUT_BASE_DIR, f"batch{first_batch}-{last_batch}_assignments.csv")
+        ))
         
-        start_idx = 0
-        for i in range(4):
-            take_count = products_per_batch + (1 if i < remainder else 0)
-            end_idx = start_idx + take_count
-            batches[i].extend(type_products[start_idx:end_idx])
-            start_idx = end_idx
+        # Reserve the whole assignment before copying anything, so a crash
+        # can neither lose it nor hand the same images out again
+        batch_images = {batch_num: [] for batch_num in range(first_batch, last_batch + 1)}
+        for index, batch_idx in assignments:
+            batch_images[first_batch + batch_idx].append(image_ids[index])
+        ledger.reserve(batch_images, owner=LEDGER_OWNER)
     
-    # Verify batch sizes
-    for i in range(4):
-        print(f"Batch {i+5} size: {len(batches[i])}")
+    # One copy job per image, bucketed by batch so each metadata file is one pass over its jobs
+    print(f"Materializing images ({link_mode})...")
     
-    # Copy images to batch directories and create metadata
-    for batch_idx, batch in enumerate(batches):
+    batch_sizes = [0] * num_batches
+    
+    batch_jobs = [[] for _ in range(num_batches)]
+    for index, batch_idx in assignments:
+        batch_sizes[batch_idx] += 1
         batch_dir = NEW_BATCH_DIRS[batch_idx]
-        batch_num = batch_idx + 5  # Batch numbers 5-8
-        
-        print(f"Copying images to {batch_dir}...")
-        
-        # Prepare metadata for this batch
-        batch_metadata = []
+        image_id = selected_products[index]['main_image_id']
         
-        for product in batch:
-            image_id = product['main_image_id']
+        # Get image path
+        if image_id in image_path_map:
+            src_path = os.path.join(IMAGES_BASE_DIR, image_path_map[image_id])
             
-            # Get image path
-            if image_id in image_path_map:
-                src_path = os.path.join(IMAGES_BASE_DIR, image_path_map[image_id])
-                
-                # Extract file extension
-                _, ext = os.path.splitext(src_path)
-                if not ext:  # If no extension, default to .jpg
-                    ext = ".jpg"
-                
-                # Create destination path
-                dst_path = os.path.join(batch_dir, f"{image_id}{ext}")
-                
-                # Copy the file
-                try:
-                    shutil.copy2(src_path, dst_path)
-                    
-                    # Create metadata entry
-                    metadata_entry = {
-                        'item_id': product.get('item_id', ''),
-                        'image_id': image_id,
-                        'image_path': image_path_map.get(image_id, '')
-                    }
-                    
-                    # Add brand info
-                    if 'brand' in product and product['brand']:
-                        brand_entry = product['brand'][0]
-                        metadata_entry['brand'] = brand_entry.get('value', '')
-                        if 'language_tag' in brand_entry:
-                            metadata_entry['brand_language'] = brand_entry['language_tag']
-                    
-                    # Add item name
-                    if 'item_name' in product and product['item_name']:
-                        name_entry = product['item_name'][0]
-                        metadata_entry['item_name'] = name_entry.get('value', '')
-                        if 'language_tag' in name_entry:
-                            metadata_entry['name_language'] = name_entry['language_tag']
-                    
-                    # Add color
-                    if 'color' in product and product['color']:
-                        color_entry = product['color'][0]
-                        metadata_entry['color'] = color_entry.get('value', '')
-                    
-                    # Add product type
-                    if 'product_type' in product and product['product_type']:
-                        metadata_entry['product_type'] = product['product_type'][0].get('value', '')
-                    
-                    # Add bullet points (features)
-                    if 'bullet_point' in product and product['bullet_point']:
-                        bullet_points = []
-                        for bp in product['bullet_point']:
-                            if 'value' in bp:
-                                bullet_points.append(bp['value'])
-                        metadata_entry['features'] = bullet_points
-                    
-                    # Add style
-                    if 'style' in product and product['style']:
-                        metadata_entry['style'] = product['style'][0].get('value', '')
-                    
-                    # Add material
-                    if 'material' in product and product['material']:
-                        metadata_entry['material'] = product['material'][0].get('value', '')
-                    
-                    # Add weight
-                    if 'item_weight' in product and product['item_weight']:
-                        weight_entry = product['item_weight'][0]
-                        if 'value' in weight_entry:
-                            metadata_entry['weight'] = weight_entry['value']
-                            if 'unit' in weight_entry:
-                                metadata_entry['weight_unit'] = weight_entry['unit']
-                    
-                    # Add dimensions
-                    if 'item_dimensions' in product and product['item_dimensions']:
-                        dims = {}
-                        for dim_type in ['height', 'width', 'length']:
-                            if dim_type in product['item_dimensions']:
-                                dim_entry = product['item_dimensions'][dim_type]
-                                if 'value' in dim_entry:
-                                    dims[dim_type] = {
-                                        'value': dim_entry['value'],
-                                        'unit': dim_entry.get('unit', '')
-                                    }
-                        if dims:
-                            metadata_entry['dimensions'] = dims
-                    
-                    # Add local file path relative to batch directory
-                    metadata_entry['local_path'] = f"{image_id}{ext}"
-                    
-                    batch_metadata.append(metadata_entry)
-                    
-                except Exception as e:
-                    print(f"Error copying {image_id}: {str(e)}")
+            # Extract file extension
+            _, ext = os.path.splitext(src_path)
+            if not ext:  # If no extension, default to .jpg
+                ext = ".jpg"
+            
+            # Create destination path
+            dst_path = os.path.join(batch_dir, f"{image_id}{ext}")
+            batch_jobs[batch_idx].append((index, image_id, src_path, dst_path))
+    jobs = [job for jobs_in_batch in batch_jobs for job in jobs_in_batch]
+    
+    if image_store_dir:
+        # Each image is stored once by content; a batch is just a manifest
+        image_store = ImageStore(image_store_dir)
+        blobs, _ = image_store.add_many(((image_id, src_path) for _, image_id, src_path, _ in jobs),
+                                        workers=copy_workers)
+        failed = {dst_path for _, image_id, _, dst_path in jobs if image_id not in blobs}
+    else:
+        # Files already in place (same size and mtime) are skipped, so a rerun
+        # only copies what is missing
+        stats = materialize_files(((src_path, dst_path) for _, _, src_path, dst_path in jobs),
+                                  mode=link_mode, workers=copy_workers)
+        failed = {dst_path for _, dst_path, _ in stats['failed']}
+    
+    def kept_entries(batch_idx):
+        # Metadata is only kept for images that made it into their batch, and
+        # is built one entry at a time as the file is written
+        for index, image_id, _, dst_path in batch_jobs[batch_idx]:
+            if dst_path in failed:
+                continue
+            # Only the sampled products are parsed, and only their metadata fields
+            record = read_metadata(store, image_id) or ProductMetadata.from_product(selected_products[index])
+            yield record.to_entry(image_id, image_path_map.get(image_id, ''), os.path.basename(dst_path))
+    
+    for batch_idx, batch_dir in enumerate(NEW_BATCH_DIRS):
+        batch_num = batch_idx + first_batch
+        print(f"Batch {batch_num} size: {batch_sizes[batch_idx]}")
         
-        # Save metadata to JSON file
-        output_path = os.path.join(OUTPUT_BASE_DIR, f"batch{batch_num}_metadata.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(batch_metadata, f, indent=2, ensure_ascii=False)
+        # Stream metadata to the batch's metadata file
+        output_path = metadata_path(OUTPUT_BASE_DIR, batch_num, metadata_format)
+        entry_count = write_metadata(output_path, kept_entries(batch_idx))
         
-        # Count files in batch directory
-        file_count = len(os.listdir(batch_dir))
-        print(f"Batch {batch_num} contains {file_count} images")
-        print(f"Created metadata file for batch {batch_num} with {len(batch_metadata)} entries")
+        if image_store_dir:
+            path = manifest_path(OUTPUT_BASE_DIR, batch_num)
+            file_count = write_manifest(path, ({'image_id': image_id,
+                                                'blob': blobs[image_id],
+                                                'local_path': os.path.basename(dst_path)}
+                                               for _, image_id, _, dst_path in batch_jobs[batch_idx]
+                                               if dst_path not in failed))
+            print(f"Batch {batch_num} manifest lists {file_count} images at {path}")
+        else:
+            # Count files in batch directory
+            file_count = len(os.listdir(batch_dir))
+            print(f"Batch {batch_num} contains {file_count} images")
+        print(f"Created metadata file for batch {batch_num} with {entry_count} entries")
+    
+    # Every metadata record has been read
+    store.close()
     
-    print("Done creating new batches 5-8!")
+    ledger.commit(range(first_batch, last_batch + 1))
+    print(f"Done creating new batches {first_batch}-{last_batch}!")
 
 if __name__ == "__main__":
     create_new_batches()
\ No newline at end of file
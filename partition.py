@@ -0,0 +1,89 @@
+import heapq
+import os
+
+def _image_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def image_sizes(image_paths):
+    """
+    On-disk size of each image, 0 for missing files
+
+    Args:
+        image_paths: Source image paths
+
+    Returns:
+        list: Sizes in bytes
+    """
+    return [_image_size(path) for path in image_paths]
+
+def partition_balanced(type_labels, num_batches, sizes=None, keys=None, assignments_file=None):
+    """
+    Split products into K batches balanced by product type and image bytes
+
+    Products are grouped by type in a single pass. Each type is then spread
+    as evenly as possible across the batches (counts differ by at most one),
+    with the extra items going to the batches holding the fewest bytes, and
+    within a type the largest images are placed first into the lightest
+    batch that still has room for that type. Types are processed largest
+    first, so the bulk is placed before the small types fine-tune balance.
+
+    Assignments are yielded as they are made, and optionally appended to a
+    CSV (index,batch[,key]) flushed after every type, so a copy stage can
+    consume them before partitioning finishes.
+
+    Args:
+        type_labels: Type label or code per product (any hashable)
+        num_batches: Number of batches K
+        sizes: Image bytes per product (None treats every product as 1)
+        keys: Optional identifier per product written to the CSV (e.g. image_id)
+        assignments_file: Optional CSV path for the streamed assignments
+
+    Yields:
+        tuple: (product index, batch index)
+    """
+    if num_batches < 1:
+        raise ValueError("num_batches must be at least 1")
+
+    # Group product indices by type in one pass
+    groups = {}
+    for index, label in enumerate(type_labels):
+        groups.setdefault(label, []).append(index)
+
+    batch_bytes = [0] * num_batches
+    out = open(assignments_file, 'w', encoding='utf-8') if assignments_file else None
+    try:
+        if out:
+            out.write("index,batch,key\n" if keys is not None else "index,batch\n")
+
+        for label in sorted(groups, key=lambda x: len(groups[x]), reverse=True):
+            indices = groups[label]
+            if sizes is not None:
+                indices = sorted(indices, key=lambda i: sizes[i], reverse=True)
+
+            # Even per-type quotas; the remainder goes to the lightest batches
+            base, remainder = divmod(len(indices), num_batches)
+            by_load = sorted(range(num_batches), key=lambda b: batch_bytes[b])
+            quota = [base] * num_batches
+            for b in by_load[:remainder]:
+                quota[b] += 1
+
+            heap = [(batch_bytes[b], b) for b in range(num_batches) if quota[b] > 0]
+            heapq.heapify(heap)
+            for index in indices:
+                _, b = heapq.heappop(heap)
+                batch_bytes[b] += sizes[index] if sizes is not None else 1
+                quota[b] -= 1
+                if quota[b] > 0:
+                    heapq.heappush(heap, (batch_bytes[b], b))
+                if out:
+                    out.write(f"{index},{b},{keys[index]}\n" if keys is not None else f"{index},{b}\n")
+                yield index, b
+
+            if out:
+                out.flush()
+    finally:
+        if out:
+            out.close()
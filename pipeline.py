@@ -0,0 +1,360 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from assignment_ledger import AssignmentLedger, default_ledger_dir
+from combine import find_listing_files
+from image_store import manifest_path
+from listing_store import default_store_dir
+from metadata_io import metadata_path
+
+# Bump when stage behaviour changes so every stage reruns once
+PIPELINE_VERSION = 1
+
+DEFAULT_CONFIG = {
+    'metadata_dir': "D:\\VR-Project\\abo-listings\\listings\\metadata\\listings",
+    'combined_listings': "D:\\VR-Project\\combined_listings.json",
+    'images_csv': "D:\\VR-Project\\abo-images-small\\images\\metadata\\images.csv",
+    'images_dir': "D:\\VR-Project\\abo-images-small\\images\\small",
+    'batches_dir': "D:\\VR-Project\\dataset-batches",
+    'seed': 42,
+    'num_batches': 4,
+    'num_new_batches': 4,
+    'link_mode': 'copy',
+    'copy_workers': 8,
+    'image_store_dir': None,
+    'metadata_format': 'json',
+    'workers': None
+}
+
+def _paths(config):
+    return {key: config[key] for key in ('combined_listings', 'images_csv', 'images_dir', 'batches_dir')}
+
+def _store_meta(config):
+    return os.path.join(default_store_dir(config['combined_listings']), 'meta.json')
+
+def _first_batches(config):
+    return range(1, config['num_batches'] + 1)
+
+def _new_batches(config):
+    first = config['num_batches'] + 1
+    return range(first, first + config['num_new_batches'])
+
+def _ledger_arrays(config, batch_nums):
+    ledger_dir = default_ledger_dir(config['batches_dir'])
+    return [os.path.join(ledger_dir, f"batch{num}.npy") for num in batch_nums]
+
+def _batch_outputs(config, batch_nums):
+    # The batch image directories, or their manifests when images live in the image store
+    if config['image_store_dir']:
+        return [manifest_path(config['batches_dir'], num) for num in batch_nums]
+    return [os.path.join(config['batches_dir'], f"batch{num}") for num in batch_nums]
+
+def _load_new_batches_module():
+    # new-batches.py isn't importable by name because of the hyphen
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'new-batches.py')
+    spec = importlib.util.spec_from_file_location('new_batches', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Stage bodies. Imports are local so each worker process only loads what
+# its stage needs. Resumable stages also get whether the last attempt with
+# the same fingerprint was interrupted.
+
+def _run_combine(config):
+    from combine import combine_listing_files_parallel
+    if not find_listing_files(config['metadata_dir']) and os.path.exists(config['combined_listings']):
+        print(f"No listing shards in {config['metadata_dir']}, keeping {config['combined_listings']}")
+        return
+    combine_listing_files_parallel(config['metadata_dir'], config['combined_listings'], workers=config['workers'])
+
+def _run_store(config):
+    from listing_store import open_listing_store
+    open_listing_store(config['combined_listings']).close()
+
+def _run_analyze(config):
+    from analysis import analyze_listings
+    analyze_listings(config['combined_listings'], use_store=True, workers=config['workers'])
+
+def _run_distribute(config):
+    from distribute import create_diverse_image_batches
+    create_diverse_image_batches(
+        seed=config['seed'],
+        num_batches=config['num_batches'],
+        link_mode=config['link_mode'],
+        copy_workers=config['copy_workers'],
+        image_store_dir=config['image_store_dir'],
+        paths=_paths(config)
+    )
+
+def _run_new_batches(config, resume):
+    module = _load_new_batches_module()
+    # Batches an interrupted attempt reserved are finished with the same
+    # assignment; otherwise (new config or inputs, deleted outputs, forced)
+    # the new batches are regenerated
+    ledger = AssignmentLedger(default_ledger_dir(config['batches_dir']))
+    resume = resume and bool(ledger.pending_batches(owner=module.LEDGER_OWNER))
+    module.create_new_batches(
+        seed=config['seed'],
+        first_batch=config['num_batches'] + 1,
+        num_batches=config['num_new_batches'],
+        link_mode=config['link_mode'],
+        copy_workers=config['copy_workers'],
+        image_store_dir=config['image_store_dir'],
+        metadata_format=config['metadata_format'],
+        replace=not resume,
+        paths=_paths(config)
+    )
+
+def _run_batchmeta(config):
+    from batchmeta import create_batch_metadata_files
+    create_batch_metadata_files(
+        metadata_format=config['metadata_format'],
+        batch_nums=_first_batches(config),
+        paths=_paths(config)
+    )
+
+# Stage graph, in dependency order. Each stage lists the config keys and
+# input files that determine its result and the files (or directories) it
+# produces.
+STAGES = {
+    'combine': {
+        'deps': [],
+        'config': ['metadata_dir', 'combined_listings'],
+        'inputs': lambda config: find_listing_files(config['metadata_dir']),
+        'outputs': lambda config: [config['combined_listings']],
+        'run': _run_combine
+    },
+    'store': {
+        'deps': ['combine'],
+        'config': [],
+        'inputs': lambda config: [config['combined_listings']],
+        'outputs': lambda config: [_store_meta(config)],
+        'run': _run_store
+    },
+    'analyze': {
+        'deps': ['store'],
+        'config': [],
+        'inputs': lambda config: [config['combined_listings'], _store_meta(config)],
+        'outputs': lambda config: [os.path.join('analysis_results', name) for name in
+                                   ('product_types.csv', 'product_types.png', 'brands.png', 'countries.png')],
+        'run': _run_analyze
+    },
+    'distribute': {
+        'deps': ['store'],
+        'config': ['seed', 'num_batches', 'link_mode', 'image_store_dir', 'images_dir', 'batches_dir'],
+        'inputs': lambda config: [config['combined_listings'], _store_meta(config), config['images_csv']],
+        'outputs': lambda config: (
+            [os.path.join(config['batches_dir'], 'batch_assignments.csv')] +
+            _ledger_arrays(config, _first_batches(config)) +
+            _batch_outputs(config, _first_batches(config))
+        ),
+        'run': _run_distribute
+    },
+    'new_batches': {
+        'deps': ['distribute'],
+        'config': ['seed', 'num_batches', 'num_new_batches', 'link_mode', 'image_store_dir',
+                   'images_dir', 'batches_dir', 'metadata_format'],
+        'inputs': lambda config: (
+            [config['combined_listings'], _store_meta(config), config['images_csv']] +
+            _ledger_arrays(config, _first_batches(config))
+        ),
+        'outputs': lambda config: (
+            [metadata_path(config['batches_dir'], num, config['metadata_format']) for num in _new_batches(config)] +
+            _ledger_arrays(config, _new_batches(config)) +
+            _batch_outputs(config, _new_batches(config))
+        ),
+        'run': _run_new_batches,
+        'resumable': True
+    },
+    'batchmeta': {
+        'deps': ['distribute'],
+        'config': ['num_batches', 'batches_dir', 'metadata_format'],
+        'inputs': lambda config: (
+            [config['combined_listings'], _store_meta(config), config['images_csv']] +
+            _ledger_arrays(config, _first_batches(config))
+        ),
+        'outputs': lambda config: [metadata_path(config['batches_dir'], num, config['metadata_format'])
+                                   for num in _first_batches(config)],
+        'run': _run_batchmeta
+    }
+}
+
+def _file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def stage_fingerprint(name, config):
+    """
+    Fingerprint of everything a stage's result depends on
+
+    Args:
+        name: Stage name
+        config: Pipeline configuration
+
+    Returns:
+        str: SHA-256 over the stage's config values and input file stats
+    """
+    stage = STAGES[name]
+    payload = {
+        'version': PIPELINE_VERSION,
+        'stage': name,
+        'config': {key: config[key] for key in stage['config']},
+        'inputs': [[os.path.abspath(path), _file_stat(path)] for path in stage['inputs'](config)]
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _is_valid(name, config, fingerprint, state):
+    """A stage can be skipped if its fingerprint matches and its outputs are untouched"""
+    record = state.get(name)
+    if record is None or record.get('fingerprint') != fingerprint:
+        return False
+    return all(_file_stat(path) == stat and stat is not None for path, stat in record['outputs'].items())
+
+def load_state(state_file):
+    """Per-stage fingerprints and output stats from the last runs"""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    """Atomically write the pipeline state"""
+    tmp_path = f"{state_file}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_file)
+
+def _run_stage(name, config, resume=False):
+    start = time.perf_counter()
+    if STAGES[name].get('resumable'):
+        STAGES[name]['run'](config, resume)
+    else:
+        STAGES[name]['run'](config)
+    return time.perf_counter() - start
+
+def _required_stages(targets, config):
+    """Targets plus everything they depend on, in graph order"""
+    if config['num_new_batches'] <= 0:
+        targets = [name for name in targets if name != 'new_batches']
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name]['deps'])
+    return [name for name in STAGES if name in needed]
+
+def run_pipeline(config=None, targets=None, force=(), parallel=3, state_file=None):
+    """
+    Run the data pipeline, skipping stages whose outputs are still valid
+
+    A stage is rerun when its configuration, any input file (size or
+    mtime) or any recorded output changed, or when it is forced. Stages
+    start as soon as their dependencies are done, each in its own process,
+    so independent stages (e.g. analysis and batch creation) overlap. A
+    stage that was interrupted is resumed when its fingerprint is unchanged
+    (new_batches finishes the batches the interrupted run reserved).
+
+    Args:
+        config: Overrides for DEFAULT_CONFIG
+        targets: Stages to bring up to date (default: all)
+        force: Stage names to rerun regardless of their fingerprint
+        parallel: Maximum number of stages running at once
+        state_file: Where stage fingerprints are kept (default: in batches_dir)
+
+    Returns:
+        dict: {stage: 'skipped' or seconds taken}
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    unknown = (set(force) | set(targets or [])) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+    names = _required_stages(list(targets or STAGES), config)
+
+    os.makedirs(config['batches_dir'], exist_ok=True)
+    state_file = state_file or os.path.join(config['batches_dir'], 'pipeline_state.json')
+    state = load_state(state_file)
+
+    results = {}
+    started = set()
+    running = {}
+    failed = None
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=parallel) as executor:
+        while True:
+            # Start (or skip) every stage whose dependencies are done
+            scheduled = True
+            while scheduled and failed is None:
+                scheduled = False
+                for name in names:
+                    if name in started:
+                        continue
+                    if not all(dep in results for dep in STAGES[name]['deps'] if dep in names):
+                        continue
+                    started.add(name)
+                    fingerprint = stage_fingerprint(name, config)
+                    if name not in force and _is_valid(name, config, fingerprint, state):
+                        print(f"[pipeline] {name}: up to date, skipping")
+                        results[name] = 'skipped'
+                        scheduled = True
+                        continue
+                    # Remember the attempt, so an interrupted one can be resumed
+                    record = state.get(name, {})
+                    resume = name not in force and record.get('started') == fingerprint
+                    state[name] = dict(record, started=fingerprint)
+                    save_state(state_file, state)
+                    print(f"[pipeline] {name}: {'resuming' if resume else 'running'}")
+                    running[executor.submit(_run_stage, name, config, resume)] = (name, fingerprint)
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, fingerprint = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"[pipeline] {name}: failed: {e}")
+                    failed = failed or (name, e)
+                    continue
+                state[name] = {
+                    'fingerprint': fingerprint,
+                    'outputs': {path: _file_stat(path) for path in STAGES[name]['outputs'](config)}
+                }
+                save_state(state_file, state)
+                print(f"[pipeline] {name}: done in {results[name]:.1f}s")
+
+    if failed is not None:
+        raise RuntimeError(f"Pipeline stage {failed[0]} failed") from failed[1]
+
+    print(f"[pipeline] Finished in {time.perf_counter() - start:.1f}s:")
+    for name in names:
+        outcome = results.get(name)
+        print(f"  {name}: {outcome if outcome == 'skipped' else f'{outcome:.1f}s'}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ABO dataset pipeline")
+    parser.add_argument('targets', nargs='*', help=f"Stages to bring up to date (default: all of {', '.join(STAGES)})")
+    parser.add_argument('--config', help="JSON file with overrides for the default paths and settings")
+    parser.add_argument('--force', nargs='+', default=[], choices=list(STAGES), help="Stages to rerun anyway")
+    parser.add_argument('--parallel', type=int, default=3, help="Maximum number of stages running at once")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+    run_pipeline(config, targets=args.targets or None, force=args.force, parallel=args.parallel)
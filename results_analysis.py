@@ -0,0 +1,287 @@
+import argparse
+import re
+
+import pandas as pd
+
+from metadata_io import iter_metadata
+
+# Question types in the order extract_question_type tries them; the first
+# pattern that matches wins
+QUESTION_PATTERNS = [
+    ('what color', r'^what colou?r'),
+    ('what shape', r'^what shape'),
+    ('what pattern', r'^what pattern'),
+    ('what material', r'^what material'),
+    ('what type', r'^what (type|kind)'),
+    ('what is', r'^what is'),
+    ('what', r'^what'),
+    ('how many', r'^how many'),
+    ('is there', r'^is there'),
+    ('are there', r'^are there'),
+    ('does', r'^does'),
+    ('is the', r'^is the'),
+    ('are the', r'^are the'),
+    ('can', r'^can'),
+    ('where', r'^where')
+]
+
+def _combined_pattern():
+    # One anchored alternation with a named group per type. Alternatives
+    # are tried left to right, so the first matching type still wins.
+    alternatives = []
+    for idx, (_, pattern) in enumerate(QUESTION_PATTERNS):
+        body = pattern[1:].replace('(', '(?:')
+        alternatives.append(f"(?P<t{idx}>{body})")
+    return re.compile('^(?:' + '|'.join(alternatives) + ')')
+
+_QUESTION_TYPE_RE = _combined_pattern()
+
+def classify_question_types(questions):
+    """
+    Question type for a whole column at once
+
+    Same result as the notebook's extract_question_type applied row by row:
+    the first matching pattern, else the first word, else 'unknown'.
+
+    Args:
+        questions: Series of question strings
+
+    Returns:
+        pd.Series: Question type per row (same index)
+    """
+    normalized = questions.fillna('').astype(str).str.lower().str.strip()
+    matches = normalized.str.extract(_QUESTION_TYPE_RE)
+    names = [name for name, _ in QUESTION_PATTERNS]
+    matched = matches.notna()
+    types = pd.Series(pd.NA, index=questions.index, dtype=object)
+    any_match = matched.any(axis=1)
+    if any_match.any():
+        first = matched[any_match].to_numpy().argmax(axis=1)
+        types[any_match] = [names[idx] for idx in first]
+    fallback = normalized.str.split().str[0].fillna('unknown')
+    return types.fillna(fallback)
+
+def model_variants(results_df):
+    """Model names with a <name>_Prediction column, in column order"""
+    return [column[:-len('_Prediction')] for column in results_df.columns if column.endswith('_Prediction')]
+
+def attach_questions(results_df, qa_file):
+    """
+    Add Question and Question_Type columns from the eval QA file
+
+    Args:
+        results_df: Results table in dataset order (e.g. vqa_results.csv)
+        qa_file: The QA file it was evaluated on (e.g. batch4_qa_dataset.json)
+
+    Returns:
+        pd.DataFrame: results_df (modified in place)
+    """
+    questions = [qa_pair['question'] for item in iter_metadata(qa_file) for qa_pair in item['qa_pairs']]
+    print(f"Loaded {len(questions)} questions from {qa_file}")
+    if len(questions) != len(results_df):
+        raise ValueError(f"Number of questions ({len(questions)}) doesn't match results ({len(results_df)})")
+    results_df['Question'] = questions
+    results_df['Question_Type'] = classify_question_types(results_df['Question'])
+    return results_df
+
+def _improvement_names(variants):
+    # Two models keep the notebook's column names; more get one set per model
+    others = variants[1:]
+    if len(others) == 1:
+        return {others[0]: ''}
+    return {variant: f'{variant}_' for variant in others}
+
+def performance_by_type(results_df, variants=None):
+    """
+    Accuracy and BERTScore per question type
+
+    Args:
+        results_df: Results with Question_Type, <variant>_Correct and
+            optionally <variant>_BERTScore_F1 columns
+        variants: Model names (default: every <name>_Prediction column); the
+            first is the reference for the improvement columns
+
+    Returns:
+        pd.DataFrame: One row per question type, sorted by the (first)
+            accuracy improvement
+    """
+    variants = variants or model_variants(results_df)
+    aggregations = {}
+    for variant in variants:
+        aggregations[f'{variant}_Correct'] = 'mean'
+        if f'{variant}_BERTScore_F1' in results_df:
+            aggregations[f'{variant}_BERTScore_F1'] = 'mean'
+    performance = results_df.groupby('Question_Type').agg(aggregations).reset_index()
+
+    reference = variants[0]
+    sort_column = None
+    for variant, prefix in _improvement_names(variants).items():
+        performance[f'{prefix}Accuracy_Improvement'] = performance[f'{variant}_Correct'] - performance[f'{reference}_Correct']
+        if f'{variant}_BERTScore_F1' in performance and f'{reference}_BERTScore_F1' in performance:
+            performance[f'{prefix}BERTScore_Improvement'] = (performance[f'{variant}_BERTScore_F1'] -
+                                                             performance[f'{reference}_BERTScore_F1'])
+        performance[f'{prefix}Relative_Accuracy_Improvement'] = (performance[f'{prefix}Accuracy_Improvement'] /
+                                                                  performance[f'{reference}_Correct'])
+        if f'{prefix}BERTScore_Improvement' in performance:
+            performance[f'{prefix}Relative_BERTScore_Improvement'] = (performance[f'{prefix}BERTScore_Improvement'] /
+                                                                       performance[f'{reference}_BERTScore_F1'])
+        sort_column = sort_column or f'{prefix}Accuracy_Improvement'
+
+    if sort_column is None:
+        return performance
+    return performance.sort_values(sort_column, ascending=False)
+
+def top_errors(results_df, variant, types, top_n=5):
+    """
+    Most frequent ground truth → wrong prediction pairs per question type
+
+    Ties are broken like the notebook's Counter-based version: by the
+    ground truth's first appearance in the type, then by the pair's.
+
+    Args:
+        results_df: Results with Question_Type, Ground_Truth and <variant>_Prediction
+        variant: Model name
+        types: Question types to report
+        top_n: Pairs per type
+
+    Returns:
+        dict: {question type: [(ground truth, prediction, count), ...]}
+    """
+    df = pd.DataFrame({
+        'type': results_df['Question_Type'].to_numpy(),
+        'gt': results_df['Ground_Truth'].fillna('').astype(str).to_numpy(),
+        'pred': results_df[f'{variant}_Prediction'].fillna('').astype(str).to_numpy(),
+    })
+    df['position'] = range(len(df))
+    df = df[df['type'].isin(types)]
+
+    pairs = df.groupby(['type', 'gt', 'pred'], sort=False).agg(count=('position', 'size'),
+                                                              pair_first=('position', 'min')).reset_index()
+    gt_first = df.groupby(['type', 'gt'], sort=False)['position'].min().rename('gt_first').reset_index()
+    pairs = pairs.merge(gt_first, on=['type', 'gt'])
+    pairs = pairs[pairs['gt'].str.lower() != pairs['pred'].str.lower()]
+    pairs = pairs.sort_values(['type', 'count', 'gt_first', 'pair_first'], ascending=[True, False, True, True])
+    pairs = pairs.groupby('type', sort=False).head(top_n)
+
+    errors = {question_type: [] for question_type in types}
+    for question_type, gt, pred, count in zip(pairs['type'], pairs['gt'], pairs['pred'], pairs['count']):
+        errors[question_type].append((gt, pred, int(count)))
+    return errors
+
+def analyze_question_type_errors(results_df, variants=None, min_examples=10, top_n=5):
+    """
+    Per-type accuracy, BERTScore and top errors for every model
+
+    Args:
+        results_df: Results with Question_Type, Ground_Truth and per-model columns
+        variants: Model names (default: every <name>_Prediction column)
+        min_examples: Skip question types with fewer examples
+        top_n: Error pairs per type and model
+
+    Returns:
+        list: One dict per question type with count and, per model,
+            <model>_accuracy, <model>_bert and <model>_top_errors (lower-cased
+            model names, e.g. baseline_accuracy); sorted by the second model's
+            improvement over the first
+    """
+    variants = variants or model_variants(results_df)
+    counts = results_df['Question_Type'].value_counts()
+    types = [question_type for question_type, count in counts.items() if count >= max(min_examples, 5)]
+
+    grouped = results_df[results_df['Question_Type'].isin(types)].groupby('Question_Type')
+    accuracy = grouped[[f'{variant}_Correct' for variant in variants]].mean()
+    bert_columns = [f'{variant}_BERTScore_F1' for variant in variants if f'{variant}_BERTScore_F1' in results_df]
+    bert = grouped[bert_columns].mean() if bert_columns else None
+    errors = {variant: top_errors(results_df, variant, types, top_n) for variant in variants}
+
+    analyses = []
+    for question_type in types:
+        analysis = {'question_type': question_type, 'count': int(counts[question_type])}
+        for variant in variants:
+            key = variant.lower()
+            analysis[f'{key}_accuracy'] = accuracy.at[question_type, f'{variant}_Correct']
+            analysis[f'{key}_top_errors'] = errors[variant][question_type]
+            if bert is not None and f'{variant}_BERTScore_F1' in bert:
+                analysis[f'{key}_bert'] = bert.at[question_type, f'{variant}_BERTScore_F1']
+        analyses.append(analysis)
+
+    if len(variants) > 1:
+        first, second = variants[0].lower(), variants[1].lower()
+        analyses.sort(key=lambda x: x[f'{second}_accuracy'] - x[f'{first}_accuracy'], reverse=True)
+    return analyses
+
+def print_error_report(analyses, results_df, variants=None, examples=3):
+    """
+    Print the per-type report (accuracy, BERTScore, top errors, fixed/worsened examples)
+
+    Args:
+        analyses: Output of analyze_question_type_errors
+        results_df: The results table (for example questions)
+        variants: Model names (default: every <name>_Prediction column)
+        examples: Fixed / worsened examples shown per type and model
+    """
+    variants = variants or model_variants(results_df)
+    reference = variants[0]
+    by_type = {question_type: rows for question_type, rows in results_df.groupby('Question_Type')}
+
+    for analysis in analyses:
+        qt = analysis['question_type']
+        count = analysis['count']
+        print(f"\n==== Question Type: {qt} ({count} examples) ====")
+        for variant in variants:
+            print(f"{variant} Accuracy: {analysis[f'{variant.lower()}_accuracy']:.4f}")
+        ref_acc = analysis[f'{reference.lower()}_accuracy']
+        for variant in variants[1:]:
+            improvement = analysis[f'{variant.lower()}_accuracy'] - ref_acc
+            print(f"Improvement ({variant}): {improvement:.4f} ({improvement/ref_acc*100 if ref_acc > 0 else 0:.1f}%)")
+        if f'{reference.lower()}_bert' in analysis:
+            print("BERTScore: " + " → ".join(f"{variant} {analysis[f'{variant.lower()}_bert']:.4f}"
+                                             for variant in variants if f'{variant.lower()}_bert' in analysis))
+
+        for variant in variants:
+            print(f"\nTop {variant} Errors (Ground Truth → Incorrect Prediction):")
+            for gt, pred, error_count in analysis[f'{variant.lower()}_top_errors']:
+                print(f"  '{gt}' → '{pred}': {error_count} times ({error_count/count:.1%})")
+
+        print("\nExamples of fixed/worsened answers:")
+        rows = by_type[qt]
+        for variant in variants[1:]:
+            for label, mask in (
+                (f"{variant} fixed {reference} errors", ~rows[f'{reference}_Correct'] & rows[f'{variant}_Correct']),
+                (f"{variant} worsened {reference} correct answers", rows[f'{reference}_Correct'] & ~rows[f'{variant}_Correct'])
+            ):
+                selected = rows[mask].head(examples)
+                if selected.empty:
+                    continue
+                print(f"  Examples where {label}:")
+                for row in selected.to_dict('records'):
+                    print(f"    Q: '{row['Question']}'")
+                    print(f"    GT: '{row['Ground_Truth']}', {reference}: '{row[f'{reference}_Prediction']}', "
+                          f"{variant}: '{row[f'{variant}_Prediction']}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-question-type analysis of VQA results")
+    parser.add_argument('results', nargs='?', default='vqa-results-with-bertscore.csv', help="Results CSV")
+    parser.add_argument('--qa-file', default='vqa_data/dataset-batches/batch4_qa_dataset.json',
+                        help="QA file the results were evaluated on (for the questions)")
+    parser.add_argument('--min-examples', type=int, default=10)
+    args = parser.parse_args()
+
+    results_df = pd.read_csv(args.results)
+    print(f"Loaded {len(results_df)} results from {args.results}")
+    if 'Question' in results_df:
+        results_df['Question_Type'] = classify_question_types(results_df['Question'])
+    else:
+        attach_questions(results_df, args.qa_file)
+
+    print("\nQuestion Type Distribution:")
+    for q_type, count in results_df['Question_Type'].value_counts().items():
+        print(f"{q_type}: {count} ({count/len(results_df):.1%})")
+
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', 120)
+    pd.set_option('display.precision', 4)
+    print("\nPerformance by Question Type (Sorted by Accuracy Improvement):")
+    print(performance_by_type(results_df).to_string(index=False))
+
+    print_error_report(analyze_question_type_errors(results_df, min_examples=args.min_examples), results_df)
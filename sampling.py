@@ -0,0 +1,90 @@
+import numpy as np
+
+def stratified_sample(type_codes, total_samples=20000, min_per_type=5, max_per_type=200, seed=None, verbose=True):
+    """
+    Select a diverse, type-balanced sample of products
+
+    Same policy the batch scripts have always used:
+    1. Take up to min_per_type products from every type
+    2. Allocate the remaining budget proportionally to what is left of each
+       type, capped so no type exceeds max_per_type
+    3. Top up from all leftover products until total_samples is reached
+    4. Shuffle and trim to total_samples
+
+    Works on index arrays only: products are grouped by one random
+    permutation plus a stable bucketing by type, so each type's random
+    sample is just a prefix of its group and nothing is ever removed from a
+    list. Types are counted with np.bincount over the code range and grouped
+    with a radix sort of 16-bit keys, so the cost is linear in the number of
+    products (plus the code range) for up to 65536 types.
+
+    Args:
+        type_codes: Integer type code per product (any ints, e.g. -1 for
+            missing; compact codes such as string pool codes keep the
+            bincount small)
+        total_samples: Number of products to select
+        min_per_type: Minimum taken from every type (all of it if fewer)
+        max_per_type: Cap per type before the top-up stage
+        seed: Seed for reproducible selections (None for a fresh one)
+        verbose: Print progress of each stage
+
+    Returns:
+        np.ndarray: Indices into type_codes of the selected products
+    """
+    type_codes = np.asarray(type_codes)
+    rng = np.random.default_rng(seed)
+    n_products = len(type_codes)
+    if n_products == 0 or total_samples <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Dense 0..T-1 codes (in code order) so per-type quantities are plain arrays
+    offsets = type_codes.ravel().astype(np.int64) - type_codes.min()
+    code_counts = np.bincount(offsets)
+    present = code_counts > 0
+    dense = (np.cumsum(present) - 1)[offsets]
+    counts = code_counts[present]
+
+    # Group products by type, in random order within each type. A stable
+    # sort of 16-bit keys is a counting (radix) sort in NumPy
+    perm = rng.permutation(n_products)
+    keys = dense[perm].astype(np.uint16 if len(counts) <= 1 << 16 else np.int64)
+    order = perm[np.argsort(keys, kind='stable')]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # 1. Minimum samples from all types to ensure diversity
+    min_take = np.minimum(counts, min_per_type)
+    if verbose:
+        print(f"Selected {int(min_take.sum())} products as minimum samples")
+
+    # 2. Proportional allocation of the remaining budget, respecting max_per_type
+    left = counts - min_take
+    remaining_samples = total_samples - int(min_take.sum())
+    total_left = int(left.sum())
+    if total_left > 0:
+        allocation = np.trunc(left / total_left * remaining_samples).astype(np.int64)
+    else:
+        allocation = np.zeros_like(left)
+    max_additional = np.maximum(max_per_type - min_take, 0)
+    extra_take = np.maximum(np.minimum(np.minimum(allocation, max_additional), left), 0)
+    quota = min_take + extra_take
+
+    dense_sorted = dense[order]
+    position = np.arange(n_products) - starts[dense_sorted]
+    taken = position < quota[dense_sorted]
+    selected = order[taken]
+    if verbose:
+        print(f"Selected {len(selected)} products total after proportional allocation")
+
+    # 3. Top up from whatever is left if we haven't reached the target
+    if len(selected) < total_samples:
+        remaining_needed = total_samples - len(selected)
+        leftovers = order[~taken]
+        if verbose:
+            print(f"Need {remaining_needed} more products to reach target")
+        if len(leftovers) > remaining_needed:
+            leftovers = rng.choice(leftovers, remaining_needed, replace=False)
+        selected = np.concatenate((selected, leftovers))
+
+    # 4. Shuffle and trim
+    rng.shuffle(selected)
+    return selected[:total_samples]
@@ -0,0 +1,26 @@
+import json
+
+from analysis import ListingAggregate, _statistics_from_store
+from listing_store import open_listing_store
+
+LISTINGS = [
+    {'item_id': 'a', 'country': 'US', 'marketplace': 'Amazon', 'main_image_id': 'img1',
+     'brand': [{'value': 'Acme', 'language_tag': 'en_US'}]},
+    {'item_id': 'b', 'country': None},
+    {'item_id': 'c'},
+    {'item_id': 'd', 'country': 'DE', 'marketplace': None, 'other_image_id': ['x', 'y']},
+    {'item_id': 'e', 'country': None, 'marketplace': 'Amazon', 'product_type': [{'value': 'CHAIR'}]}
+]
+
+def test_store_statistics_match_streaming_aggregate(tmp_path):
+    listings_file = tmp_path / "combined_listings.json"
+    listings_file.write_text(''.join(json.dumps(product) + '\n' for product in LISTINGS), encoding='utf-8')
+    expected = ListingAggregate()
+    for product in LISTINGS:
+        expected.add(product)
+    with open_listing_store(str(listings_file)) as store:
+        stats = _statistics_from_store(store)
+    # Explicit nulls count as None, missing fields not at all, in the same order
+    assert list(stats.country_counts.items()) == list(expected.country_counts.items())
+    assert list(stats.marketplace_counts.items()) == list(expected.marketplace_counts.items())
+    assert stats.to_dict() == expected.to_dict()
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from assignment_ledger import DONE, PENDING, AssignmentLedger
+
+def test_reserve_then_commit(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    ledger.reserve({1: ['b', 'a'], 2: ['c']}, owner='new-batches')
+    assert ledger.batches == {1: PENDING, 2: PENDING}
+    assert ledger.batch_ids(1).tolist() == [b'a', b'b']
+    assert len(ledger) == 3
+
+    ledger.commit([1, 2])
+    assert ledger.batches == {1: DONE, 2: DONE}
+    assert ledger.pending_batches() == []
+
+def test_state_survives_reopening(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    ledger.reserve({3: ['x', 'y']}, owner='new-batches')
+
+    reopened = AssignmentLedger(str(tmp_path))
+    assert reopened.batches == {3: PENDING}
+    assert reopened.owner(3) == 'new-batches'
+    assert reopened.batch_ids(3).tolist() == [b'x', b'y']
+
+def test_pending_batches_by_owner(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    ledger.reserve({1: ['a'], 2: ['b']}, owner='distribute')
+    ledger.reserve({3: ['c'], 4: ['d']}, owner='new-batches')
+
+    resumed = AssignmentLedger(str(tmp_path))
+    assert resumed.pending_batches() == [1, 2, 3, 4]
+    assert resumed.pending_batches(owner='new-batches') == [3, 4]
+    assert resumed.pending_batches(owner='distribute') == [1, 2]
+    assert resumed.next_batch() == 5
+
+def test_committed_batch_needs_overwrite(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    ledger.record(1, ['a'])
+    with pytest.raises(ValueError):
+        ledger.reserve({1: ['b']})
+    ledger.reserve({1: ['b']}, overwrite=True)
+    assert ledger.batch_ids(1).tolist() == [b'b']
+
+def test_contains_covers_every_batch(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    ledger.record(1, ['img1', 'img3'])
+    ledger.reserve({2: ['img5', 'a_much_longer_image_id']})
+    mask = ledger.contains(['img0', 'img1', 'img3', 'img5', 'a_much_longer_image_id', 'img', 'zzz'])
+    assert mask.tolist() == [False, True, True, True, True, False, False]
+
+def test_contains_sees_later_changes(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    ledger.record(1, ['a'])
+    assert ledger.contains(['a', 'b']).tolist() == [True, False]
+    ledger.reserve({2: ['b']})
+    assert ledger.contains(['a', 'b']).tolist() == [True, True]
+    ledger.drop([1])
+    assert ledger.contains(['a', 'b']).tolist() == [False, True]
+    assert 1 not in ledger.batches
+
+def test_contains_on_empty_ledger(tmp_path):
+    ledger = AssignmentLedger(str(tmp_path))
+    assert ledger.contains(['a']).tolist() == [False]
+    assert ledger.contains([]).dtype == np.bool_
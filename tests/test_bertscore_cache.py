@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from bertscore_cache import BertScorer
+
+PREDICTIONS = ["red", "blue", "", "red", "a wooden chair", "  ", "red", "two"]
+REFERENCES = ["red", "navy blue", "black", "red", "wooden chair", "white", "crimson", "2"]
+
+@pytest.fixture
+def tiny_model(tmp_path):
+    # A small random BERT saved locally, so the comparison runs offline
+    transformers = pytest.importorskip("transformers")
+    words = sorted({word for text in PREDICTIONS + REFERENCES for word in text.split()})
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text('\n'.join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words) + '\n', encoding='utf-8')
+    model_dir = tmp_path / "tiny-bert"
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=5 + len(words), hidden_size=16, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=32)
+    transformers.BertModel(config).save_pretrained(model_dir)
+    transformers.BertTokenizer(str(vocab_file), model_max_length=64).save_pretrained(model_dir)
+    return str(model_dir)
+
+def test_matches_bert_score(tiny_model):
+    bert_score = pytest.importorskip("bert_score")
+    from bert_score.utils import get_tokenizer, sent_encode
+    try:
+        sent_encode(get_tokenizer(tiny_model), " ")
+    except AttributeError:
+        pytest.skip("bert_score doesn't support the installed transformers")
+    # calculate_bert_score_complete replaced empty strings with a space before scoring
+    cleaned = [text if text.strip() else " " for text in PREDICTIONS]
+    P, R, F1 = bert_score.score(cleaned, REFERENCES, model_type=tiny_model, num_layers=2, batch_size=3,
+                                device='cpu')
+    scores = BertScorer(tiny_model, num_layers=2, device='cpu', batch_size=3).score(PREDICTIONS, REFERENCES)
+    assert scores['precision_scores'] == pytest.approx(P.tolist(), abs=1e-6)
+    assert scores['recall_scores'] == pytest.approx(R.tolist(), abs=1e-6)
+    assert scores['f1_scores'] == pytest.approx(F1.tolist(), abs=1e-6)
+    assert scores['f1'] == pytest.approx(F1.mean().item(), abs=1e-6)
+
+class _CountingScorer(BertScorer):
+    # Embedding and scoring stubbed out: the cache logic is all that runs
+    def __init__(self, *args, **kwargs):
+        super().__init__("stub", *args, num_layers=1, device='cpu', batch_size=2, **kwargs)
+        self.scored = []
+
+    def _embed(self, sentences):
+        pass
+
+    def _pair_scores(self, batch):
+        self.scored.extend(batch)
+        values = [float(len(cand) + 10 * len(ref)) for cand, ref in batch]
+        return values, values, values
+
+def test_each_distinct_pair_scored_once(tmp_path):
+    cache_file = str(tmp_path / "scores" / "scores.jsonl")
+    scorer = _CountingScorer(cache_file=cache_file)
+    first = scorer.score(PREDICTIONS, REFERENCES)
+    assert len(scorer.scored) == len(set(scorer.scored)) == 7
+    scorer.score(PREDICTIONS[:3], REFERENCES[:3])
+    assert len(scorer.scored) == 7
+
+    # A new scorer on the same cache file scores nothing
+    restarted = _CountingScorer(cache_file=cache_file)
+    assert restarted.score(PREDICTIONS, REFERENCES)['f1_scores'] == first['f1_scores']
+    assert restarted.scored == []
+
+def test_append_after_torn_line(tmp_path):
+    cache_file = tmp_path / "scores.jsonl"
+    scorer = _CountingScorer(cache_file=str(cache_file))
+    scorer.score(["red"], ["red"])
+    with open(cache_file, 'a', encoding='utf-8') as f:
+        f.write('{"model": "stub:L1", "cand": "bl')  # interrupted mid-write
+
+    _CountingScorer(cache_file=str(cache_file)).score(["blue"], ["navy"])
+    entries = [json.loads(line) for line in cache_file.read_text(encoding='utf-8').splitlines()[::2]]
+    assert [(entry['cand'], entry['ref']) for entry in entries] == [("red", "red"), ("blue", "navy")]
+    assert ("blue", "navy") in _CountingScorer(cache_file=str(cache_file)).scores
@@ -0,0 +1,40 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from results_analysis import QUESTION_PATTERNS, classify_question_types
+
+def _extract_question_type(question):
+    # The notebook's row-wise version
+    question = question.lower().strip()
+    for q_type, pattern in dict(QUESTION_PATTERNS).items():
+        if re.search(pattern, question):
+            return q_type
+    return question.split()[0] if question else 'unknown'
+
+QUESTIONS = [
+    "What color is the sofa?", "What colour is the lamp?", "what shape is the table", "What pattern is on the rug?",
+    "What material is the chair made of?", "What type of shoe is this?", "What kind of bag is it?",
+    "What is the brand?", "What brand is shown?", "Whatever is this?", "How many drawers are there?",
+    "How big is it?", "Is there a handle?", "Are there any buttons?", "Does it have wheels?", "Is the lid open?",
+    "Are the legs wooden?", "Can it fold?", "Where is the logo?", "Which side is longer?", "  IS THERE A ZIP? ",
+    "Is it red?", "Dose it fit?", "Cane or chair?", "", "   ", "?", "Wherever"
+]
+
+def test_matches_row_wise_extraction():
+    questions = pd.Series(QUESTIONS)
+    assert classify_question_types(questions).tolist() == [_extract_question_type(q) for q in QUESTIONS]
+
+def test_matches_row_wise_extraction_on_random_questions():
+    rng = np.random.default_rng(0)
+    words = ['what', 'colour', 'color', 'is', 'the', 'how', 'many', 'are', 'there', 'does', 'can', 'where',
+             'kind', 'type', 'shape', 'Is', 'WHAT', 'There', 'x']
+    questions = [' '.join(rng.choice(words, rng.integers(0, 5))) for _ in range(2000)]
+    assert classify_question_types(pd.Series(questions)).tolist() == [_extract_question_type(q) for q in questions]
+
+def test_keeps_index_and_handles_missing_questions():
+    questions = pd.Series(["How many legs?", None, "Where is it?"], index=[10, 20, 30])
+    types = classify_question_types(questions)
+    assert types.index.tolist() == [10, 20, 30]
+    assert types.tolist() == ['how many', 'unknown', 'where']
@@ -0,0 +1,50 @@
+import numpy as np
+
+from sampling import stratified_sample
+
+def _codes(n_products=5000, n_types=120, seed=0):
+    # Skewed type sizes, -1 for products without a type
+    rng = np.random.default_rng(seed)
+    return (rng.zipf(1.5, n_products) % n_types - 1).astype(np.int32)
+
+def test_same_seed_same_selection():
+    codes = _codes()
+    first = stratified_sample(codes, total_samples=1000, seed=42, verbose=False)
+    second = stratified_sample(codes, total_samples=1000, seed=42, verbose=False)
+    assert np.array_equal(first, second)
+
+def test_different_seed_different_selection():
+    codes = _codes()
+    first = stratified_sample(codes, total_samples=1000, seed=1, verbose=False)
+    second = stratified_sample(codes, total_samples=1000, seed=2, verbose=False)
+    assert not np.array_equal(first, second)
+
+def test_selection_is_distinct_and_sized():
+    codes = _codes()
+    selected = stratified_sample(codes, total_samples=1000, seed=0, verbose=False)
+    assert len(selected) == 1000
+    assert len(np.unique(selected)) == 1000
+    assert selected.min() >= 0 and selected.max() < len(codes)
+
+def test_small_types_taken_in_full():
+    codes = _codes()
+    types, counts = np.unique(codes, return_counts=True)
+    selected = stratified_sample(codes, total_samples=len(codes) // 2, min_per_type=5, seed=0, verbose=False)
+    chosen = dict(zip(*np.unique(codes[selected], return_counts=True)))
+    for code, count in zip(types, counts):
+        assert chosen.get(code, 0) >= min(count, 5)
+
+def test_code_values_do_not_change_selection():
+    # Only the grouping matters, not the code values themselves
+    codes = _codes()
+    shifted = codes.astype(np.int64) * 7 + 1000
+    assert np.array_equal(stratified_sample(codes, total_samples=800, seed=3, verbose=False),
+                          stratified_sample(shifted, total_samples=800, seed=3, verbose=False))
+
+def test_everything_when_budget_exceeds_products():
+    codes = _codes(n_products=300)
+    selected = stratified_sample(codes, total_samples=1000, seed=0, verbose=False)
+    assert sorted(selected.tolist()) == list(range(300))
+
+def test_empty_input():
+    assert len(stratified_sample(np.zeros(0, dtype=np.int32), seed=0, verbose=False)) == 0
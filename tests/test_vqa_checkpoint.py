@@ -0,0 +1,167 @@
+import csv
+import os
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from torch.utils.data import DataLoader
+
+from vqa_checkpoint import AsyncCheckpointer, ResumableSampler, load_checkpoint, step_checkpoints
+from vqa_train import train
+
+class _EpochBatches:
+    # Stand-in for ImageGroupedBatchSampler: batches whose order depends on the epoch
+    def __init__(self, n_batches):
+        self.n_batches = n_batches
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.n_batches
+
+    def __iter__(self):
+        for i in range(self.n_batches):
+            yield [(i + self.epoch) % self.n_batches, self.epoch]
+
+def test_same_epoch_same_order():
+    sampler = ResumableSampler(50, seed=3)
+    sampler.set_epoch(2)
+    first = list(sampler)
+    sampler.set_epoch(2)
+    assert list(sampler) == first
+    assert sorted(first) == list(range(50))
+
+def test_epochs_are_shuffled_differently():
+    sampler = ResumableSampler(50, seed=3)
+    sampler.set_epoch(0)
+    first = list(sampler)
+    sampler.set_epoch(1)
+    assert list(sampler) != first
+
+def test_resume_yields_the_rest_of_the_epoch():
+    sampler = ResumableSampler(50, seed=3)
+    sampler.set_epoch(1)
+    full = list(sampler)
+    resumed = ResumableSampler(50, seed=3)
+    resumed.set_epoch(1, position=17)
+    assert list(resumed) == full[17:]
+    assert len(resumed) == 33
+
+def test_resume_past_the_end_is_empty():
+    sampler = ResumableSampler(10)
+    sampler.set_epoch(0, position=12)
+    assert list(sampler) == []
+    assert len(sampler) == 0
+
+def test_wrapped_batch_sampler_resumes_in_the_same_order():
+    sampler = ResumableSampler(_EpochBatches(6))
+    sampler.set_epoch(3)
+    full = list(sampler)
+    sampler.set_epoch(3, position=4)
+    assert list(sampler) == full[4:]
+    assert sampler.source.epoch == 3
+
+def test_dataloader_resume_matches_uninterrupted_run():
+    dataset = list(range(40))
+    sampler = ResumableSampler(len(dataset), seed=7)
+    loader = DataLoader(dataset, batch_size=4, sampler=sampler)
+    sampler.set_epoch(5)
+    full = [batch.tolist() for batch in loader]
+    # Interrupted after 3 batches: position counts samples when used as a sampler
+    sampler.set_epoch(5, position=3 * 4)
+    assert [batch.tolist() for batch in loader] == full[3:]
+
+def _linear_and_optimizer(seed=0):
+    torch.manual_seed(seed)
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.1)
+    model(torch.randn(3, 4)).sum().backward()
+    optimizer.step()
+    return model, optimizer
+
+def test_save_load_round_trip(tmp_path):
+    model, optimizer = _linear_and_optimizer()
+    checkpointer = AsyncCheckpointer(str(tmp_path))
+    checkpointer.save(7, model, optimizer, {'epoch': 1, 'position': 12})
+    checkpointer.close()
+    expected_draws = (random.random(), np.random.rand(), torch.rand(1))
+
+    restored, restored_optimizer = _linear_and_optimizer(seed=1)
+    state = load_checkpoint(str(tmp_path / 'step_7'), restored, restored_optimizer)
+    assert state == {'epoch': 1, 'position': 12, 'global_step': 7}
+    for name, param in model.state_dict().items():
+        assert torch.equal(restored.state_dict()[name], param)
+    saved_moments = optimizer.state_dict()['state'][0]['exp_avg']
+    assert torch.equal(restored_optimizer.state_dict()['state'][0]['exp_avg'], saved_moments)
+    # RNG states are back to where they were at save time
+    assert (random.random(), np.random.rand(), torch.rand(1)) == expected_draws
+    assert not [name for name in os.listdir(tmp_path) if '.tmp' in name]
+
+def test_keep_last_prunes_oldest(tmp_path):
+    model, optimizer = _linear_and_optimizer()
+    checkpointer = AsyncCheckpointer(str(tmp_path), keep_last=2)
+    for step in (1, 2, 3, 4):
+        checkpointer.save(step, model, optimizer, {})
+    checkpointer.close()
+    assert [step for step, _ in step_checkpoints(str(tmp_path))] == [3, 4]
+
+class _Preempted(Exception):
+    pass
+
+class _TinyVQA(torch.nn.Module):
+    # Just enough of the BLIP interface for train(); dropout exercises the RNG restore
+    def __init__(self, preempt_at=None):
+        super().__init__()
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(2, 1)
+        self.dropout = torch.nn.Dropout(0.5)
+        self.calls = 0
+        self.preempt_at = preempt_at
+
+    def forward(self, input_ids, pixel_values, attention_mask, labels, return_dict=True):
+        self.calls += 1
+        if self.calls == self.preempt_at:
+            raise _Preempted()
+        prediction = self.linear(self.dropout(input_ids.float())).squeeze(-1)
+        return SimpleNamespace(loss=((prediction - labels.float()) ** 2).mean())
+
+    def save_pretrained(self, path):
+        os.makedirs(path, exist_ok=True)
+
+def _train(checkpoint_dir, preempt_at=None, resume=None, num_epochs=3):
+    model = _TinyVQA(preempt_at)
+    dataset = [{'input_ids': torch.tensor([i, i % 3]), 'pixel_values': torch.zeros(1),
+                'attention_mask': torch.ones(2), 'labels': torch.tensor(i % 2)} for i in range(20)]
+    loader = DataLoader(dataset, batch_size=2, sampler=ResumableSampler(len(dataset), seed=1))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.05)
+    try:
+        train(model, loader, optimizer, 'cpu', num_epochs=num_epochs, checkpoint_dir=str(checkpoint_dir),
+              checkpoint_every=3, keep_last=2, resume=resume)
+    except _Preempted:
+        return None
+    return model
+
+def _timeline_steps(checkpoint_dir):
+    with open(os.path.join(checkpoint_dir, 'training_timeline.csv'), newline='', encoding='utf-8') as f:
+        return [int(row['global_step']) for row in csv.DictReader(f)]
+
+def test_resumed_training_matches_uninterrupted(tmp_path):
+    reference = _train(tmp_path / 'reference')
+    assert _train(tmp_path / 'resumed', preempt_at=15) is None
+    resumed = _train(tmp_path / 'resumed', resume=True)
+    for name, param in reference.state_dict().items():
+        assert torch.equal(resumed.state_dict()[name], param)
+    # The timeline covers every step once, across the interruption
+    assert _timeline_steps(tmp_path / 'resumed') == list(range(1, 31))
+
+def test_fresh_run_discards_earlier_step_checkpoints(tmp_path):
+    _train(tmp_path)
+    assert [step for step, _ in step_checkpoints(str(tmp_path / 'steps'))] == [27, 30]
+    assert _train(tmp_path, preempt_at=15) is None
+    assert [step for step, _ in step_checkpoints(str(tmp_path / 'steps'))] == [10, 12]
@@ -0,0 +1,71 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("PIL")
+
+from vqa_data import collate_vqa
+
+PAD = 0
+
+def _item(question, answer, image_key, example_index, pixels=None):
+    input_ids = torch.tensor(question, dtype=torch.long)
+    return {
+        'pixel_values': pixels if pixels is not None else torch.full((3, 4, 4), float(example_index)),
+        'input_ids': input_ids,
+        'attention_mask': torch.ones_like(input_ids),
+        'labels': torch.tensor(answer, dtype=torch.long),
+        'image_key': image_key,
+        'example_index': example_index
+    }
+
+def test_questions_padded_to_longest_in_batch():
+    batch = collate_vqa([_item([101, 7, 102], [101, 5, 102], 'a.jpg', 0),
+                         _item([101, 8, 9, 10, 102], [101, 6, 102], 'b.jpg', 1)], pad_token_id=PAD)
+    assert batch['input_ids'].tolist() == [[101, 7, 102, PAD, PAD], [101, 8, 9, 10, 102]]
+    assert batch['attention_mask'].tolist() == [[1, 1, 1, 0, 0], [1, 1, 1, 1, 1]]
+    assert batch['pixel_values'].shape == (2, 3, 4, 4)
+
+def test_labels_keep_fixed_length_by_default():
+    batch = collate_vqa([_item([101, 102], [101, 5, 102], 'a.jpg', 0),
+                         _item([101, 102], [101, 6, 7, 102], 'b.jpg', 1)], pad_token_id=PAD)
+    assert batch['labels'].shape == (2, 32)
+    assert batch['labels'][0, :4].tolist() == [101, 5, 102, PAD]
+    assert (batch['labels'][:, 4:] == PAD).all()
+
+def test_labels_dynamic_when_requested():
+    batch = collate_vqa([_item([101, 102], [101, 5, 102], 'a.jpg', 0),
+                         _item([101, 102], [101, 6, 7, 102], 'b.jpg', 1)], pad_token_id=PAD, label_length=None)
+    assert batch['labels'].tolist() == [[101, 5, 102, PAD], [101, 6, 7, 102]]
+
+def test_failed_items_are_dropped():
+    batch = collate_vqa([None, _item([101, 102], [101, 102], 'a.jpg', 3)], pad_token_id=PAD)
+    assert batch['input_ids'].shape[0] == 1
+
+def test_batch_of_failed_items_is_none():
+    assert collate_vqa([None, None], pad_token_id=PAD) is None
+    assert collate_vqa([None], pad_token_id=PAD, group_images=True) is None
+
+def test_grouping_keeps_one_row_per_image():
+    items = [_item([101, 102], [101, 102], 'a.jpg', 4, torch.zeros(3, 4, 4)),
+             _item([101, 102], [101, 102], 'b.jpg', 5, torch.ones(3, 4, 4)),
+             _item([101, 102], [101, 102], 'a.jpg', 6, torch.zeros(3, 4, 4))]
+    batch = collate_vqa(items, pad_token_id=PAD, group_images=True)
+    assert batch['pixel_values'].shape == (2, 3, 4, 4)
+    assert batch['image_index'].tolist() == [0, 1, 0]
+    assert batch['example_index'].tolist() == [4, 5, 6]
+    # Every example still sees its own image
+    for row, item in zip(batch['image_index'].tolist(), items):
+        assert torch.equal(batch['pixel_values'][row], item['pixel_values'])
+
+def test_mixed_cached_and_uncached_images():
+    cached = _item([101, 102], [101, 102], 'a.jpg', 0)
+    del cached['pixel_values']
+    cached['image_embeds'] = torch.ones(2, 5)
+    items = [cached, _item([101, 102], [101, 102], 'b.jpg', 1), dict(cached, example_index=2)]
+    batch = collate_vqa(items, pad_token_id=PAD)
+    assert batch['image_cached'].tolist() == [True, False, True]
+    assert batch['image_embeds'].shape == (2, 2, 5)
+    assert batch['pixel_values'].shape == (1, 3, 4, 4)
+    grouped = collate_vqa(items, pad_token_id=PAD, group_images=True)
+    assert grouped['image_cached'].tolist() == [True, False]
+    assert grouped['image_index'].tolist() == [0, 1, 0]
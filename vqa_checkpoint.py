@@ -0,0 +1,218 @@
+import json
+import os
+import random
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+# Bump when the checkpoint contents change
+CHECKPOINT_VERSION = 1
+
+_STEP_DIR = re.compile(r'^step_(\d+)$')
+
+class ResumableSampler(Sampler):
+    """
+    Deterministic data order that can restart mid-epoch
+
+    Wraps either a dataset length (a seeded shuffle, like shuffle=True) or a
+    sampler with set_epoch (LengthGroupedSampler, ImageGroupedBatchSampler).
+    The order only depends on (seed, epoch), so skipping the first
+    `position` elements reproduces the rest of an interrupted epoch. Use as
+    the DataLoader's sampler, or as its batch_sampler when wrapping a batch
+    sampler.
+
+    Args:
+        source: Dataset length, or a sampler with set_epoch
+        seed: Base seed for the shuffle (ignored when wrapping a sampler)
+    """
+
+    def __init__(self, source, seed=0):
+        self.source = source
+        self.seed = seed
+        self.epoch = 0
+        self.position = 0
+
+    def set_epoch(self, epoch, position=0):
+        """Select the epoch's order and how many of its elements to skip"""
+        self.epoch = epoch
+        self.position = position
+        if not isinstance(self.source, int):
+            self.source.set_epoch(epoch)
+
+    def _order(self):
+        if isinstance(self.source, int):
+            return np.random.default_rng(self.seed + self.epoch).permutation(self.source).tolist()
+        return list(self.source)
+
+    def __len__(self):
+        total = self.source if isinstance(self.source, int) else len(self.source)
+        return max(total - self.position, 0)
+
+    def __iter__(self):
+        order = self._order()
+        yield from order[self.position:]
+
+def rng_state():
+    """Python, NumPy and torch (CPU and CUDA) RNG states"""
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+    }
+
+def set_rng_state(state):
+    """Restore states captured by rng_state()"""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def _to_cpu(obj):
+    # Detached CPU copies, so training can keep updating the originals
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: _to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value) for value in obj)
+    return obj
+
+def trainable_state(model):
+    """State of the trainable parameters only (the LoRA weights under PEFT)"""
+    return {name: param.detach() for name, param in model.named_parameters() if param.requires_grad}
+
+def step_checkpoints(checkpoint_dir):
+    """
+    Step checkpoints in a directory, oldest first
+
+    Returns:
+        list: (global step, path)
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    found = []
+    for name in os.listdir(checkpoint_dir):
+        match = _STEP_DIR.match(name)
+        if match and os.path.exists(os.path.join(checkpoint_dir, name, 'state.pt')):
+            found.append((int(match.group(1)), os.path.join(checkpoint_dir, name)))
+    return sorted(found)
+
+def latest_checkpoint(checkpoint_dir):
+    """Path of the newest complete step checkpoint, or None"""
+    found = step_checkpoints(checkpoint_dir)
+    return found[-1][1] if found else None
+
+def load_checkpoint(path, model, optimizer=None):
+    """
+    Restore a step checkpoint into a model (and optimizer)
+
+    Args:
+        path: Step checkpoint directory
+        model: Model with the same trainable parameters
+        optimizer: Optimizer to restore, if any
+
+    Returns:
+        dict: Training state (epoch, position, global_step, ...) with the
+            RNG states already applied
+    """
+    state = torch.load(os.path.join(path, 'state.pt'), map_location='cpu', weights_only=False)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state.get('version')} in {path}")
+    missing = set(state['model']) - set(trainable_state(model))
+    if missing:
+        raise ValueError(f"Checkpoint {path} has parameters the model doesn't train: {sorted(missing)[:5]}")
+    model.load_state_dict(state['model'], strict=False)
+    if optimizer is not None:
+        optimizer.load_state_dict(state['optimizer'])
+    set_rng_state(state['rng'])
+    return state['training']
+
+class AsyncCheckpointer:
+    """
+    Write training checkpoints in the background
+
+    save() copies the trainable weights, optimizer state and RNG states to
+    CPU (cheap with LoRA) and returns; a worker thread serializes them into
+    step_<N>/state.pt. Each checkpoint is written to a temporary directory
+    and renamed into place, so a crash never leaves a partial step_<N>.
+    Only the newest keep_last step checkpoints are kept.
+
+    Usage:
+        checkpointer = AsyncCheckpointer(checkpoint_dir, keep_last=3)
+        checkpointer.save(global_step, model, optimizer, training_state)
+        ...
+        checkpointer.close()
+    """
+
+    def __init__(self, checkpoint_dir, keep_last=3):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def save(self, global_step, model, optimizer, training_state):
+        """
+        Snapshot the current state and write it in the background
+
+        Args:
+            global_step: Steps completed so far (names the checkpoint)
+            model: Model being trained
+            optimizer: Its optimizer
+            training_state: JSON-serializable loop state (epoch, position, ...)
+        """
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'model': _to_cpu(trainable_state(model)),
+            'optimizer': _to_cpu(optimizer.state_dict()),
+            'rng': rng_state(),
+            'training': dict(training_state, global_step=global_step)
+        }
+        # One write in flight at a time; a slow disk delays the next snapshot, not training
+        self.wait()
+        self._pending = self._executor.submit(self._write, global_step, state)
+
+    def _write(self, global_step, state):
+        final_dir = os.path.join(self.checkpoint_dir, f"step_{global_step}")
+        tmp_dir = f"{final_dir}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        torch.save(state, os.path.join(tmp_dir, 'state.pt'))
+        with open(os.path.join(tmp_dir, 'training_state.json'), 'w', encoding='utf-8') as f:
+            json.dump(state['training'], f, indent=2)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        self._prune()
+
+    def discard(self, after=0):
+        """
+        Delete step checkpoints newer than step `after` (all of them by default)
+
+        A fresh run calls this so an earlier run's higher step numbers neither
+        crowd its own checkpoints out of keep_last nor get resumed later.
+        """
+        self.wait()
+        for step, path in step_checkpoints(self.checkpoint_dir):
+            if step > after:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _prune(self):
+        found = step_checkpoints(self.checkpoint_dir)
+        for _, path in found[:max(len(found) - self.keep_last, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Block until the last checkpoint is on disk (re-raising its error)"""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown(wait=True)
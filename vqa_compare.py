@@ -0,0 +1,199 @@
+import os
+import time
+
+import pandas as pd
+import torch
+from tqdm.auto import tqdm
+
+from vqa_model import answer_token_cap, batch_image_embeds, decode_answers, encode_images, vqa_generate
+
+BASELINE = "Baseline"
+
+def find_checkpoints(checkpoint_dir="blip_lora_checkpoints"):
+    """
+    LoRA adapters saved by train()
+
+    Args:
+        checkpoint_dir: Directory with best_model_epoch_N / checkpoint_epoch_N folders
+
+    Returns:
+        dict: {adapter name: path}, sorted by name
+    """
+    checkpoints = {}
+    for name in sorted(os.listdir(checkpoint_dir)):
+        path = os.path.join(checkpoint_dir, name)
+        if os.path.exists(os.path.join(path, 'adapter_config.json')):
+            checkpoints[name] = path
+    return checkpoints
+
+def attach_adapters(base_model, checkpoints):
+    """
+    Load several LoRA adapters onto one copy of the base model
+
+    Args:
+        base_model: BLIP VQA model, loaded once
+        checkpoints: {adapter name: path}
+
+    Returns:
+        PeftModel: The base model with every adapter attached (none active
+            outside set_adapter / disable_adapter)
+    """
+    from peft import PeftModel
+
+    model = None
+    for name, path in checkpoints.items():
+        if model is None:
+            model = PeftModel.from_pretrained(base_model, path, adapter_name=name, is_trainable=False)
+        else:
+            model.load_adapter(path, adapter_name=name, is_trainable=False)
+        print(f"Attached adapter {name} from {path}")
+    return model
+
+def _adapters_touch_vision(model):
+    return any('vision_model' in name and 'lora_' in name for name, _ in model.named_parameters())
+
+def evaluate_variants(base_model, checkpoints, dataloader, dataset, processor, device, include_baseline=True,
+                      max_new_tokens=None):
+    """
+    Score the baseline and every LoRA checkpoint in one pass over the data
+
+    The base weights are loaded once and each adapter is switched in with
+    set_adapter; the baseline runs with the adapters disabled. Each batch
+    is moved to the device once, and because the adapters only change the
+    text side, the images are encoded once per batch for all variants.
+
+    Args:
+        base_model: BLIP VQA model (e.g. from AutoModelForVisualQuestionAnswering)
+        checkpoints: {adapter name: path} (e.g. find_checkpoints())
+        dataloader: DataLoader over the pre-tokenized eval dataset (collate_vqa)
+        dataset: The dataset behind the DataLoader
+        processor: BLIP processor
+        device: Device to evaluate on
+        include_baseline: Also score the model without adapters
+        max_new_tokens: Generation budget (default: answer_token_cap(dataset))
+
+    Returns:
+        dict: {variant: results dict as from evaluate_model_with_details}
+    """
+    if not checkpoints and not include_baseline:
+        raise ValueError("Nothing to evaluate: no checkpoints and include_baseline=False")
+    model = attach_adapters(base_model, checkpoints) if checkpoints else base_model
+    model.eval()
+    model.to(device)
+    variants = ([BASELINE] if include_baseline else []) + list(checkpoints)
+    if max_new_tokens is None:
+        max_new_tokens = answer_token_cap(dataset)
+    ground_truths = decode_answers(dataset, processor)
+    share_images = not _adapters_touch_vision(model)
+
+    def generate(batch, image_embeds):
+        if image_embeds is None:
+            image_embeds = encode_images(model, batch["pixel_values"])
+        return vqa_generate(model, batch["input_ids"], batch["attention_mask"], image_embeds,
+                            batch.get("image_index"), max_new_tokens=max_new_tokens)
+
+    predictions = {variant: {} for variant in variants}
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for batch in tqdm(dataloader, desc=f"Evaluating {len(variants)} variants"):
+            if batch is None:
+                continue  # every image in the batch failed to load
+            batch = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+            # Cached embeddings are always used; otherwise images are encoded once per batch if shared
+            image_embeds = None
+            if "image_embeds" in batch or share_images:
+                image_embeds = batch_image_embeds(model, batch)
+
+            if "example_index" in batch:
+                indices = batch["example_index"].tolist()
+            else:
+                done = len(predictions[variants[0]])
+                indices = range(done, done + len(batch["input_ids"]))
+
+            for variant in variants:
+                if variant == BASELINE and checkpoints:
+                    with model.disable_adapter():
+                        generated_ids = generate(batch, image_embeds)
+                else:
+                    if checkpoints:
+                        model.set_adapter(variant)
+                    generated_ids = generate(batch, image_embeds)
+                texts = processor.batch_decode(generated_ids, skip_special_tokens=True)
+                for idx, pred in zip(indices, texts):
+                    predictions[variant][idx] = pred.strip().lower()
+    print(f"Evaluated {len(variants)} variants in {time.perf_counter() - start:.1f}s")
+
+    results = {}
+    for variant in variants:
+        order = sorted(predictions[variant])
+        preds = [predictions[variant][idx] for idx in order]
+        gts = [ground_truths[idx] for idx in order]
+        is_correct = [pred == gt for pred, gt in zip(preds, gts)]
+        results[variant] = {
+            "predictions": preds,
+            "ground_truths": gts,
+            "is_correct": is_correct,
+            "correct": sum(is_correct),
+            "total": len(order),
+            "accuracy": sum(is_correct) / len(order) if order else 0
+        }
+        print(f"{variant} results: {results[variant]['correct']}/{results[variant]['total']} correct, "
+              f"Accuracy: {results[variant]['accuracy']:.4f}")
+    return results
+
+def create_variants_csv(results, output_file="vqa_results.csv"):
+    """
+    One table with every variant's predictions, like create_results_csv
+
+    Args:
+        results: {variant: results dict} (e.g. from evaluate_variants)
+        output_file: Path to save the CSV file
+
+    Returns:
+        pd.DataFrame: Question_ID, Ground_Truth, then <variant>_Prediction and
+            <variant>_Correct per variant, plus agreement columns and, next to
+            a baseline, <variant>_Improved / <variant>_Degraded
+    """
+    variants = list(results)
+    if not variants:
+        raise ValueError("No variant results to write")
+    ground_truths = results[variants[0]]["ground_truths"]
+    columns = {
+        'Question_ID': range(len(ground_truths)),
+        'Ground_Truth': ground_truths
+    }
+    for variant in variants:
+        columns[f'{variant}_Prediction'] = results[variant]["predictions"]
+        columns[f'{variant}_Correct'] = results[variant]["is_correct"]
+    results_df = pd.DataFrame(columns)
+
+    predictions = results_df[[f'{variant}_Prediction' for variant in variants]]
+    correct = results_df[[f'{variant}_Correct' for variant in variants]]
+    results_df['Models_Agree'] = predictions.nunique(axis=1) == 1
+    results_df['All_Correct'] = correct.all(axis=1)
+    results_df['All_Incorrect'] = ~correct.any(axis=1)
+    if BASELINE in variants:
+        for variant in variants:
+            if variant == BASELINE:
+                continue
+            results_df[f'{variant}_Improved'] = (~results_df[f'{BASELINE}_Correct']) & results_df[f'{variant}_Correct']
+            results_df[f'{variant}_Degraded'] = results_df[f'{BASELINE}_Correct'] & (~results_df[f'{variant}_Correct'])
+
+    results_df.to_csv(output_file, index=False)
+    print(f"Results saved to {output_file}")
+
+    print("\nSummary Statistics:")
+    print(f"Total examples: {len(results_df)}")
+    for variant in variants:
+        print(f"{variant} accuracy: {results[variant]['accuracy']:.4f}")
+    total = max(len(results_df), 1)
+    print(f"Examples where all models are correct: {results_df['All_Correct'].sum()} ({results_df['All_Correct'].sum()/total:.2%})")
+    print(f"Examples where all models are incorrect: {results_df['All_Incorrect'].sum()} ({results_df['All_Incorrect'].sum()/total:.2%})")
+    if BASELINE in variants:
+        for variant in variants:
+            if variant == BASELINE:
+                continue
+            print(f"{variant} vs baseline: {results_df[f'{variant}_Improved'].sum()} improved, "
+                  f"{results_df[f'{variant}_Degraded'].sum()} degraded")
+
+    return results_df
@@ -0,0 +1,805 @@
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, Sampler
+
+from metadata_io import iter_metadata
+
+# Bump when the on-disk cache layout changes
+CACHE_VERSION = 1
+
+class ArrayCache:
+    """
+    Append-only on-disk store of same-shaped arrays keyed by string
+
+    Rows live in one flat data.bin file that is memory-mapped for reading,
+    so every process (e.g. DataLoader workers) shares the same page cache
+    instead of holding its own copy. index.jsonl maps keys to rows and is
+    only appended after the row data is written; a torn last line from an
+    interrupted build is ignored. If the fingerprint, shape or dtype in
+    meta.json doesn't match, the cache is discarded and starts empty.
+    """
+
+    def __init__(self, cache_dir, shape, fingerprint, dtype='float16'):
+        self.cache_dir = cache_dir
+        self.shape = tuple(int(d) for d in shape)
+        self.dtype = np.dtype(dtype)
+        self.fingerprint = fingerprint
+        self.data_path = os.path.join(cache_dir, 'data.bin')
+        self.index_path = os.path.join(cache_dir, 'index.jsonl')
+        self.row_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        meta = {'version': CACHE_VERSION, 'fingerprint': fingerprint, 'shape': list(self.shape), 'dtype': self.dtype.str}
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        existing = None
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+        if existing != meta:
+            if existing is not None:
+                print(f"Cache {cache_dir} was built with a different configuration, rebuilding")
+            for path in (self.data_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from an interrupted build
+                    self.index[entry['key']] = entry['row']
+        self._rows = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getstate__(self):
+        # Each process maps the file itself
+        state = self.__dict__.copy()
+        state['_rows'] = None
+        return state
+
+    def _stored_rows(self):
+        return os.path.getsize(self.data_path) // self.row_bytes if os.path.exists(self.data_path) else 0
+
+    def rows(self):
+        """Memory-mapped view of every stored row"""
+        count = self._stored_rows()
+        if self._rows is None or len(self._rows) < count:
+            self._rows = np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(count,) + self.shape) if count else None
+        return self._rows
+
+    def get(self, key):
+        """
+        Stored array for a key
+
+        Args:
+            key: Cache key
+
+        Returns:
+            np.ndarray or None: Read-only view of the row, None if missing
+        """
+        row = self.index.get(key)
+        if row is None:
+            return None
+        return self.rows()[row]
+
+    def put_many(self, items):
+        """
+        Append arrays to the cache
+
+        Args:
+            items: Iterable of (key, array); arrays are cast to the cache dtype
+
+        Returns:
+            int: Number of rows written
+        """
+        written = 0
+        with open(self.data_path, 'ab') as data_file, open(self.index_path, 'a', encoding='utf-8') as index_file:
+            row = data_file.tell() // self.row_bytes
+            if data_file.tell() % self.row_bytes:
+                # Partial row from an interrupted write: pad it out and skip it
+                data_file.write(b'\0' * (self.row_bytes - data_file.tell() % self.row_bytes))
+                row += 1
+            for key, array in items:
+                array = np.ascontiguousarray(array, dtype=self.dtype)
+                if array.shape != self.shape:
+                    raise ValueError(f"Expected shape {self.shape} for {key}, got {array.shape}")
+                data_file.write(array.tobytes())
+                data_file.flush()
+                index_file.write(json.dumps({'key': key, 'row': row}) + '\n')
+                self.index[key] = row
+                row += 1
+                written += 1
+        return written
+
+def processor_fingerprint(image_processor):
+    """
+    Hash of an image processor's configuration
+
+    Args:
+        image_processor: Hugging Face image processor (e.g. processor.image_processor)
+
+    Returns:
+        str: SHA-256 over its settings (size, mean, std, resampling, ...)
+    """
+    config = json.dumps(image_processor.to_dict(), sort_keys=True, default=str)
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()
+
+def image_cache_key(image_path):
+    """Cache key for an image: its file name"""
+    return os.path.basename(image_path)
+
+def _load_rgb(image_path):
+    try:
+        return Image.open(image_path).convert('RGB')
+    except Exception as e:
+        print(f"Error loading {image_path}: {e}")
+        return None
+
+def build_pixel_cache(image_paths, processor, cache_dir, batch_size=32, workers=4):
+    """
+    Preprocess every distinct image once into a float16 pixel cache
+
+    Images already in the cache are skipped, so adding batches only
+    processes the new images. If the processor's image settings changed,
+    the cache is rebuilt from scratch.
+
+    Args:
+        image_paths: Image paths (duplicates are processed once)
+        processor: BLIP processor (its image_processor is used)
+        cache_dir: Cache directory
+        batch_size: Images per image_processor call
+        workers: Threads decoding images
+
+    Returns:
+        ArrayCache: The cache, keyed by image file name
+    """
+    image_processor = processor.image_processor
+    unique_paths = list(dict.fromkeys(image_paths))
+
+    # Output shape of the processor (3 x H x W)
+    probe = image_processor(images=Image.new('RGB', (64, 64)), return_tensors='np')['pixel_values'][0]
+    cache = ArrayCache(cache_dir, probe.shape, processor_fingerprint(image_processor))
+
+    todo = [path for path in unique_paths if image_cache_key(path) not in cache]
+    print(f"Pixel cache: {len(unique_paths) - len(todo)} images cached, {len(todo)} to process")
+    if not todo:
+        return cache
+
+    def processed():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(todo), batch_size):
+                paths = todo[start:start + batch_size]
+                images = list(executor.map(_load_rgb, paths))
+                loaded = [(path, image) for path, image in zip(paths, images) if image is not None]
+                if not loaded:
+                    continue
+                pixels = image_processor(images=[image for _, image in loaded], return_tensors='np')['pixel_values']
+                for (path, _), pixel_values in zip(loaded, pixels):
+                    yield image_cache_key(path), pixel_values
+
+    written = cache.put_many(processed())
+    print(f"Pixel cache: added {written} images to {cache_dir}")
+    return cache
+
+class TokenizedExamples:
+    """
+    Question and answer token ids for a list of examples
+
+    Stored as two flat int32 arrays with offsets, without any padding, so
+    they take a few bytes per token and can be saved next to the data.
+    """
+
+    def __init__(self, question_ids, question_offsets, answer_ids, answer_offsets):
+        self.question_ids = question_ids
+        self.question_offsets = question_offsets
+        self.answer_ids = answer_ids
+        self.answer_offsets = answer_offsets
+
+    @staticmethod
+    def _flatten(tokenizer, texts, max_length, batch_size):
+        ids = []
+        lengths = []
+        for start in range(0, len(texts), batch_size):
+            encoded = tokenizer(
+                texts[start:start + batch_size],
+                max_length=max_length,
+                truncation=True,
+                return_attention_mask=False,
+                return_token_type_ids=False
+            )['input_ids']
+            for token_ids in encoded:
+                ids.extend(token_ids)
+                lengths.append(len(token_ids))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return np.asarray(ids, dtype=np.int32), offsets
+
+    @classmethod
+    def build(cls, questions, answers, tokenizer, max_length=32, batch_size=1024):
+        """
+        Tokenize every question and answer once
+
+        Args:
+            questions: Question strings
+            answers: Answer strings (same order)
+            tokenizer: BLIP tokenizer (processor.tokenizer)
+            max_length: Truncation length, as used at training time
+            batch_size: Texts per tokenizer call
+
+        Returns:
+            TokenizedExamples: Token ids for every example
+        """
+        question_ids, question_offsets = cls._flatten(tokenizer, list(questions), max_length, batch_size)
+        answer_ids, answer_offsets = cls._flatten(tokenizer, list(answers), max_length, batch_size)
+        return cls(question_ids, question_offsets, answer_ids, answer_offsets)
+
+    def __len__(self):
+        return len(self.question_offsets) - 1
+
+    def question(self, idx):
+        """Token ids of an example's question"""
+        return self.question_ids[self.question_offsets[idx]:self.question_offsets[idx + 1]]
+
+    def answer(self, idx):
+        """Token ids of an example's answer"""
+        return self.answer_ids[self.answer_offsets[idx]:self.answer_offsets[idx + 1]]
+
+    @property
+    def question_lengths(self):
+        return np.diff(self.question_offsets)
+
+    @property
+    def answer_lengths(self):
+        return np.diff(self.answer_offsets)
+
+    def save(self, path):
+        """Write the arrays to an .npz file"""
+        np.savez(path, question_ids=self.question_ids, question_offsets=self.question_offsets,
+                 answer_ids=self.answer_ids, answer_offsets=self.answer_offsets)
+
+    @classmethod
+    def load(cls, path):
+        """Read arrays written by save()"""
+        with np.load(path) as data:
+            return cls(data['question_ids'], data['question_offsets'], data['answer_ids'], data['answer_offsets'])
+
+def collate_vqa(batch, pad_token_id=0, group_images=False, label_length=32):
+    """
+    Collate pre-tokenized examples, padding questions only to the longest in the batch
+
+    Labels keep the notebook's fixed padding by default: BLIP feeds them to
+    the answer decoder as its inputs too, so label padding can't be masked
+    with -100, and its cross-entropy covers the pad positions. Padding them
+    to a fixed length keeps that objective (and the reported loss) the same
+    for every batch.
+
+    Args:
+        batch: List of dicts from VQADataset (with tokenized set)
+        pad_token_id: Padding id (processor.tokenizer.pad_token_id)
+        group_images: Keep one pixel_values row per distinct image, plus an
+            image_index mapping each example to its row (see vqa_model)
+        label_length: Length labels are padded to (the dataset's max_length);
+            None pads them to the longest answer, which changes the loss
+
+    Returns:
+        dict: pixel_values and/or image_embeds, input_ids, attention_mask and
+            labels tensors (and image_index / example_index when grouping
+            images). A batch mixing cached and uncached images also gets an
+            image_cached mask: image_embeds holds the cached rows and
+            pixel_values the others, in order. None if every example failed
+            to load
+    """
+    batch = [example for example in batch if example is not None]
+    if not batch:
+        return None
+
+    def stack_images(examples):
+        # Items carry cached vision encoder outputs instead of pixels when available
+        cached = ['image_embeds' in example for example in examples]
+        if all(cached):
+            return {'image_embeds': torch.stack([example['image_embeds'] for example in examples])}
+        if not any(cached):
+            return {'pixel_values': torch.stack([example['pixel_values'] for example in examples])}
+        return {
+            'image_embeds': torch.stack([example['image_embeds'] for example, hit in zip(examples, cached) if hit]),
+            'pixel_values': torch.stack([example['pixel_values'] for example, hit in zip(examples, cached) if not hit]),
+            'image_cached': torch.tensor(cached, dtype=torch.bool)
+        }
+
+    def pad(sequences, length=None):
+        longest = max(max(len(seq) for seq in sequences), length or 0)
+        padded = torch.full((len(sequences), longest), pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(sequences), longest), dtype=torch.long)
+        for row, seq in enumerate(sequences):
+            padded[row, :len(seq)] = seq
+            mask[row, :len(seq)] = 1
+        return padded, mask
+
+    input_ids, attention_mask = pad([example['input_ids'] for example in batch])
+    labels, _ = pad([example['labels'] for example in batch], label_length)
+    if group_images:
+        rows = {}
+        image_index = [rows.setdefault(example['image_key'], len(rows)) for example in batch]
+        images = [None] * len(rows)
+        for example, row in zip(batch, image_index):
+            images[row] = example
+        return {
+            **stack_images(images),
+            'image_index': torch.tensor(image_index, dtype=torch.long),
+            'example_index': torch.tensor([example['example_index'] for example in batch], dtype=torch.long),
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'labels': labels
+        }
+    return {
+        **stack_images(batch),
+        'input_ids': input_ids,
+        'attention_mask': attention_mask,
+        'labels': labels
+    }
+
+def make_collate_fn(processor, group_images=False, label_length=32):
+    """collate_vqa bound to the processor's pad id (picklable for DataLoader workers)"""
+    return partial(collate_vqa, pad_token_id=processor.tokenizer.pad_token_id, group_images=group_images,
+                   label_length=label_length)
+
+class LengthGroupedSampler(Sampler):
+    """
+    Random order in which neighbouring examples have similar lengths
+
+    Indices are shuffled, cut into mega-batches of batch_size * mega_batch_mult,
+    and each mega-batch is sorted by length, so consecutive batches are
+    nearly uniform in length (little padding) while the order stays random.
+
+    Args:
+        lengths: Token length per example (e.g. dataset.lengths)
+        batch_size: DataLoader batch size
+        mega_batch_mult: Mega-batch size in batches
+        seed: Base seed; call set_epoch() for a new order every epoch
+    """
+
+    def __init__(self, lengths, batch_size, mega_batch_mult=50, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.mega_batch_mult = mega_batch_mult
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        perm = rng.permutation(len(self.lengths))
+        mega = self.batch_size * self.mega_batch_mult
+        for start in range(0, len(perm), mega):
+            chunk = perm[start:start + mega]
+            chunk = chunk[np.argsort(-self.lengths[chunk], kind='stable')]
+            yield from chunk.tolist()
+
+class ImageGroupedBatchSampler(Sampler):
+    """
+    Batches that keep all questions about an image together
+
+    Examples are grouped by image and whole groups are packed into batches
+    of at most batch_size examples (a group larger than that is split), so
+    the vision encoder only has to run once per image in each batch. Use as
+    the DataLoader's batch_sampler with make_collate_fn(processor,
+    group_images=True).
+
+    Args:
+        image_keys: Image per example (e.g. dataset.image_keys)
+        batch_size: Maximum examples per batch
+        shuffle: Shuffle the order of the image groups every epoch
+        seed: Base seed; call set_epoch() for a new order every epoch
+    """
+
+    def __init__(self, image_keys, batch_size, shuffle=True, seed=0):
+        groups = {}
+        for idx, key in enumerate(image_keys):
+            groups.setdefault(key, []).append(idx)
+        self.groups = list(groups.values())
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        order = range(len(self.groups))
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(len(self.groups))
+        batches = []
+        current = []
+        for group_idx in order:
+            group = self.groups[group_idx]
+            if current and len(current) + len(group) > self.batch_size:
+                batches.append(current)
+                current = []
+            for start in range(0, len(group), self.batch_size):
+                chunk = group[start:start + self.batch_size]
+                if len(current) + len(chunk) > self.batch_size:
+                    batches.append(current)
+                    current = []
+                current = current + chunk
+        if current:
+            batches.append(current)
+        return batches
+
+    def __len__(self):
+        return len(self._batches())
+
+    def __iter__(self):
+        yield from self._batches()
+
+class ExampleManifest:
+    """
+    One row per QA pair across every loaded batch
+
+    Each example gets a global ID (its row) that is stable as long as the
+    QA files don't change: batches are numbered in batch order and later
+    batches only append rows. The row records which batch, image file and
+    QA pair it came from, so any set of batches can be turned into a
+    dataset with a single linear pass, with no searching.
+    """
+
+    def __init__(self):
+        self.batch_names = []
+        self._batch_codes = []
+        self.image_filenames = []
+        self.item_index = []
+        self.qa_index = []
+        self.questions = []
+        self.answers = []
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add_batch(self, batch_name, items):
+        """
+        Append every QA pair of a batch
+
+        Args:
+            batch_name: Batch name (e.g. 'batch5')
+            items: Iterable of QA items (image_filename, qa_pairs)
+
+        Returns:
+            int: Number of QA items seen
+        """
+        if batch_name in self.batch_names:
+            raise ValueError(f"{batch_name} is already in the manifest")
+        code = len(self.batch_names)
+        self.batch_names.append(batch_name)
+        count = 0
+        for item_idx, item in enumerate(items):
+            for qa_idx, qa_pair in enumerate(item['qa_pairs']):
+                self._batch_codes.append(code)
+                self.image_filenames.append(item['image_filename'])
+                self.item_index.append(item_idx)
+                self.qa_index.append(qa_idx)
+                self.questions.append(qa_pair['question'])
+                self.answers.append(qa_pair['answer'])
+            count += 1
+        return count
+
+    @property
+    def batch_codes(self):
+        return np.asarray(self._batch_codes, dtype=np.int32)
+
+    def batch_of(self, example_id):
+        """Batch name an example belongs to"""
+        return self.batch_names[self._batch_codes[example_id]]
+
+    def select(self, batch_names):
+        """
+        Example IDs belonging to some batches
+
+        Args:
+            batch_names: Batch names to include
+
+        Returns:
+            np.ndarray: Sorted example IDs
+        """
+        missing = [name for name in batch_names if name not in self.batch_names]
+        if missing:
+            raise KeyError(f"Batches not in the manifest: {missing}")
+        codes = [self.batch_names.index(name) for name in batch_names]
+        return np.flatnonzero(np.isin(self.batch_codes, codes))
+
+    def examples(self, batch_names, base_path):
+        """
+        Flattened examples for VQADataset
+
+        Args:
+            batch_names: Batch names to include
+            base_path: Base path holding one folder per batch
+
+        Returns:
+            list: Dicts with example_id, image_path, question and answer
+        """
+        return [
+            {
+                'example_id': int(example_id),
+                'image_path': os.path.join(base_path, self.batch_of(example_id), self.image_filenames[example_id]),
+                'question': self.questions[example_id],
+                'answer': self.answers[example_id],
+            }
+            for example_id in self.select(batch_names)
+        ]
+
+def _batch_number(file_name):
+    match = re.match(r'batch(\d+)_', file_name)
+    return int(match.group(1)) if match else float('inf')
+
+def load_qa_data(base_path):
+    """
+    Load every batchN_qa_dataset file and build the example manifest
+
+    Files are read in batch-number order (batch10 after batch9), streaming
+    .json, .jsonl or .jsonl.gz alike.
+
+    Args:
+        base_path: Directory with the batchN_qa_dataset files
+
+    Returns:
+        tuple: ({batch name: list of QA items}, ExampleManifest)
+    """
+    qa_files = [f for f in os.listdir(base_path) if re.match(r'batch\d+_qa_dataset\.(json|jsonl|jsonl\.gz)$', f)]
+    qa_data = {}
+    manifest = ExampleManifest()
+    for qa_file in sorted(qa_files, key=lambda f: (_batch_number(f), f)):
+        batch_name = qa_file.split('_')[0]
+        if batch_name in qa_data:
+            print(f"Skipping {qa_file}: {batch_name} already loaded")
+            continue
+        qa_data[batch_name] = list(iter_metadata(os.path.join(base_path, qa_file)))
+        manifest.add_batch(batch_name, qa_data[batch_name])
+        print(f"Loaded {qa_file} with {len(qa_data[batch_name])} items")
+    print(f"Manifest holds {len(manifest)} QA pairs from {len(manifest.batch_names)} batches")
+    return qa_data, manifest
+
+def create_combined_dataset(batch_names, processor, manifest, base_path, max_length=32, **kwargs):
+    """
+    Dataset over several batches, each image resolved to its own batch folder
+
+    Drop-in for the notebook's create_combined_dataset, built from the
+    manifest in linear time.
+
+    Args:
+        batch_names: Batches to combine (e.g. ["batch1", "batch2", "batch3"])
+        processor: BLIP processor
+        manifest: ExampleManifest from load_qa_data
+        base_path: Base path to the dataset
+        max_length: Maximum sequence length
+        **kwargs: pixel_cache / tokenized, as for VQADataset
+
+    Returns:
+        VQADataset: The combined dataset
+    """
+    for batch in batch_names:
+        print(f"Adding {batch} data...")
+    return VQADataset.from_manifest(manifest, batch_names, base_path, processor, max_length=max_length, **kwargs)
+
+class VQADataset(Dataset):
+    def __init__(self, qa_data, base_path, batch_name, processor, max_length=32, pixel_cache=None, tokenized=None,
+                 examples=None, image_embeddings=None):
+        """
+        Initialize the VQA dataset.
+
+        Args:
+            qa_data: List of QA items
+            base_path: Base path to the dataset
+            batch_name: Name of the batch (e.g., 'batch1')
+            processor: BLIP processor for tokenization and image processing
+            max_length: Maximum sequence length
+            pixel_cache: Optional ArrayCache from build_pixel_cache; images found
+                in it are not decoded or preprocessed again
+            tokenized: Optional TokenizedExamples aligned with the examples (see
+                pretokenize); items are then returned unpadded for collate_vqa
+            examples: Already flattened examples (e.g. from an ExampleManifest),
+                used instead of flattening qa_data
+            image_embeddings: Optional ArrayCache from vqa_model.build_embedding_cache;
+                pre-tokenized items then carry image_embeds instead of pixel_values
+        """
+        self.qa_data = qa_data
+        self.base_path = base_path
+        self.batch_name = batch_name
+        self.processor = processor
+        self.max_length = max_length
+        self.pixel_cache = pixel_cache
+        self.tokenized = tokenized
+        self.image_embeddings = image_embeddings
+
+        # Flatten the dataset structure for one entry per QA pair
+        self.examples = examples if examples is not None else []
+        for item in (qa_data if examples is None else []):
+            image_path = os.path.join(base_path, batch_name, item['image_filename'])
+            for qa_pair in item['qa_pairs']:
+                self.examples.append({
+                    'image_path': image_path,
+                    'question': qa_pair['question'],
+                    'answer': qa_pair['answer'],
+                })
+
+        print(f"Created dataset with {len(self.examples)} examples from {self.batch_name}")
+
+    @classmethod
+    def from_manifest(cls, manifest, batch_names, base_path, processor, max_length=32, **kwargs):
+        """
+        Build a dataset over any set of batches in linear time
+
+        Args:
+            manifest: ExampleManifest from load_qa_data
+            batch_names: Batches to include (e.g. ["batch1", "batch2", "batch3"])
+            base_path: Base path to the dataset (holding one folder per batch)
+            processor: BLIP processor
+            max_length: Maximum sequence length
+            **kwargs: pixel_cache / tokenized / image_embeddings, as for the constructor
+
+        Returns:
+            VQADataset: One example per QA pair, in manifest order
+        """
+        return cls(None, base_path, "+".join(batch_names), processor, max_length=max_length,
+                   examples=manifest.examples(batch_names, base_path), **kwargs)
+
+    def __len__(self):
+        return len(self.examples)
+
+    def pretokenize(self, cache_file=None):
+        """
+        Tokenize all questions and answers once (optionally cached in an .npz)
+
+        After this, items hold unpadded token ids; use make_collate_fn(processor)
+        as the DataLoader's collate_fn.
+
+        Args:
+            cache_file: Optional .npz path to load from or save to
+
+        Returns:
+            TokenizedExamples: The token ids (also set on the dataset)
+        """
+        tokenized = None
+        if cache_file and os.path.exists(cache_file):
+            tokenized = TokenizedExamples.load(cache_file)
+            if len(tokenized) != len(self.examples):
+                print(f"Ignoring {cache_file}: built for {len(tokenized)} examples, not {len(self.examples)}")
+                tokenized = None
+        if tokenized is None:
+            tokenized = TokenizedExamples.build(
+                [example['question'] for example in self.examples],
+                [example['answer'] for example in self.examples],
+                self.processor.tokenizer,
+                max_length=self.max_length
+            )
+            if cache_file:
+                tokenized.save(cache_file)
+        self.tokenized = tokenized
+        return tokenized
+
+    @property
+    def image_keys(self):
+        """Image path per example, for ImageGroupedBatchSampler"""
+        return [example['image_path'] for example in self.examples]
+
+    @property
+    def lengths(self):
+        """Question plus answer token count per example (requires pretokenize)"""
+        return self.tokenized.question_lengths + self.tokenized.answer_lengths
+
+    def _cached_pixels(self, image_path):
+        if self.pixel_cache is None:
+            return None
+        pixels = self.pixel_cache.get(image_cache_key(image_path))
+        if pixels is None:
+            return None
+        return torch.from_numpy(np.array(pixels, dtype=np.float32))
+
+    def _cached_embeddings(self, image_path):
+        if self.image_embeddings is None:
+            return None
+        embeds = self.image_embeddings.get(image_cache_key(image_path))
+        if embeds is None:
+            return None
+        return torch.from_numpy(np.array(embeds, dtype=np.float32))
+
+    def load_pixels(self, image_path):
+        """Preprocessed pixel_values for an image, from the pixel cache if possible"""
+        pixel_values = self._cached_pixels(image_path)
+        if pixel_values is None:
+            image = Image.open(image_path).convert('RGB')
+            pixel_values = self.processor.image_processor(images=image, return_tensors="pt")["pixel_values"][0]
+        return pixel_values
+
+    def _pretokenized_item(self, idx, example):
+        input_ids = torch.from_numpy(self.tokenized.question(idx).astype(np.int64))
+        item = {}
+        image_embeds = self._cached_embeddings(example['image_path'])
+        if image_embeds is not None:
+            item["image_embeds"] = image_embeds
+        else:
+            item["pixel_values"] = self.load_pixels(example['image_path'])
+        item.update({
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "labels": torch.from_numpy(self.tokenized.answer(idx).astype(np.int64)),
+            "image_key": example['image_path'],
+            "example_index": idx
+        })
+        return item
+
+    def __getitem__(self, idx):
+        example = self.examples[idx]
+
+        try:
+            if self.tokenized is not None:
+                return self._pretokenized_item(idx, example)
+
+            pixel_values = self._cached_pixels(example['image_path'])
+            if pixel_values is not None:
+                # Image already preprocessed: only the question needs tokenizing
+                inputs = self.processor.tokenizer(
+                    example['question'],
+                    return_tensors="pt",
+                    padding="max_length",
+                    max_length=self.max_length,
+                    truncation=True,
+                    return_token_type_ids=False
+                )
+                inputs["pixel_values"] = pixel_values.unsqueeze(0)
+            else:
+                image = Image.open(example['image_path']).convert('RGB')
+
+                # Process the input (image + question)
+                inputs = self.processor(
+                    images=image,
+                    text=example['question'],
+                    return_tensors="pt",
+                    padding="max_length",
+                    max_length=self.max_length,
+                    truncation=True
+                )
+
+            # Remove batch dimension
+            for k, v in inputs.items():
+                inputs[k] = v.squeeze(0)
+
+            # Process the target (answer)
+            target = self.processor.tokenizer(
+                example['answer'],
+                padding="max_length",
+                max_length=self.max_length,
+                truncation=True,
+                return_tensors="pt"
+            )
+
+            inputs["labels"] = target["input_ids"].squeeze(0)
+
+            return inputs
+
+        except Exception as e:
+            print(f"Error processing {example['image_path']}: {e}")
+            # Return a placeholder in case of error
+            return self[0] if idx != 0 else None
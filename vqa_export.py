@@ -0,0 +1,273 @@
+import argparse
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from vqa_model import encode_images, evaluate_lean, vqa_generate
+from vqa_serve import BASE_MODEL_NAME, load_merged_model
+
+# Weight formats an export can use
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+def convert(model, precision):
+    """
+    Convert a merged model for CPU inference
+
+    Args:
+        model: Merged BLIP VQA model (fp32)
+        precision: 'fp32', 'int8' (dynamic quantization of every nn.Linear,
+            activations quantized on the fly) or 'bf16'
+
+    Returns:
+        torch.nn.Module: The converted model, in eval mode
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    model.eval()
+    if precision == 'int8':
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == 'bf16':
+        return model.to(torch.bfloat16)
+    return model
+
+def export_model(adapter_path, output_dir, precision='int8', base_model_name=BASE_MODEL_NAME):
+    """
+    Merge a LoRA checkpoint into the base weights and save a CPU artifact
+
+    The artifact holds the config, the processor and the converted state
+    dict, so loading it never touches the hub or the adapter machinery.
+
+    Args:
+        adapter_path: LoRA checkpoint (e.g. blip_lora_checkpoints/best_model_epoch_3)
+        output_dir: Artifact directory
+        precision: 'fp32', 'int8' or 'bf16'
+        base_model_name: Base model name or path
+
+    Returns:
+        str: output_dir
+    """
+    model, processor = load_merged_model(adapter_path, base_model_name)
+    model = convert(model, precision)
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+    tmp_path = os.path.join(output_dir, f"model_state.pt.tmp{os.getpid()}")
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, os.path.join(output_dir, 'model_state.pt'))
+    with open(os.path.join(output_dir, 'export.json'), 'w', encoding='utf-8') as f:
+        json.dump({'precision': precision, 'adapter': adapter_path, 'base_model': base_model_name}, f, indent=2)
+    print(f"Exported {precision} model to {output_dir} ({model_size_mb(model):.1f} MB)")
+    return output_dir
+
+def load_exported(output_dir):
+    """
+    Load an artifact written by export_model
+
+    Args:
+        output_dir: Artifact directory
+
+    Returns:
+        tuple: (model, processor, precision)
+    """
+    from transformers import AutoConfig, AutoModelForVisualQuestionAnswering, AutoProcessor
+
+    with open(os.path.join(output_dir, 'export.json'), 'r', encoding='utf-8') as f:
+        precision = json.load(f)['precision']
+    config = AutoConfig.from_pretrained(output_dir)
+    # Same module structure as at export time, then the saved weights
+    model = convert(AutoModelForVisualQuestionAnswering.from_config(config), precision)
+    state = torch.load(os.path.join(output_dir, 'model_state.pt'), map_location='cpu', weights_only=False)
+    model.load_state_dict(state)
+    model.eval()
+    return model, AutoProcessor.from_pretrained(output_dir), precision
+
+def model_size_mb(model):
+    """Serialized size of a model's weights in MB"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 ** 2
+
+def rss_mb():
+    """Resident memory of this process in MB (None where /proc/self/statm doesn't exist, e.g. Windows)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _peak_rss_mb(fn, interval=0.005):
+    # Run fn while a thread samples RSS; ru_maxrss can't be used here because it
+    # only ever grows, so after the first variant it no longer reflects the current one
+    start = rss_mb()
+    if start is None:
+        return fn(), None
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = fn()
+    finally:
+        done.set()
+        sampler.join()
+    return result, max(peak[0], rss_mb())
+
+def _prepare(processor, requests):
+    from PIL import Image
+
+    pixel_values = torch.stack([
+        processor.image_processor(images=Image.open(image_path).convert('RGB'), return_tensors="pt")["pixel_values"][0]
+        for image_path, _, _ in requests
+    ])
+    inputs = processor.tokenizer([question for _, question, _ in requests], padding=True, return_tensors="pt",
+                                 return_token_type_ids=False)
+    return pixel_values, inputs["input_ids"], inputs["attention_mask"]
+
+def time_requests(model, processor, requests, batch_size, repeats=20, max_new_tokens=10):
+    """
+    Latency of answering batches of requests (preprocessing excluded)
+
+    Args:
+        model: Model to time
+        processor: BLIP processor
+        requests: (image_path, question, answer) tuples to draw batches from
+        batch_size: Requests per call
+        repeats: Timed calls (after one warm-up call)
+        max_new_tokens: Generation budget
+
+    Returns:
+        np.ndarray: Seconds per call
+    """
+    # Only the batches that will be timed are preprocessed
+    batches = [_prepare(processor, requests[start:start + batch_size])
+               for start in range(0, min(len(requests) - batch_size + 1, repeats * batch_size), batch_size)]
+    if not batches:
+        raise ValueError(f"Need at least {batch_size} requests")
+    timings = []
+    with torch.inference_mode():
+        for call in range(repeats + 1):
+            pixel_values, input_ids, attention_mask = batches[call % len(batches)]
+            start = time.perf_counter()
+            image_embeds = encode_images(model, pixel_values)
+            vqa_generate(model, input_ids, attention_mask, image_embeds, max_new_tokens=max_new_tokens)
+            if call:
+                timings.append(time.perf_counter() - start)
+    return np.asarray(timings)
+
+def benchmark(variants, processor, requests, batch_sizes=(1, 8), repeats=20, eval_loader=None, eval_dataset=None,
+              load_rss_mb=None):
+    """
+    Compare exported variants against fp32
+
+    Args:
+        variants: {name: model}; the first is the reference (normally fp32)
+        processor: BLIP processor
+        requests: (image_path, question, answer) tuples (e.g. from batch4)
+        batch_sizes: Batch sizes to time (1 = single request)
+        repeats: Timed calls per batch size
+        eval_loader: Optional DataLoader over the pre-tokenized batch4 dataset
+        eval_dataset: The dataset behind eval_loader, for the accuracy check
+        load_rss_mb: Optional {name: MB} resident memory each variant added when loaded
+
+    Returns:
+        pd.DataFrame: One row per variant with size, memory, latency, throughput and,
+            with an eval set, exact-match accuracy and its change vs the reference.
+            Runtime_Peak_RSS_MB is how far resident memory rose above its level
+            before timing while the variant answered requests (empty without /proc)
+    """
+    rows = []
+    for name, model in variants.items():
+        row = {'Variant': name, 'Size_MB': round(model_size_mb(model), 1)}
+        if load_rss_mb and load_rss_mb.get(name) is not None:
+            row['Load_RSS_MB'] = round(load_rss_mb[name], 1)
+        runtime_peak = None
+        for batch_size in batch_sizes:
+            before = rss_mb()
+            timings, peak = _peak_rss_mb(lambda: time_requests(model, processor, requests, batch_size, repeats))
+            if peak is not None:
+                runtime_peak = max(runtime_peak or 0, peak - before)
+            row[f'Latency_bs{batch_size}_p50_ms'] = round(float(np.percentile(timings, 50)) * 1000, 1)
+            row[f'Latency_bs{batch_size}_p95_ms'] = round(float(np.percentile(timings, 95)) * 1000, 1)
+            row[f'Throughput_bs{batch_size}_per_s'] = round(batch_size / float(np.mean(timings)), 2)
+        row['Runtime_Peak_RSS_MB'] = None if runtime_peak is None else round(runtime_peak, 1)
+        if eval_loader is not None:
+            results = evaluate_lean(model, eval_loader, eval_dataset, processor, torch.device('cpu'), model_name=name)
+            row['Accuracy'] = round(results['accuracy'], 4)
+        rows.append(row)
+        print(row)
+
+    report = pd.DataFrame(rows)
+    if 'Accuracy' in report:
+        report['Accuracy_Delta'] = (report['Accuracy'] - report['Accuracy'].iloc[0]).round(4)
+    return report
+
+def _load_batch4(args, processor):
+    from torch.utils.data import DataLoader
+
+    from metadata_io import load_metadata
+    from vqa_data import VQADataset, make_collate_fn
+    from vqa_serve import load_requests
+
+    requests = load_requests(args.qa_file, args.base_path, args.batch_name)
+    dataset = VQADataset(load_metadata(args.qa_file), args.base_path, args.batch_name, processor)
+    dataset.pretokenize()
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, collate_fn=make_collate_fn(processor))
+    return requests, dataset, loader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the merged LoRA BLIP-VQA model for CPU and benchmark it")
+    parser.add_argument('command', choices=['export', 'bench'])
+    parser.add_argument('--adapter', required=True, help="LoRA checkpoint (e.g. blip_lora_checkpoints/best_model_epoch_3)")
+    parser.add_argument('--base-model', default=BASE_MODEL_NAME)
+    parser.add_argument('--output-dir', default="blip_vqa_export")
+    parser.add_argument('--precision', nargs='+', default=['int8'], choices=PRECISIONS,
+                        help="Precisions to export (or to benchmark next to fp32)")
+    parser.add_argument('--qa-file', default="batch4_qa_dataset.json")
+    parser.add_argument('--base-path', default=".", help="Directory holding the batch image folders")
+    parser.add_argument('--batch-name', default="batch4")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--no-accuracy', action='store_true', help="Skip the batch4 accuracy check")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        for precision in args.precision:
+            export_model(args.adapter, os.path.join(args.output_dir, precision), precision, args.base_model)
+    else:
+        # Resident memory each variant adds when loaded
+        load_rss = {}
+        before = rss_mb()
+        reference, processor = load_merged_model(args.adapter, args.base_model)
+        variants = {'fp32': reference}
+        load_rss['fp32'] = None if before is None else rss_mb() - before
+        for precision in args.precision:
+            if precision == 'fp32':
+                continue
+            path = os.path.join(args.output_dir, precision)
+            before = rss_mb()
+            if os.path.exists(os.path.join(path, 'export.json')):
+                start = time.perf_counter()
+                variants[precision] = load_exported(path)[0]
+                print(f"Loaded {path} in {time.perf_counter() - start:.1f}s")
+            else:
+                variants[precision] = convert(load_merged_model(args.adapter, args.base_model)[0], precision)
+            load_rss[precision] = None if before is None else rss_mb() - before
+        requests, dataset, loader = _load_batch4(args, processor)
+        report = benchmark(variants, processor, requests, batch_sizes=(1, args.batch_size), repeats=args.repeats,
+                           eval_loader=None if args.no_accuracy else loader,
+                           eval_dataset=None if args.no_accuracy else dataset, load_rss_mb=load_rss)
+        print(report.to_string(index=False))
+        os.makedirs(args.output_dir, exist_ok=True)
+        report.to_csv(os.path.join(args.output_dir, 'benchmark.csv'), index=False)
@@ -0,0 +1,431 @@
+import hashlib
+import time
+
+import numpy as np
+import torch
+from tqdm.auto import tqdm
+
+from vqa_data import ArrayCache, image_cache_key, processor_fingerprint
+
+def unwrap_model(model):
+    """
+    The BlipForQuestionAnswering under a PEFT wrapper
+
+    LoRA layers are injected into the base model in place, so calling its
+    submodules directly still goes through the adapters.
+    """
+    return model.get_base_model() if hasattr(model, 'get_base_model') else model
+
+def encode_images(model, pixel_values):
+    """
+    Run BLIP's vision encoder
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        pixel_values: (num_images, 3, H, W) tensor
+
+    Returns:
+        torch.Tensor: (num_images, num_patches + 1, hidden) image embeddings
+    """
+    blip = unwrap_model(model)
+    # Match the weights' dtype (e.g. a bfloat16 export)
+    return blip.vision_model(pixel_values=pixel_values.to(blip.dtype))[0]
+
+def vision_fingerprint(model, extra=''):
+    """
+    Hash of the vision encoder's weights
+
+    LoRA here only targets the text side's query/key/value layers, so the
+    baseline model and every fine-tuned checkpoint share this fingerprint
+    (and therefore the embedding cache).
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        extra: Anything else the embeddings depend on (e.g. preprocessing)
+
+    Returns:
+        str: SHA-256 over parameter names, dtypes, shapes and values
+    """
+    digest = hashlib.sha256(extra.encode('utf-8'))
+    for name, tensor in sorted(unwrap_model(model).vision_model.state_dict().items()):
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+def build_embedding_cache(model, dataset, cache_dir, device, batch_size=16, dtype='float32'):
+    """
+    Encode every distinct image of a dataset once into an on-disk cache
+
+    The cache is keyed by image and tied to the vision weights' fingerprint,
+    so evaluating the baseline and several LoRA checkpoints encodes each
+    image only the first time. Pass the result to the dataset as
+    image_embeddings (pre-tokenized datasets only).
+
+    Unreadable images are skipped (and logged), like build_pixel_cache
+    does; their items keep using the pixel path.
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        dataset: VQADataset whose images to encode
+        cache_dir: Cache directory
+        device: Device to run the vision encoder on
+        batch_size: Images per vision encoder call
+        dtype: Storage dtype ('float16' halves the size)
+
+    Returns:
+        ArrayCache: Image embeddings keyed by image file name (None if the
+            dataset has no readable images)
+    """
+    image_paths = list(dict.fromkeys(dataset.image_keys))
+    if not image_paths:
+        print("Embedding cache: dataset has no images, nothing to encode")
+        return None
+    model.eval()
+    model.to(device)
+    fingerprint = vision_fingerprint(model, processor_fingerprint(dataset.processor.image_processor))
+
+    def load(path):
+        try:
+            return dataset.load_pixels(path)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return None
+
+    def encode(paths):
+        loaded = [(path, pixel_values) for path, pixel_values in zip(paths, map(load, paths))
+                  if pixel_values is not None]
+        if not loaded:
+            return []
+        pixel_values = torch.stack([pixel_values for _, pixel_values in loaded]).to(device)
+        with torch.no_grad():
+            embeds = encode_images(model, pixel_values).float().cpu().numpy()
+        return [(path, row) for (path, _), row in zip(loaded, embeds)]
+
+    # Probe the output shape with the first readable image
+    probe = []
+    for path in image_paths:
+        probe = encode([path])
+        if probe:
+            break
+    if not probe:
+        print("Embedding cache: no readable images, nothing to encode")
+        return None
+    cache = ArrayCache(cache_dir, probe[0][1].shape, fingerprint, dtype=dtype)
+
+    todo = [path for path in image_paths if image_cache_key(path) not in cache]
+    print(f"Embedding cache: {len(image_paths) - len(todo)} images cached, {len(todo)} to encode")
+
+    def encoded():
+        for start in tqdm(range(0, len(todo), batch_size), desc="Encoding images"):
+            for path, embeds in encode(todo[start:start + batch_size]):
+                yield image_cache_key(path), embeds
+
+    written = cache.put_many(encoded())
+    if written:
+        print(f"Embedding cache: added {written} images to {cache_dir}")
+    return cache
+
+def _encode_questions(blip, input_ids, attention_mask, image_embeds):
+    image_attention_mask = torch.ones(image_embeds.size()[:-1], dtype=torch.long, device=image_embeds.device)
+    return blip.text_encoder(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        encoder_hidden_states=image_embeds,
+        encoder_attention_mask=image_attention_mask,
+        return_dict=False
+    )[0]
+
+def vqa_loss(model, input_ids, attention_mask, labels, image_embeds, image_index=None):
+    """
+    BlipForQuestionAnswering's training loss from precomputed image embeddings
+
+    Same computation as model(input_ids=..., pixel_values=..., labels=...),
+    with the vision encoder step replaced by a lookup, so images shared by
+    several questions are only encoded once.
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        input_ids: Question token ids
+        attention_mask: Question attention mask
+        labels: Answer token ids
+        image_embeds: Output of encode_images
+        image_index: Row of image_embeds for each question (default: one each)
+
+    Returns:
+        torch.Tensor: Mean loss
+    """
+    blip = unwrap_model(model)
+    if image_index is not None:
+        image_embeds = image_embeds[image_index]
+    question_embeds = _encode_questions(blip, input_ids, attention_mask, image_embeds)
+    answer_output = blip.text_decoder(
+        input_ids=labels,
+        encoder_hidden_states=question_embeds,
+        encoder_attention_mask=attention_mask,
+        labels=labels,
+        return_dict=True,
+        reduction="mean"
+    )
+    return answer_output.loss.mean()
+
+def vqa_generate(model, input_ids, attention_mask, image_embeds, image_index=None, **generate_kwargs):
+    """
+    BlipForQuestionAnswering.generate from precomputed image embeddings
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        input_ids: Question token ids
+        attention_mask: Question attention mask
+        image_embeds: Output of encode_images
+        image_index: Row of image_embeds for each question (default: one each)
+        **generate_kwargs: Passed on to the text decoder (e.g. max_length)
+
+    Returns:
+        torch.Tensor: Generated answer token ids
+    """
+    blip = unwrap_model(model)
+    if image_index is not None:
+        image_embeds = image_embeds[image_index]
+    question_embeds = _encode_questions(blip, input_ids, attention_mask, image_embeds)
+    question_attention_mask = torch.ones(question_embeds.size()[:-1], dtype=torch.long, device=question_embeds.device)
+    bos_ids = torch.full((question_embeds.size(0), 1), fill_value=blip.decoder_start_token_id,
+                         device=question_embeds.device)
+    return blip.text_decoder.generate(
+        input_ids=bos_ids,
+        eos_token_id=blip.config.text_config.sep_token_id,
+        pad_token_id=blip.config.text_config.pad_token_id,
+        encoder_hidden_states=question_embeds,
+        encoder_attention_mask=question_attention_mask,
+        **generate_kwargs
+    )
+
+def batch_image_embeds(model, batch):
+    """
+    Image embeddings for a collate_vqa batch
+
+    Cached embeddings come from the dataset; the encoder only runs on the
+    rest (all rows, or the uncached rows of a mixed batch).
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        batch: Batch already on the model's device
+
+    Returns:
+        torch.Tensor: One row per image row of the batch
+    """
+    dtype = unwrap_model(model).dtype
+    if 'pixel_values' not in batch:
+        return batch["image_embeds"].to(dtype)
+    encoded = encode_images(model, batch["pixel_values"])
+    if 'image_embeds' not in batch:
+        return encoded
+    cached = batch["image_cached"]
+    image_embeds = encoded.new_empty((len(cached),) + tuple(encoded.shape[1:]))
+    image_embeds[cached] = batch["image_embeds"].to(encoded.dtype)
+    image_embeds[~cached] = encoded
+    return image_embeds
+
+def batch_loss(model, batch):
+    """
+    Training loss for a DataLoader batch, grouped by image or not
+
+    Drop-in for model(...).loss in the training loop: batches from
+    ImageGroupedBatchSampler (with an image_index) encode each image once,
+    and batches with cached image_embeds skip the vision encoder.
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        batch: Batch already on the model's device
+
+    Returns:
+        torch.Tensor: Mean loss
+    """
+    if 'image_index' not in batch and 'image_embeds' not in batch:
+        return model(
+            input_ids=batch["input_ids"],
+            pixel_values=batch["pixel_values"],
+            attention_mask=batch["attention_mask"],
+            labels=batch["labels"],
+            return_dict=True
+        ).loss
+    image_embeds = batch_image_embeds(model, batch)
+    return vqa_loss(model, batch["input_ids"], batch["attention_mask"], batch["labels"],
+                    image_embeds, batch.get("image_index"))
+
+def batch_generate(model, batch, **generate_kwargs):
+    """
+    Generated answer ids for a DataLoader batch, grouped by image or not
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        batch: Batch already on the model's device
+        **generate_kwargs: Generation settings (e.g. max_length)
+
+    Returns:
+        torch.Tensor: Generated answer token ids
+    """
+    if 'image_index' not in batch and 'image_embeds' not in batch:
+        return model.generate(
+            pixel_values=batch["pixel_values"],
+            input_ids=batch["input_ids"],
+            attention_mask=batch["attention_mask"],
+            **generate_kwargs
+        )
+    image_embeds = batch_image_embeds(model, batch)
+    return vqa_generate(model, batch["input_ids"], batch["attention_mask"], image_embeds,
+                        batch.get("image_index"), **generate_kwargs)
+
+def evaluate_model_with_details(model, dataloader, processor, device, model_name="Model", max_length=32):
+    """
+    Exact-match evaluation that also keeps every prediction
+
+    Works with the notebook's DataLoaders and with image-grouped ones; for
+    the latter results are put back in dataset order via example_index.
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        dataloader: Evaluation DataLoader
+        processor: BLIP processor (for decoding)
+        device: Device to evaluate on
+        model_name: Name used in progress and result messages
+        max_length: Maximum generated length
+
+    Returns:
+        dict: correct, total, accuracy, predictions, ground_truths, is_correct
+    """
+    model.eval()
+    model.to(device)
+
+    pairs = {}
+    with torch.no_grad():
+        for batch in tqdm(dataloader, desc=f"Evaluating {model_name}"):
+            if batch is None:
+                continue  # every image in the batch failed to load
+            batch = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+            generated_ids = batch_generate(model, batch, max_length=max_length)
+
+            generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=True)
+            gt_texts = processor.batch_decode(batch["labels"], skip_special_tokens=True)
+            if "example_index" in batch:
+                indices = batch["example_index"].tolist()
+            else:
+                indices = range(len(pairs), len(pairs) + len(gt_texts))
+            for idx, pred, gt in zip(indices, generated_texts, gt_texts):
+                pairs[idx] = (pred.strip().lower(), gt.strip().lower())
+
+    ordered = [pairs[idx] for idx in sorted(pairs)]
+    results = {
+        "predictions": [pred for pred, _ in ordered],
+        "ground_truths": [gt for _, gt in ordered],
+        "is_correct": [pred == gt for pred, gt in ordered]
+    }
+    results["correct"] = sum(results["is_correct"])
+    results["total"] = len(ordered)
+    results["accuracy"] = results["correct"] / results["total"] if results["total"] > 0 else 0
+    print(f"{model_name} results: {results['correct']}/{results['total']} correct, Accuracy: {results['accuracy']:.4f}")
+
+    return results
+
+def answer_token_cap(dataset, quantile=1.0, max_length=32):
+    """
+    Generation budget (max_new_tokens) from the dataset's answer lengths
+
+    Tokenized answers are [CLS] answer [SEP]. The decoder starts from its
+    own BOS token, so the longest answer needs len - 1 new tokens. One more
+    is allowed so a prediction that runs past every ground truth is still
+    seen as too long, keeping exact-match results the same as with the
+    full max_length. A quantile below 1 trades that guarantee for speed.
+
+    Args:
+        dataset: Pre-tokenized VQADataset
+        quantile: Answer length quantile to cover
+        max_length: Upper bound, as used by the original evaluation
+
+    Returns:
+        int: max_new_tokens for generate
+    """
+    lengths = dataset.tokenized.answer_lengths
+    if len(lengths) == 0:
+        return max_length - 1
+    return int(min(np.ceil(np.quantile(lengths, quantile)), max_length - 1))
+
+def decode_answers(dataset, processor):
+    """
+    Normalized ground-truth answers, decoded once
+
+    Decodes the pre-tokenized answer ids exactly as the notebook decodes
+    batch["labels"] (so truncation and tokenizer normalization match).
+
+    Args:
+        dataset: Pre-tokenized VQADataset
+        processor: BLIP processor
+
+    Returns:
+        list: Lower-cased, stripped answer per example
+    """
+    answers = [dataset.tokenized.answer(idx).tolist() for idx in range(len(dataset))]
+    return [text.strip().lower() for text in processor.batch_decode(answers, skip_special_tokens=True)]
+
+def evaluate_lean(model, dataloader, dataset, processor, device, model_name="Model", max_new_tokens=None,
+                  ground_truths=None):
+    """
+    Exact-match evaluation with a single greedy generation pass per batch
+
+    Unlike the notebook's evaluate_model there is no extra forward pass, the
+    answer budget comes from answer_token_cap, finished sequences stop at
+    [SEP] (the batch stops once every sequence has), and ground truths are
+    decoded once up front instead of per batch.
+
+    Args:
+        model: BLIP VQA model (plain or PEFT-wrapped)
+        dataloader: DataLoader over the pre-tokenized dataset (collate_vqa)
+        dataset: The dataset behind the DataLoader
+        processor: BLIP processor
+        device: Device to evaluate on
+        model_name: Name used in progress and result messages
+        max_new_tokens: Generation budget (default: answer_token_cap(dataset))
+        ground_truths: decode_answers(dataset, processor), if already computed
+
+    Returns:
+        dict: correct, total, accuracy, predictions, ground_truths, is_correct
+            (in dataset order) and seconds
+    """
+    model.eval()
+    model.to(device)
+    if max_new_tokens is None:
+        max_new_tokens = answer_token_cap(dataset)
+    if ground_truths is None:
+        ground_truths = decode_answers(dataset, processor)
+
+    start = time.perf_counter()
+    predictions = {}
+    with torch.inference_mode():
+        for batch in tqdm(dataloader, desc=f"Evaluating {model_name}"):
+            if batch is None:
+                continue  # every image in the batch failed to load
+            batch = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+            generated_ids = batch_generate(model, batch, max_new_tokens=max_new_tokens, num_beams=1,
+                                           do_sample=False)
+            generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=True)
+            if "example_index" in batch:
+                indices = batch["example_index"].tolist()
+            else:
+                indices = range(len(predictions), len(predictions) + len(generated_texts))
+            for idx, pred in zip(indices, generated_texts):
+                predictions[idx] = pred.strip().lower()
+    seconds = time.perf_counter() - start
+
+    order = sorted(predictions)
+    results = {
+        "predictions": [predictions[idx] for idx in order],
+        "ground_truths": [ground_truths[idx] for idx in order],
+        "seconds": seconds
+    }
+    results["is_correct"] = [pred == gt for pred, gt in zip(results["predictions"], results["ground_truths"])]
+    results["correct"] = sum(results["is_correct"])
+    results["total"] = len(order)
+    results["accuracy"] = results["correct"] / results["total"] if results["total"] > 0 else 0
+    print(f"{model_name} results: {results['correct']}/{results['total']} correct, "
+          f"Accuracy: {results['accuracy']:.4f} ({seconds:.1f}s, max_new_tokens={max_new_tokens})")
+
+    return results
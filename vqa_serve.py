@@ -0,0 +1,487 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from metadata_io import iter_metadata
+from vqa_model import encode_images, vqa_generate
+
+BASE_MODEL_NAME = "Salesforce/blip-vqa-base"
+
+def load_merged_model(adapter_path, base_model_name=BASE_MODEL_NAME):
+    """
+    Load the base model with a LoRA adapter merged into its weights
+
+    Merging removes the adapter indirection, so inference costs the same
+    as the plain base model.
+
+    Args:
+        adapter_path: LoRA checkpoint (e.g. blip_lora_checkpoints/best_model_epoch_3)
+        base_model_name: Base model name or path
+
+    Returns:
+        tuple: (model, processor)
+    """
+    from peft import PeftModel
+    from transformers import AutoModelForVisualQuestionAnswering, AutoProcessor
+
+    processor = AutoProcessor.from_pretrained(base_model_name)
+    base_model = AutoModelForVisualQuestionAnswering.from_pretrained(base_model_name)
+    model = PeftModel.from_pretrained(base_model, adapter_path, is_trainable=False).merge_and_unload()
+    model.eval()
+    return model, processor
+
+class PixelCache:
+    """
+    LRU cache of preprocessed images
+
+    Product images are requested over and over; a hit skips decoding and
+    resizing. Only touched from the inference thread, so it needs no lock.
+    """
+
+    def __init__(self, image_processor, max_items=1024):
+        self.image_processor = image_processor
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """
+        pixel_values for an image, preprocessing it on a miss
+
+        Args:
+            key: Image identity (path or content hash)
+            load: Callable returning the PIL image
+
+        Returns:
+            torch.Tensor: (3, H, W) pixel values
+        """
+        pixel_values = self.items.get(key)
+        if pixel_values is not None:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return pixel_values
+        self.misses += 1
+        image = load().convert('RGB')
+        pixel_values = self.image_processor(images=image, return_tensors="pt")["pixel_values"][0]
+        self.items[key] = pixel_values
+        if len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+        return pixel_values
+
+class ImageLoadError(ValueError):
+    """A request's image could not be read or preprocessed (the client's fault, so a 400)"""
+
+class Metrics:
+    """Rolling request latencies, batch sizes and queue depth"""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.batch_seconds = deque(maxlen=window)
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.requests = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def enqueued(self):
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def dequeued(self, count):
+        self.queue_depth -= count
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {}
+        p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+        return {'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2)}
+
+    def snapshot(self, pixel_cache=None):
+        """Current metrics as a JSON-serializable dict"""
+        elapsed = time.perf_counter() - self.started
+        snapshot = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'requests_per_s': round(self.requests / elapsed, 2) if elapsed > 0 else 0,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'latency': self._percentiles(self.latencies),
+            'queue_wait': self._percentiles(self.queue_waits),
+            'batch_latency': self._percentiles(self.batch_seconds),
+            'mean_batch_size': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0
+        }
+        if pixel_cache is not None:
+            snapshot['pixel_cache'] = {'items': len(pixel_cache.items), 'hits': pixel_cache.hits,
+                                       'misses': pixel_cache.misses}
+        return snapshot
+
+class MicroBatcher:
+    """
+    Async request queue that runs concurrent requests as micro-batches
+
+    A batch is started when max_batch_size requests are waiting or when the
+    oldest one has waited max_wait_ms. Inference runs on a single worker
+    thread so the event loop keeps accepting requests meanwhile, and
+    questions about the same image in a batch share one vision encoder pass.
+
+    Usage:
+        batcher = MicroBatcher(model, processor)
+        await batcher.start()
+        answer = await batcher.submit(image_path="...", question="...")
+    """
+
+    def __init__(self, model, processor, max_batch_size=16, max_wait_ms=10, max_new_tokens=31,
+                 cache_size=1024, max_question_length=32):
+        self.model = model
+        self.processor = processor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        # Questions are truncated like at training time, so a long one can't fail its batch
+        self.max_question_length = max_question_length
+        self.pixel_cache = PixelCache(processor.image_processor, cache_size)
+        self.metrics = Metrics()
+        self._queue = None
+        self._worker = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, question, image_path=None, image_bytes=None):
+        """
+        Answer one question about an image
+
+        Args:
+            question: Question text
+            image_path: Local image file, or
+            image_bytes: Encoded image content
+
+        Returns:
+            str: Predicted answer
+        """
+        if not isinstance(question, str) or not question.strip():
+            raise ValueError("question must be a non-empty string")
+        if (image_path is None) == (image_bytes is None):
+            raise ValueError("Pass exactly one of image_path and image_bytes")
+        if image_path is not None:
+            key, load = image_path, lambda: Image.open(image_path)
+        else:
+            key = hashlib.sha256(image_bytes).hexdigest()
+            load = lambda: Image.open(io.BytesIO(image_bytes))
+        future = asyncio.get_running_loop().create_future()
+        self.metrics.enqueued()
+        await self._queue.put((time.perf_counter(), key, load, question, future))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = batch[0][0] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get_nowait() if timeout <= 0 else
+                             await asyncio.wait_for(self._queue.get(), timeout))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            self.metrics.dequeued(len(batch))
+            start = time.perf_counter()
+            for enqueued_at, *_ in batch:
+                self.metrics.queue_waits.append(start - enqueued_at)
+            try:
+                answers = await loop.run_in_executor(self._executor, self._infer,
+                                                     [(key, load, question) for _, key, load, question, _ in batch])
+            except Exception as e:
+                self.metrics.errors += len(batch)
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            self.metrics.batch_seconds.append(finished - start)
+            self.metrics.batch_sizes.append(len(batch))
+            for (enqueued_at, *_, future), answer in zip(batch, answers):
+                if isinstance(answer, Exception):
+                    # Only the request with the unreadable image fails
+                    self.metrics.errors += 1
+                    if not future.done():
+                        future.set_exception(answer)
+                    continue
+                self.metrics.latencies.append(finished - enqueued_at)
+                self.metrics.requests += 1
+                if not future.done():
+                    future.set_result(answer)
+
+    def _infer(self, requests):
+        # Runs on the worker thread: one pixel row per distinct image. Each image
+        # is loaded on its own, so a bad one only fails its own requests; the
+        # result holds an ImageLoadError in their place
+        rows = {}
+        failed = {}
+        pixel_values = []
+        for key, load, _ in requests:
+            if key in rows or key in failed:
+                continue
+            try:
+                pixel_values.append(self.pixel_cache.get(key, load))
+            except Exception as e:
+                print(f"Error loading {key}: {e}")
+                failed[key] = ImageLoadError(f"Could not read image: {e}")
+            else:
+                rows[key] = len(pixel_values) - 1
+        ok = [(key, question) for key, _, question in requests if key in rows]
+        answers = []
+        if ok:
+            image_index = [rows[key] for key, _ in ok]
+            inputs = self.processor.tokenizer([question for _, question in ok], padding=True, truncation=True,
+                                              max_length=self.max_question_length, return_tensors="pt",
+                                              return_token_type_ids=False)
+            with torch.inference_mode():
+                image_embeds = encode_images(self.model, torch.stack(pixel_values))
+                generated_ids = vqa_generate(self.model, inputs["input_ids"], inputs["attention_mask"], image_embeds,
+                                             torch.tensor(image_index, dtype=torch.long),
+                                             max_new_tokens=self.max_new_tokens)
+            answers = [text.strip().lower()
+                       for text in self.processor.batch_decode(generated_ids, skip_special_tokens=True)]
+        answers = iter(answers)
+        return [failed[key] if key in failed else next(answers) for key, *_ in requests]
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None, None, None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, body
+
+def _write_response(writer, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+
+def _parse_predict(body, image_root=None):
+    # (question, image_path, image_bytes) from a /predict body; ValueError becomes a 400
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+    # The question itself is checked by MicroBatcher.submit
+    question = request.get('question')
+    if 'image' in request:
+        if not isinstance(request['image'], str):
+            raise ValueError("image must be a base64 string")
+        return question, None, base64.b64decode(request['image'], validate=True)
+    image_path = request.get('image_path')
+    if image_path is None:
+        raise ValueError("Pass one of image and image_path")
+    if image_root is None:
+        raise ValueError("image_path is not accepted by this server; send the image as base64")
+    if not isinstance(image_path, str):
+        raise ValueError("image_path must be a string")
+    # Resolved (symlinks included) and kept under the configured root
+    root = os.path.realpath(image_root)
+    resolved = os.path.realpath(os.path.join(root, image_path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError("image_path is outside the image root")
+    return question, resolved, None
+
+async def serve(batcher, host='127.0.0.1', port=8080, image_root=None):
+    """
+    Minimal HTTP front end for a MicroBatcher
+
+    POST /predict with {"question": ..., "image_path": ...} or
+    {"question": ..., "image": <base64>} returns {"answer": ...};
+    GET /metrics returns the batcher's metrics. image_path is only
+    accepted with an image_root, and must resolve to a file under it
+    (relative paths are taken from the root).
+
+    Args:
+        batcher: Started MicroBatcher
+        host: Address to bind
+        port: Port to bind (0 picks a free one)
+        image_root: Directory clients may read images from by path (None: base64 only)
+
+    Returns:
+        asyncio.base_events.Server: The running server
+    """
+    async def handle(reader, writer):
+        try:
+            method, path, body = await _read_request(reader)
+            if method is None:
+                return
+            if method == 'GET' and path == '/metrics':
+                _write_response(writer, 200, batcher.metrics.snapshot(batcher.pixel_cache))
+            elif method == 'POST' and path == '/predict':
+                try:
+                    question, image_path, image_bytes = _parse_predict(body, image_root)
+                    answer = await batcher.submit(question, image_path=image_path, image_bytes=image_bytes)
+                except ValueError as e:
+                    _write_response(writer, 400, {'error': str(e)})
+                else:
+                    _write_response(writer, 200, {'answer': answer})
+            else:
+                _write_response(writer, 404, {'error': f"No route for {method} {path}"})
+        except Exception as e:
+            _write_response(writer, 500, {'error': str(e)})
+        finally:
+            await writer.drain()
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+async def _post(host, port, payload):
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(f"POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, json.loads(body)
+
+async def run_load_test(host, port, requests, concurrency=16):
+    """
+    Fire requests at a running server with a fixed number in flight
+
+    Args:
+        host: Server host
+        port: Server port
+        requests: List of (image_path, question, expected answer)
+        concurrency: Requests in flight at once
+
+    Returns:
+        dict: Client-side latency percentiles, throughput and exact-match accuracy
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    correct = 0
+    errors = 0
+
+    async def one(image_path, question, expected):
+        nonlocal correct, errors
+        async with semaphore:
+            start = time.perf_counter()
+            status, response = await _post(host, port, {'image_path': image_path, 'question': question})
+            latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors += 1
+        elif response['answer'] == expected.strip().lower():
+            correct += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*request) for request in requests))
+    elapsed = time.perf_counter() - start
+    report = {
+        'requests': len(requests),
+        'errors': errors,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 2),
+        'requests_per_s': round(len(requests) / elapsed, 2) if elapsed > 0 else 0,
+        'latency': Metrics._percentiles(latencies),
+        'accuracy': round(correct / len(requests), 4) if requests else 0
+    }
+    return report
+
+def load_requests(qa_file, base_path, batch_name, limit=None):
+    """
+    (image_path, question, answer) for every QA pair of a batch
+
+    Args:
+        qa_file: batchN_qa_dataset file
+        base_path: Base path holding the batch's image folder
+        batch_name: Batch folder name (e.g. 'batch4')
+        limit: Maximum number of requests
+
+    Returns:
+        list: Requests in file order
+    """
+    requests = []
+    for item in iter_metadata(qa_file):
+        image_path = os.path.join(base_path, batch_name, item['image_filename'])
+        for qa_pair in item['qa_pairs']:
+            requests.append((image_path, qa_pair['question'], qa_pair['answer']))
+    return requests[:limit] if limit else requests
+
+async def _main(args):
+    model, processor = load_merged_model(args.adapter, args.base_model)
+    batcher = MicroBatcher(model, processor, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                           max_new_tokens=args.max_new_tokens, cache_size=args.cache_size)
+    await batcher.start()
+    # The load test sends paths under --base-path
+    image_root = args.image_root or (args.base_path if args.command == 'bench' else None)
+    server = await serve(batcher, args.host, args.port, image_root)
+    port = server.sockets[0].getsockname()[1]
+    print(f"Serving on http://{args.host}:{port} (POST /predict, GET /metrics)")
+    try:
+        if args.command == 'serve':
+            await server.serve_forever()
+        else:
+            requests = [(os.path.abspath(image_path), question, answer) for image_path, question, answer
+                        in load_requests(args.qa_file, args.base_path, args.batch_name, args.limit)]
+            print(f"Load test: {len(requests)} requests, {args.concurrency} in flight")
+            report = await run_load_test(args.host, port, requests, args.concurrency)
+            report['server'] = batcher.metrics.snapshot(batcher.pixel_cache)
+            print(json.dumps(report, indent=2))
+    finally:
+        server.close()
+        await batcher.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching inference server for the LoRA BLIP-VQA model")
+    parser.add_argument('command', choices=['serve', 'bench'], help="Run the server, or run it and load-test it")
+    parser.add_argument('--adapter', required=True, help="LoRA checkpoint to merge (e.g. blip_lora_checkpoints/best_model_epoch_3)")
+    parser.add_argument('--base-model', default=BASE_MODEL_NAME)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--max-new-tokens', type=int, default=31)
+    parser.add_argument('--cache-size', type=int, default=1024, help="Preprocessed images kept in memory")
+    parser.add_argument('--image-root', help="Directory clients may send image_path requests for "
+                                             "(default: base64 images only; --base-path for bench)")
+    parser.add_argument('--qa-file', default="batch4_qa_dataset.json", help="Requests for the load test")
+    parser.add_argument('--base-path', default=".", help="Directory holding the batch image folders")
+    parser.add_argument('--batch-name', default="batch4")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--limit', type=int, help="Only send the first N requests")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,420 @@
+import csv
+import gc
+import json
+import os
+import time
+from pathlib import Path
+
+import torch
+from tqdm.auto import tqdm
+
+from vqa_checkpoint import (AsyncCheckpointer, ResumableSampler, latest_checkpoint, load_checkpoint, rng_state,
+                            set_rng_state)
+from vqa_model import batch_loss
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TIMELINE_FIELDS = ['epoch', 'step', 'global_step', 'samples', 'loss', 'data_wait_s', 'forward_s', 'backward_s',
+                   'optimizer_s', 'step_s', 'samples_per_s', 'peak_memory_mb']
+_INT_FIELDS = {'epoch', 'step', 'global_step', 'samples'}
+
+def _peak_memory_mb(device):
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1024 ** 2
+    if resource is not None:
+        # Peak RSS of the process (KB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+class TrainingTelemetry:
+    """
+    Per-step timings of the training loop
+
+    Each step is split into waiting for the DataLoader, forward, backward
+    and optimizer time. On CUDA the device is synchronized at every phase
+    boundary so the split reflects GPU work rather than kernel launches.
+    Peak memory is the CUDA allocator's peak for the step, or the process'
+    peak RSS on CPU.
+
+    Usage:
+        telemetry = TrainingTelemetry(device)
+        for batch in telemetry.iterate(dataloader):
+            with telemetry.phase('forward'):
+                loss = ...
+            ...
+            telemetry.end_step(epoch, step, samples, loss_value, global_step=global_step)
+        telemetry.save(checkpoint_dir)
+    """
+
+    def __init__(self, device, sync=None):
+        self.device = torch.device(device)
+        self.sync = self.device.type == 'cuda' if sync is None else sync
+        self.rows = []
+        self._current = {}
+        self._step_start = None
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+    def iterate(self, iterable):
+        """Yield from a DataLoader, timing how long each batch took to arrive"""
+        iterator = iter(iterable)
+        while True:
+            start = self._now()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._step_start = start
+            self._current = {'data_wait_s': time.perf_counter() - start}
+            if self.device.type == 'cuda':
+                torch.cuda.reset_peak_memory_stats(self.device)
+            yield batch
+
+    def phase(self, name):
+        """Context manager timing one phase ('forward', 'backward', 'optimizer')"""
+        return _Phase(self, f"{name}_s")
+
+    def end_step(self, epoch, step, samples, loss=None, global_step=None):
+        """
+        Record the step that just finished
+
+        global_step is the training loop's 1-based step counter, so the
+        timeline lines up with profiler windows and resumed runs; without it
+        steps are numbered from 1 in the order they were recorded.
+        """
+        elapsed = self._now() - self._step_start
+        row = {field: None for field in TIMELINE_FIELDS}
+        row.update(self._current)
+        peak = _peak_memory_mb(self.device)
+        row.update({
+            'epoch': epoch,
+            'step': step,
+            'global_step': len(self.rows) + 1 if global_step is None else global_step,
+            'samples': samples,
+            'loss': loss,
+            'step_s': elapsed,
+            'samples_per_s': samples / elapsed if elapsed > 0 else None,
+            'peak_memory_mb': round(peak, 1) if peak is not None else None
+        })
+        self.rows.append(row)
+        return row
+
+    def summary(self):
+        """Totals over all recorded steps, and where the time went"""
+        if not self.rows:
+            return {'steps': 0}
+        total = {field: sum(row[field] or 0 for row in self.rows)
+                 for field in ('samples', 'data_wait_s', 'forward_s', 'backward_s', 'optimizer_s', 'step_s')}
+        summary = {
+            'steps': len(self.rows),
+            'samples': total['samples'],
+            'seconds': round(total['step_s'], 3),
+            'samples_per_s': round(total['samples'] / total['step_s'], 2) if total['step_s'] > 0 else None,
+            'peak_memory_mb': max((row['peak_memory_mb'] or 0) for row in self.rows)
+        }
+        for field in ('data_wait_s', 'forward_s', 'backward_s', 'optimizer_s'):
+            summary[f"{field[:-2]}_fraction"] = round(total[field] / total['step_s'], 4) if total['step_s'] > 0 else None
+        return summary
+
+    def save(self, output_dir, name="training_timeline"):
+        """
+        Write the timeline (CSV) and summary (JSON) to output_dir
+
+        Returns:
+            tuple: (csv path, json path)
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        csv_path = os.path.join(output_dir, f"{name}.csv")
+        json_path = os.path.join(output_dir, f"{name}_summary.json")
+        tmp_path = f"{csv_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=TIMELINE_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+        os.replace(tmp_path, csv_path)
+        tmp_path = f"{json_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_path, json_path)
+        return csv_path, json_path
+
+    def restore(self, output_dir, max_global_step, name="training_timeline"):
+        """
+        Reload the steps an earlier run saved, up to a resumed checkpoint
+
+        Steps after max_global_step are dropped: they are trained again.
+
+        Returns:
+            int: Number of steps restored
+        """
+        csv_path = os.path.join(output_dir, f"{name}.csv")
+        if not os.path.exists(csv_path):
+            return 0
+        rows = []
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            for saved in csv.DictReader(f):
+                row = {field: None if saved.get(field) in (None, '') else
+                       int(saved[field]) if field in _INT_FIELDS else float(saved[field])
+                       for field in TIMELINE_FIELDS}
+                if row['global_step'] is not None and row['global_step'] <= max_global_step:
+                    rows.append(row)
+        self.rows = rows + self.rows
+        return len(rows)
+
+class _Phase:
+    def __init__(self, telemetry, field):
+        self.telemetry = telemetry
+        self.field = field
+
+    def __enter__(self):
+        self.start = self.telemetry._now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.telemetry._current[self.field] = self.telemetry._now() - self.start
+
+class ProfilerWindow:
+    """
+    Run torch.profiler for global steps [start, stop) only
+
+    Steps are the training loop's 1-based global steps, the same numbers the
+    telemetry timeline records. A run resumed inside the window profiles
+    the rest of it.
+
+    The trace is written as a Chrome trace (open in chrome://tracing or
+    Perfetto) and the top operators are printed when the window closes.
+    """
+
+    def __init__(self, start, stop, output_dir, device):
+        self.start = start
+        self.stop = stop
+        self.output_dir = output_dir
+        self.activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.device(device).type == 'cuda':
+            self.activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._profiler = None
+        self._done = False
+
+    def before_step(self, global_step):
+        if self.start <= global_step < self.stop and self._profiler is None and not self._done:
+            self._profiler = torch.profiler.profile(activities=self.activities, record_shapes=True,
+                                                    profile_memory=True)
+            self._profiler.__enter__()
+
+    def after_step(self, global_step):
+        if self._profiler is not None and global_step + 1 >= self.stop:
+            self.close()
+
+    def close(self):
+        if self._profiler is None:
+            return
+        self._profiler.__exit__(None, None, None)
+        os.makedirs(self.output_dir, exist_ok=True)
+        trace_path = os.path.join(self.output_dir, f"profile_steps_{self.start}_{self.stop}.json")
+        self._profiler.export_chrome_trace(trace_path)
+        sort_by = 'cuda_time_total' if len(self.activities) > 1 else 'cpu_time_total'
+        print(self._profiler.key_averages().table(sort_by=sort_by, row_limit=15))
+        print(f"Profiler trace saved to {trace_path}")
+        self._profiler = None
+        self._done = True
+
+def _batch_samples(batch):
+    return len(batch["input_ids"])
+
+def _resumable_sampler(dataloader):
+    """The DataLoader's ResumableSampler and whether it yields whole batches"""
+    if isinstance(dataloader.batch_sampler, ResumableSampler):
+        return dataloader.batch_sampler, True
+    if isinstance(dataloader.sampler, ResumableSampler):
+        return dataloader.sampler, False
+    return None, False
+
+def train(model, dataloader, optimizer, device, num_epochs=3, checkpoint_dir="blip_lora_checkpoints",
+          gc_every=None, profile_steps=None, checkpoint_every=None, keep_last=3, resume=None):
+    """
+    Trains the model for a specified number of epochs.
+
+    Same loop and checkpoints as the notebook's train, with per-step
+    telemetry written next to the checkpoints (training_timeline.csv and
+    training_timeline_summary.json). Works with plain and image-grouped
+    batches (see vqa_model.batch_loss).
+
+    With checkpoint_every, the trainable weights, optimizer state, position
+    in the data order and RNG states are saved every N steps (and at the
+    end of each epoch) under checkpoint_dir/steps, in the background. A run
+    started with resume continues from the exact step; for that the
+    DataLoader should use a ResumableSampler (as sampler or batch_sampler),
+    otherwise the interrupted epoch's remaining batches are drawn afresh.
+    The timeline is restored up to the checkpoint too. A run started without
+    resume deletes any step checkpoints already under checkpoint_dir/steps.
+
+    Args:
+        model: The PyTorch model to train.
+        dataloader: The DataLoader for the training data.
+        optimizer: The optimizer to use for training.
+        device: The device (CPU or CUDA) to train on.
+        num_epochs: The number of epochs to train for.
+        checkpoint_dir: Where adapters and the timeline are saved.
+        gc_every: Run gc.collect() / empty_cache() every N steps (off by
+            default; the notebook used 100).
+        profile_steps: Optional (start, stop) global steps (1-based, stop
+            excluded) to run the PyTorch profiler for.
+        checkpoint_every: Save a resumable checkpoint every N steps.
+        keep_last: Number of step checkpoints to keep.
+        resume: True for the latest step checkpoint, or a step checkpoint path.
+
+    Returns:
+        The trained model.
+    """
+    model.train()  # Set the model to training mode
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    device = torch.device(device)
+    steps_dir = checkpoint_dir / "steps"
+
+    telemetry = TrainingTelemetry(device)
+    profiler = ProfilerWindow(*profile_steps, checkpoint_dir, device) if profile_steps else None
+    checkpointer = AsyncCheckpointer(steps_dir, keep_last) if checkpoint_every else None
+    sampler, batch_mode = _resumable_sampler(dataloader)
+
+    resume_rng = None
+    state = {'epoch': 0, 'position': 0, 'global_step': 0, 'best_loss': float("inf"), 'best_epoch': -1,
+             'total_loss': 0.0, 'step_count': 0}
+    if resume:
+        resume_path = latest_checkpoint(steps_dir) if resume is True else resume
+        if resume_path is None:
+            print(f"No step checkpoint in {steps_dir}, starting from scratch")
+        else:
+            state.update(load_checkpoint(resume_path, model, optimizer))
+            # Creating the DataLoader iterator draws from the torch RNG, so the
+            # checkpoint's RNG state is applied again right before the first step
+            resume_rng = rng_state()
+            print(f"Resuming from {resume_path}: epoch {state['epoch']+1}, step {state['step_count']}")
+            # The timeline continues from the checkpoint instead of starting over
+            telemetry.restore(checkpoint_dir, state['global_step'])
+    if checkpointer is not None:
+        # Step checkpoints beyond the starting point (all of them on a fresh run)
+        # belong to another run; keep_last would otherwise prune this run's instead
+        checkpointer.discard(after=state['global_step'])
+
+    def save_checkpoint():
+        checkpointer.save(state['global_step'], model, optimizer, state)
+        # Saved with each checkpoint so a resume finds every step up to it
+        telemetry.save(checkpoint_dir)
+
+    try:
+        for epoch in range(state['epoch'], num_epochs):
+            if epoch != state['epoch']:
+                state.update(epoch=epoch, position=0, total_loss=0.0, step_count=0)
+            skip = 0
+            if sampler is not None:
+                sampler.set_epoch(epoch, state['position'])
+            elif state['position']:
+                skip = state['step_count']
+                print(f"DataLoader has no ResumableSampler: skipping {skip} batches of a new order")
+
+            resumed = state['step_count'] if sampler is not None else 0
+            progress_bar = tqdm(dataloader, desc=f"Epoch {epoch+1}/{num_epochs}", unit="batch",
+                                initial=resumed, total=resumed + len(dataloader))
+
+            for batch in telemetry.iterate(progress_bar):
+                if batch is None:
+                    # Every image in the batch failed to load; its samples still count as consumed
+                    state['position'] += 1 if batch_mode else dataloader.batch_size
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                if resume_rng is not None:
+                    set_rng_state(resume_rng)
+                    resume_rng = None
+                # 1-based and carried over by resume, for both the profiler and the timeline
+                global_step = state['global_step'] + 1
+                if profiler is not None:
+                    profiler.before_step(global_step)
+
+                try:
+                    # Move batch data to the specified device
+                    batch = {k: v.to(device) for k, v in batch.items()}
+
+                    with telemetry.phase('forward'):
+                        loss = batch_loss(model, batch)
+
+                    with telemetry.phase('backward'):
+                        loss.backward()
+
+                    with telemetry.phase('optimizer'):
+                        optimizer.step()
+                        optimizer.zero_grad()
+
+                    # One host sync per step
+                    loss_value = loss.item()
+                    state['total_loss'] += loss_value
+                    state['step_count'] += 1
+                    telemetry.end_step(epoch + 1, state['step_count'], _batch_samples(batch), loss_value,
+                                       global_step=global_step)
+
+                    # Update progress bar
+                    progress_bar.set_postfix({"loss": f"{loss_value:.4f}"})
+
+                    if gc_every and state['step_count'] % gc_every == 0:
+                        gc.collect()
+                        torch.cuda.empty_cache()
+
+                except RuntimeError as e:
+                    print(f"❗ Runtime error at step {state['step_count']} in epoch {epoch+1}: {e}")
+
+                    # Clean up CUDA memory if an error occurs
+                    optimizer.zero_grad()
+                    torch.cuda.empty_cache()
+                    gc.collect()
+
+                    continue  # Skip to the next batch
+                finally:
+                    # The batch counts as consumed either way
+                    # Sampler positions count what the sampler yielded, including examples collate dropped
+                    state['position'] += 1 if batch_mode else (dataloader.batch_size or _batch_samples(batch))
+                    state['global_step'] = global_step
+                    if profiler is not None:
+                        profiler.after_step(global_step)
+
+                if checkpointer is not None and state['global_step'] % checkpoint_every == 0:
+                    save_checkpoint()
+
+            avg_loss = state['total_loss'] / state['step_count'] if state['step_count'] > 0 else float('inf')
+            print(f"\n📘 Epoch {epoch + 1} completed. Average Training Loss: {avg_loss:.4f}")
+
+            # Save model checkpoint if it's the best one so far
+            if avg_loss < state['best_loss']:
+                print(f"✅ New best model! Average loss improved from {state['best_loss']:.4f} to {avg_loss:.4f}. Saving...")
+                state['best_loss'] = avg_loss
+                state['best_epoch'] = epoch + 1
+                model.save_pretrained(checkpoint_dir / f"best_model_epoch_{epoch+1}")
+
+            # Save checkpoint for each epoch
+            model.save_pretrained(checkpoint_dir / f"checkpoint_epoch_{epoch+1}")
+            telemetry.save(checkpoint_dir)
+            print(f"⏱️ {json.dumps(telemetry.summary())}")
+
+            # Resume point at the start of the next epoch
+            state.update(epoch=epoch + 1, position=0, total_loss=0.0, step_count=0)
+            if checkpointer is not None:
+                save_checkpoint()
+
+            # Clean up memory
+            torch.cuda.empty_cache()
+            gc.collect()
+    finally:
+        if checkpointer is not None:
+            checkpointer.close()
+        if profiler is not None:
+            profiler.close()
+
+    print(f"\n🎉 Training finished. Best model from epoch {state['best_epoch']} with average loss {state['best_loss']:.4f}.")
+    return model